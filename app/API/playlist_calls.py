@@ -22,12 +22,21 @@
            "Jelle Witsen Elias"
 """
 
+import requests
 from flask_restplus import Namespace, Resource, fields
 
-from app.utils import spotify
+from app import app
+from app.utils import spotify, spotify_async
+from app.utils.cache import TTLCache
+from app.utils.exceptions import CircuitOpenError, RateLimitedError, StatusCodeError
+from app.utils.models import User
+from app.utils.tasks import analyse_playlists
 
 api = Namespace('playlist', description='playlist', path="/playlist")
 
+# The last playlists fetched per user, served when Spotify is unavailable.
+_playlists = TTLCache(app.config.get('PLAYLIST_FALLBACK_SIZE', 1024), app.config.get('PLAYLIST_FALLBACK_TTL', 86400))
+
 
 @api.route('list/<string:userid>')
 class PlaylistList(Resource):
@@ -51,10 +60,71 @@ class PlaylistList(Resource):
     })
 
     @api.marshal_with(playlists, envelope='resource')
+    @api.response(404, 'User not found')
+    @api.response(503, 'Spotify is unavailable')
     def get(self, userid):
         """Get a list playlists"""
-        playlists = spotify.get_playlists(userid)
+        if User.get_user(userid) is None:
+            api.abort(404, message=f"User '{userid}' not found")
+
+        try:
+            playlists = list(spotify_async.iter_playlists(userid))
+            _playlists.put(userid, playlists)
+        except (CircuitOpenError, RateLimitedError, requests.exceptions.RequestException, StatusCodeError):
+            playlists = _playlists.get(userid)
+            if playlists is None:
+                api.abort(503, message=f"Spotify is unavailable, no playlists of '{userid}' are cached")
+
         return {
             'userid': userid,
             'playlists': playlists
         }
+
+
+@api.route('mood/<string:userid>/<string:playlistids>')
+@api.response(404, 'No playlists found')
+@api.response(503, 'Spotify is unavailable')
+class PlaylistMood(Resource):
+    """
+    Analyse the moods of the tracks of one or more playlists.
+    :param userid: Unique identifier for a user.
+    :param playlistids: Comma separated list of playlist ids.
+    """
+
+    # Output format
+    track_mood = api.model('Playlist track mood', {
+        'songid': fields.String,
+        'name': fields.String,
+        'excitedness': fields.Float,
+        'happiness': fields.Float
+    })
+    playlist_mood = api.model('Playlist mood', {
+        'playlistid': fields.String,
+        'excitedness': fields.Float,
+        'happiness': fields.Float,
+        'track_count': fields.Integer,
+        'tracks': fields.List(fields.Nested(track_mood))
+    })
+    moods = api.model('Playlists moods', {
+        'userid': fields.String,
+        'excitedness': fields.Float,
+        'happiness': fields.Float,
+        'playlists': fields.List(fields.Nested(playlist_mood))
+    })
+
+    @api.marshal_with(moods, envelope='resource')
+    def get(self, userid, playlistids):
+        """Get the mood per track and the mean mood of playlists"""
+        playlistids = [playlistid for playlistid in playlistids.split(',') if playlistid]
+        if not playlistids:
+            api.abort(404, message=f"No playlists given for '{userid}'")
+        if User.get_user(userid) is None:
+            api.abort(404, message=f"User '{userid}' not found")
+
+        try:
+            access_token = spotify.get_access_token(User.get_refresh_token(userid))
+            moods = analyse_playlists(access_token, playlistids)
+        except (CircuitOpenError, RateLimitedError, requests.exceptions.RequestException, StatusCodeError):
+            api.abort(503, message="Spotify is unavailable, try again later")
+
+        return dict(moods, userid=userid)
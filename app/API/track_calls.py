@@ -22,8 +22,8 @@
 
 from flask_restplus import Namespace, Resource, fields
 
-from app import app
 from app.utils import influx, models
+from app.utils.history import get_store
 from app.utils.recommendations import recommend_input, recommend_metric
 
 api = Namespace('tracks', description='Information about tracks (over time)', path="/tracks")
@@ -38,21 +38,20 @@ def get_history(userid, song_count, return_songids=False, calc_mood=True):
     :param calc_mood: Calculate the average excitedness and happiness.
     :return: Average of happiness and happiness, list of dictionary containing songs.
     """
-    client = influx.create_client(app.config['INFLUX_HOST'], app.config['INFLUX_PORT'])
-
-    recent_songs = influx.get_songs(client, userid, song_count)
+    # Remove duplicate songs while streaming the history, keeping the time of the latest listen.
+    recent_songs = {}
+    for song in get_store().iter_songs(userid, song_count):
+        recent_songs.setdefault(song['songid'], song['time'])
 
     if recent_songs:
         history = []
-        # Remove duplicates songs
-        songids = [song['songid'] for song in recent_songs]
-        songids = songids[:song_count] if song_count > 0 else songids
+        songids = list(recent_songs.keys())
         songmoods = models.Songmood.get_moods(songids)
         excitedness = 0
         happiness = 0
         count = 1
 
-        for i, songmood in enumerate(songmoods):
+        for songmood in songmoods:
             if calc_mood and songmood.excitedness and songmood.happiness:
                 excitedness += songmood.excitedness
                 happiness += songmood.happiness
@@ -62,7 +61,7 @@ def get_history(userid, song_count, return_songids=False, calc_mood=True):
                 song = {'songid': songmood.songid,
                         'excitedness': songmood.excitedness,
                         'happiness': songmood.happiness,
-                        'time': recent_songs[i]['time'],
+                        'time': recent_songs[songmood.songid],
                         'name': models.Song.get_song_name(songmood.songid)}
                 history.append(song)
 
@@ -125,6 +124,7 @@ class History(Resource):
     })
 
     @api.marshal_with(history, envelope='resource')
+    @models.read_only
     def get(self, userid, song_count):
         """
         Obtain song_count most recently played songs along with their mood.
@@ -142,11 +142,13 @@ class History(Resource):
 
 
 @api.route('/topsongs/<string:userid>/<string:song_count>')
+@api.route('/topsongs/<string:userid>/<string:song_count>/<string:duration>')
 class TopSongs(Resource):
     """
     Return the top songs of a user by counting the number of listens.
     :param userid: Unique identifier for a user
     :param song_count: Specifies how many songs of the history to return
+    :param duration: Limits the time frame in which the listens are counted (i.e. 1h, 1d, 1w etc).
     """
     # Output format
     top_songs = api.model('Song history with mood', {
@@ -160,24 +162,77 @@ class TopSongs(Resource):
     })
 
     @api.marshal_with(top_songs, envelope='resource')
-    def get(self, userid, song_count):
-        """Get the top N genres of the user."""
-        client = influx.create_client(app.config['INFLUX_HOST'], app.config['INFLUX_PORT'])
-
-        recent_songs = influx.get_songs(client, userid)
+    @api.response(400, 'Invalid song count or duration')
+    @models.read_only
+    def get(self, userid, song_count, duration=None):
+        """Get the top N songs of the user."""
+        try:
+            valid = str(song_count).isdigit() and (not duration or influx.check_duration(duration))
+        except ValueError:
+            valid = False
+        if not valid:
+            api.abort(400, message=f"Invalid song count '{song_count}' or duration '{duration}', "
+                                   f"durations are numbers with a unit (i.e. 1h, 1d, 1w or 1h30m)")
+
+        # Verified counters cover the entire history, time frames and unverified counters are counted by the history
+        # store instead.
+        if not duration and models.User.get_counts_verified(userid):
+            top_songs = dict(models.SongCount.get_top(userid, int(song_count)))
+        else:
+            top_songs = dict(get_store().get_top_songs(userid, int(song_count), duration))
 
-        if not recent_songs:
+        if not top_songs:
             api.abort(404, message=f"No history found for '{userid}'")
 
-        songids = [song['songid'] for song in recent_songs]
-        result = models.Song.get_songs_with_mood(songids)
-        counted_songs = sorted([((song, songmood), songids.count(song.songid)) for song, songmood in result],
-                               key=lambda val: val[1], reverse=True)
-        top_x = counted_songs[:int(song_count)]
+        result = models.Song.get_songs_with_mood(list(top_songs.keys()))
+        counted_songs = sorted(result, key=lambda val: top_songs[val[0].songid], reverse=True)
+
+        return {
+            'userid': userid,
+            'songs': [{**song.__dict__, **songmood.__dict__} for song, songmood in counted_songs]
+        }
+
+
+@api.route('/topartists/<string:userid>/<int:artist_count>')
+@api.response(404, 'No artists found')
+class TopArtists(Resource):
+    """
+    Return the top artists of a user by counting the number of listens.
+    :param userid: Unique identifier for a user
+    :param artist_count: Specifies how many artists to return
+    """
+    # Output format
+    top_artists = api.model('Top artists', {
+        'userid': fields.String,
+        'artists': fields.Nested(api.model('artist', {
+            'artistid': fields.String,
+            'name': fields.String,
+            'genres': fields.String,
+            'popularity': fields.Integer,
+            'count': fields.Integer
+        }))
+    })
+
+    @api.marshal_with(top_artists, envelope='resource')
+    @models.read_only
+    def get(self, userid, artist_count):
+        """Get the top N artists of the user."""
+        if models.User.get_counts_verified(userid):
+            top_artists = dict(models.ArtistCount.get_top(userid, artist_count))
+        else:
+            # The counters do not cover the entire history yet, so the artists are counted from it.
+            artist_counts = models.SongArtist.count_artists(get_store().get_song_counts(userid))
+            top_artists = dict(artist_counts.most_common(artist_count))
+
+        if not top_artists:
+            api.abort(404, message=f"No artists found for '{userid}'")
+
+        artists = sorted(models.Artist.get_artists(list(top_artists.keys())),
+                         key=lambda artist: top_artists[artist.artistid], reverse=True)
 
         return {
             'userid': userid,
-            'songs': [{**song.__dict__, **songmood.__dict__} for (song, songmood), count in top_x]
+            'artists': [{**artist.__dict__, 'count': top_artists[artist.artistid]} for artist in artists]
         }
 
 
@@ -215,6 +270,7 @@ class Metric(Resource):
     })
 
     @api.marshal_with(metrics, envelope='resource')
+    @models.read_only
     def get(self, userid, song_count=0):
         """
         Obtain metrics and mood of a user for given number of songs.
@@ -265,7 +321,7 @@ class RecommendationSong(Resource):
         :param excitedness: Excitedness of the song specified by songid.
         :param happiness: happiness of the song specified by songid.
         """
-        recs = recommend_input([songid], userid, target=(float(excitedness), float(happiness)))
+        recs = recommend_input([songid], target=(float(excitedness), float(happiness)))
 
         if recs:
             return {
@@ -285,7 +341,7 @@ class RecommendationMetric(Resource):
         Obtain recommendations based on an metric selected by user.
         """
         excitedness, happiness, songids = get_history(userid, 0, return_songids=True)
-        recs = recommend_metric(songids[:6], userid, metric, excitedness, happiness)
+        recs = recommend_metric(songids[:6], metric, excitedness, happiness)
 
         if recs:
             return {
@@ -25,8 +25,7 @@ from collections import defaultdict, Counter
 
 from flask_restplus import Namespace, Resource, fields
 
-from app import app
-from app.utils import influx, models
+from app.utils import history, models, tasks
 
 api = Namespace('user', description='Information about user (over time)', path="/user")
 
@@ -53,6 +52,7 @@ class User(Resource):
     })
 
     @api.marshal_with(user_info, envelope='resource')
+    @models.read_only
     def get(self, userid):
         """
         Obtain all profile information of the user specified by userid.
@@ -64,29 +64,17 @@ class User(Resource):
         return user
 
 
-def valid_hour(time, start_hour, end_hour):
+def get_listen_averages(listens):
     """
-    Check if the time if correct.
-    :param time: Time in hours as string.
-    :param start_hour: Starting time in hours as int.
-    :param end_hour: Ending time in hours as int.
-    :return: Boolean specifying if time is valid.
+    Averages the moods and features of listens per time bucket, every listen counts like in the mood rollups.
+    :param listens: dict formatted as {bucket: Counter({songid: listen count, ...})}.
+    :return: dict formatted as {bucket: {metric: average}}, buckets without songs with a mood are left out.
     """
+    metrics = tasks.get_listen_metrics(set(songid for songs in listens.values() for songid in songs))
+    totals = tasks.sum_listen_metrics([(bucket, songid, count) for bucket, songs in listens.items()
+                                       for songid, count in songs.items()], metrics)
 
-    mood_time = time.split(".")[0]
-    mood_time = datetime.datetime.strptime(mood_time[:-1], '%Y-%m-%dT%H:%M:%S')
-    mood_hour = mood_time.hour
-
-    if start_hour <= mood_hour <= end_hour:
-        return True
-    return False
-
-
-def convert_none(dicti):
-    for key, value in dicti.items():
-        if not value:
-            dicti[key] = 0
-    return dicti
+    return {bucket: models.MoodRollup.get_total_averages(total) for bucket, total in totals.items()}
 
 
 @api.route('/mood/hourly/<string:userid>/<int:start>/<int:end>')
@@ -124,6 +112,7 @@ class HourlyMood(Resource):
     })
 
     @api.marshal_with(hourly_mood, envelope='resource')
+    @models.read_only
     def get(self=None, userid="snipy12", start=3, end=24, endoftime=False):
         """
         Obtain moods of a user within a given time frame as averages per hour.
@@ -138,79 +127,33 @@ class HourlyMood(Resource):
         if end > 24 or end < 1:
             api.abort(400, msg="Timeframe incorrect: end time not between 1 - 24")
 
-        client = influx.create_client(app.config['INFLUX_HOST'], app.config['INFLUX_PORT'])
-        songs = influx.get_songs(client, userid)
-
-        if songs:
-            # Extract all songs that fit within the time-frame specified.
-            relevantSongs = [val for val in songs if valid_hour(val['time'], start, end)]
+        if models.User.get_rollups_verified(userid):
+            return {"userid": userid,
+                    "hours": [dict(rollup.get_averages(), hour=rollup.bucket)
+                              for rollup in models.HourlyRollup.get_hours(userid, start, end)]}
 
-            # Create a dictionary of lists to store the songid's per hour
-            # Thus {"Time":[songids,....]}
-            resultDict = defaultdict(list)
+        # Rollups of users that were not rebuilt from their history yet can be partial, so the history is used,
+        # averaged per listen like the rollups.
+        # Thus {hour: Counter({songid: listen count, ...})}
+        listens = defaultdict(Counter)
+        has_history = False
 
-            # For each {songid,time} in the list
-            for song in relevantSongs:
-                mood_time = song['time'].split(".")[0]
-                mood_time = datetime.datetime.strptime(mood_time[:-1], '%Y-%m-%dT%H:%M:%S')
-                mood_hour = mood_time.hour
+        # The times are returned in seconds since the epoch (UTC), so the hour does not have to be parsed.
+        for times, songids in history.get_store().iter_songs(userid, epoch='s', columns=True):
+            has_history = True
+            for time, songid in zip(times, songids):
+                mood_hour = time // 3600 % 24
 
                 if start <= mood_hour <= end:
-                    # Add the songid to the dictionary
-                    resultDict[mood_hour].append(song['songid'])
-
-            results = []
-            # With the list of IDs with corresponding hour and features.
-            for time, songid_list in resultDict.items():
-                # Obtain the metrics for each song inside a list of songs.
-                songs = models.Song.get_songs_with_mood(songid_list)
-
-                tempresults = []
-
-                for song in songs:
-                    # We want both the mood and metrics thus we convert the object to a dictionary and combine them
-                    # Then we pop the keys of said dictionary.
-                    temp1 = ((song[0].__dict__))
-                    temp2 = ((song[1].__dict__))
-                    combineddict = {**temp1, **temp2}
-                    combineddict.pop("name")
-                    combineddict.pop("_sa_instance_state")
-                    combineddict.pop("songid")
-
-                    # Add the metrics of a SINGLE song to the temporary result
-                    tempresults.append(combineddict)
-
-                # As we are interested in the average we store the count of this list
-                count = len(tempresults)
-                # Remove the first element, which will be used for addition
-                A = Counter(tempresults.pop(0))
-                A = convert_none(A)
-                # Now iterate over each song's metrics within the results and add the values using counter.
-                for B in tempresults:
-                    B = Counter(B)
-                    B = convert_none(B)
-                    try:
-                        A = A + B
-                    except TypeError:
-                        count -= 1
-
-                # Convert these to averages by dividing each key if possible
-                for key, value in A.items():
-                    if value:
-                        A[key] = value / count
-                    else:
-                        A[key] = 0
-
-                # Add hour key for correct output format and append to results
-                A['hour'] = time
-                results.append(A)
-
-            return {"userid": userid,
-                    "hours": results}
+                    listens[mood_hour][songid] += 1
 
-        else:
+        if not has_history:
             api.abort(404, msg=f"No moods found for '{userid}'")
 
+        averages = get_listen_averages(listens)
+        return {"userid": userid,
+                "hours": [dict(averages[hour], hour=hour) for hour in sorted(averages)]}
+
 
 @api.route('/mood/daily/<string:userid>/<int:day_count>')
 @api.response(400, 'Invalid date')
@@ -245,72 +188,36 @@ class DailyMood(Resource):
     })
 
     @api.marshal_with(daily_mood, envelope='resource')
+    @models.read_only
     def get(self=None, userid="snipy12", day_count=5):
         """
         Obtain average metrics and mood per day of user, going back day_count days.
         """
-
-        client = influx.create_client(app.config['INFLUX_HOST'], app.config['INFLUX_PORT'])
-        songs = influx.get_songs(client, userid)
-
-        if songs:
-            # Create a dictionary of lists to store the songid's per hour
-            # Thus {"Time":[songids,....]}
-            resultDict = defaultdict(list)
-
-            # For each {songid,time} in the list
-            for song in songs:
-                mood_time = song['time'].split(".")[0][:10]
-                resultDict[mood_time].append(song['songid'])
-
-            results = []
-            # With the list of IDs with corresponding hour and features.
-            for time, songid_list in list(resultDict.items())[:day_count]:
-                # Obtain the metrics for each song inside a list of songs.
-                songs = models.Song.get_songs_with_mood(songid_list)
-
-                tempresults = []
-
-                for song in songs:
-                    # We want both the mood and metrics thus we convert the object to a dictionary and combine them
-                    # Then we pop the keys of said dictionary.
-                    temp1 = ((song[0].__dict__))
-                    temp2 = ((song[1].__dict__))
-                    combineddict = {**temp1, **temp2}
-                    combineddict.pop("name")
-                    combineddict.pop("_sa_instance_state")
-                    combineddict.pop("songid")
-
-                    # Add the metrics of a SINGLE song to the temporary result
-                    tempresults.append(combineddict)
-
-                # As we are interested in the average we store the count of this list
-                count = len(tempresults)
-                # Remove the first element, which will be used for addition
-                A = Counter(tempresults.pop(0))
-                A = convert_none(A)
-                # Now iterate over each song's metrics within the results and add the values using counter.
-                for B in tempresults:
-                    B = Counter(B)
-                    B = convert_none(B)
-                    try:
-                        A = A + B
-                    except TypeError:
-                        count -= 1
-
-                # Convert these to averages by dividing each key if possible
-                for key, value in A.items():
-                    if value:
-                        A[key] = value / count
-                    else:
-                        A[key] = 0
-
-                # Add hour key for correct output format and append to results
-                A['date'] = time
-                results.append(A)
+        if models.User.get_rollups_verified(userid):
+            rollups = models.DailyRollup.get_days(userid, day_count)
+            if not rollups:
+                api.abort(404, msg=f"No moods found for '{userid}'")
 
             return {"userid": userid,
-                    "dates": results}
+                    "dates": [dict(rollup.get_averages(), date=rollup.bucket.isoformat()) for rollup in rollups]}
+
+        # Rollups of users that were not rebuilt from their history yet can be partial, so the history is used,
+        # averaged per listen like the rollups.
+        # Thus {date: Counter({songid: listen count, ...})}
+        listens = defaultdict(Counter)
+
+        for song in history.get_store().iter_songs(userid, epoch='s'):
+            mood_date = datetime.datetime.utcfromtimestamp(song['time']).strftime('%Y-%m-%d')
 
-        else:
+            # The history is streamed from new to old, so once a day too many is reached all requested days are read.
+            if mood_date not in listens and len(listens) >= day_count:
+                break
+
+            listens[mood_date][song['songid']] += 1
+
+        if not listens:
             api.abort(404, msg=f"No moods found for '{userid}'")
+
+        averages = get_listen_averages(listens)
+        return {"userid": userid,
+                "dates": [dict(averages[date], date=date) for date in listens if date in averages]}
@@ -3,21 +3,37 @@ import os
 from flask import Flask
 from flask_cors import CORS
 from flask_oauthlib.client import OAuth
-from flask_sqlalchemy import SQLAlchemy
 
 import config
+from app.utils.database import RoutingSQLAlchemy
 
 app = Flask(__name__)
 CORS(app)
 app.config.from_object('config')
 app.secret_key = os.environ.get("APP_SECRET", config.SECRET)
-db = SQLAlchemy(app)
+db = RoutingSQLAlchemy(app)
+
+
+def get_instance_file(path):
+    """
+    Returns the path of a file of this machine, relative paths are placed in the instance directory of the app, which
+    is created accessible by its owner only.
+    :param path: Path of the file, None is returned unchanged.
+    :return: Absolute path of the file.
+    """
+    if path is None or os.path.isabs(path):
+        return path
+
+    os.makedirs(app.instance_path, mode=0o700, exist_ok=True)
+    return os.path.join(app.instance_path, path)
+
 
 oauth = OAuth()
+accounts_url = app.config.get('SPOTIFY_ACCOUNTS_URL', 'https://accounts.spotify.com')
 spotifysso = oauth.remote_app('spotify',
-                              base_url='https://accounts.spotify.com',
-                              access_token_url='https://accounts.spotify.com/api/token',
-                              authorize_url='https://accounts.spotify.com/authorize',
+                              base_url=accounts_url,
+                              access_token_url=f'{accounts_url}/api/token',
+                              authorize_url=f'{accounts_url}/authorize',
                               consumer_key=app.config['SPOTIFY_CLIENT'],
                               consumer_secret=app.config['SPOTIFY_SECRET'],
                               request_token_params={'scope': ('user-read-recently-played,'
@@ -21,6 +21,7 @@
 """
 
 from app import app, db
+from app.utils import influx
 
 from influxdb import InfluxDBClient
 import types
@@ -35,8 +36,11 @@ class UseTestInfluxDB(object):
         app.config['TESTING'] = True
         app.config['INFLUX_HOST'] = "localhost"
 
-        cls.cli = InfluxDBClient(host=app.config['INFLUX_HOST'], port=app.config['INFLUX_PORT'],
-                                 username=app.config['INFLUX_USER'], password=app.config['INFLUX_PASSWORD'])
+        if app.config.get('INFLUX_BACKEND', 'influxdb') == 'memory':
+            cls.cli = influx.get_client()
+        else:
+            cls.cli = InfluxDBClient(host=app.config['INFLUX_HOST'], port=app.config['INFLUX_PORT'],
+                                     username=app.config['INFLUX_USER'], password=app.config['INFLUX_PASSWORD'])
 
         cls.cli.create_database('songs')
         cls.cli.switch_database('songs')
@@ -28,9 +28,13 @@ from app.tests.data.sql import multiple_songs
 from app.tests.presets import UseTestSqlAndInfluxDB
 
 from flask_restplus import Resource
+from werkzeug.exceptions import HTTPException
 
 from app.API.track_calls import History, TopSongs, Metric
 from app.API.user_calls import HourlyMood, DailyMood
+from app import db
+from app.utils import models
+from app.utils.tasks import rebuild_mood_rollups
 
 
 @pytest.mark.api_calls
@@ -49,14 +53,14 @@ class TestAPICalls(UseTestSqlAndInfluxDB, unittest.TestCase):
                         {
                             'songid': '0QXWfOuW9Nlk1DHuriQ47d',
                             'name': 'Solid As A Rock',
-                            'time': '2019-06-24T10:57:20.282000128Z',
+                            'time': '2019-06-24T10:53:52.470000128Z',
                             'excitedness': -0.298697,
                             'happiness': 0.429299
                         },
                         {
                             'songid': '3m7oq6mI87137pdj4MUS9i',
                             'name': 'Stay Bless',
-                            'time': '2019-06-24T10:53:52.470000128Z',
+                            'time': '2019-06-24T10:57:20.282000128Z',
                             'excitedness': 0.373746,
                             'happiness': 0.60425
                         },
@@ -93,6 +97,13 @@ class TestAPICalls(UseTestSqlAndInfluxDB, unittest.TestCase):
         top = TopSongs(Resource)
         self.assertDictEqual(top.get('snipper', 1), expected_output)
 
+    def test_get_top_song_invalid_duration(self):
+        top = TopSongs(Resource)
+        for song_count, duration in (('1', '1d; drop database songs'), ('1', 'week'), ('a', '1w')):
+            with self.assertRaises(HTTPException) as context:
+                top.get('snipper', song_count, duration)
+            self.assertEqual(context.exception.code, 400)
+
     def test_get_metrics(self):
         expected_output = {
             'resource':
@@ -148,39 +159,39 @@ class TestAPICalls(UseTestSqlAndInfluxDB, unittest.TestCase):
                 {
                     'userid': 'snipper',
                     'hours': [
-                        {
-                            'hour': '14',
-                            'excitedness': 0.04745772222222222,
-                            'happiness': 0.6015380333333336,
-                            'acousticness': 0.265185,
-                            'danceability': 0.7126111111111111,
-                            'duration_ms': 215871.38888888888,
-                            'energy': 0.5402222222222224,
-                            'instrumentalness': 0.1268772433333333,
-                            'key': 5.722222222222222,
-                            'liveness': 0.21075555555555556,
-                            'loudness': 0.0,
-                            'mode': 0.6111111111111112,
-                            'speechiness': 0.16409444444444443,
-                            'tempo': 125.36200000000001,
-                            'valence': 0.5524777777777778
-                        },
                         {
                             'hour': '13',
-                            'excitedness': 0.0,
-                            'happiness': 0.04739899999999999,
+                            'excitedness': -0.5906141533333333,
+                            'happiness': -0.1687122666666667,
                             'acousticness': 0.12324,
                             'danceability': 0.7436,
                             'duration_ms': 239181.46666666667,
-                            'energy': 0.6091333333333335,
-                            'instrumentalness': 0.07230773,
+                            'energy': 0.6091333333333334,
+                            'instrumentalness': 0.07230772999999999,
                             'key': 5.733333333333333,
                             'liveness': 0.19531333333333337,
-                            'loudness': 0.0,
+                            'loudness': -7.572733333333333,
                             'mode': 0.4666666666666667,
-                            'speechiness': 0.16362666666666664,
-                            'tempo': 110.53093333333332,
+                            'speechiness': 0.1636266666666667,
+                            'tempo': 110.53093333333331,
                             'valence': 0.7540666666666667
+                        },
+                        {
+                            'hour': '14',
+                            'excitedness': -0.5245603157894737,
+                            'happiness': 0.44964808421052627,
+                            'acousticness': 0.26612263157894733,
+                            'danceability': 0.7133157894736843,
+                            'duration_ms': 213396.05263157896,
+                            'energy': 0.535157894736842,
+                            'instrumentalness': 0.1277258094736842,
+                            'key': 5.842105263157895,
+                            'liveness': 0.20897894736842107,
+                            'loudness': -8.654736842105264,
+                            'mode': 0.5789473684210527,
+                            'speechiness': 0.17503684210526319,
+                            'tempo': 128.5031578947368,
+                            'valence': 0.5533473684210526
                         }
                     ]
                 }
@@ -196,20 +207,20 @@ class TestAPICalls(UseTestSqlAndInfluxDB, unittest.TestCase):
                 'dates': [
                     {
                         'date': '2019-06-20',
-                        'excitedness': 0.1321179142857143,
-                        'happiness': 0.37893217465714296,
-                        'acousticness': 0.1732328571428572,
-                        'danceability': 0.6541142857142855,
-                        'duration_ms': 195919.22857142857,
-                        'energy': 0.7373999999999998,
-                        'instrumentalness': 0.0681925857142857,
-                        'key': 5.228571428571429,
-                        'liveness': 0.1747685714285714,
-                        'loudness': 0.0,
-                        'mode': 0.5428571428571428,
-                        'speechiness': 0.0949457142857143,
-                        'tempo': 115.08668571428574,
-                        'valence': 0.5423714285714286
+                        'excitedness': 0.28094668627450986,
+                        'happiness': 0.5815706688823528,
+                        'acousticness': 0.1535539215686275,
+                        'danceability': 0.6670980392156862,
+                        'duration_ms': 210107.66666666666,
+                        'energy': 0.7702941176470586,
+                        'instrumentalness': 0.04679886176470588,
+                        'key': 4.980392156862745,
+                        'liveness': 0.17644901960784315,
+                        'loudness': -4.829137254901961,
+                        'mode': 0.6666666666666666,
+                        'speechiness': 0.08228431372549018,
+                        'tempo': 117.77117647058826,
+                        'valence': 0.5181372549019608
                     }
                 ]
             }
@@ -217,3 +228,29 @@ class TestAPICalls(UseTestSqlAndInfluxDB, unittest.TestCase):
 
         day = DailyMood(Resource)
         self.assertDictEqual(day.get('bulk', day_count=1), expected_output)
+
+    def test_mood_rollups_match_history(self):
+        # The rollups and the history average every listen, so both give the same moods.
+        hours = HourlyMood(Resource).get('snipper', start=0, end=24)
+        days = DailyMood(Resource).get('snipper', day_count=3)
+
+        # Rollups are only read once they were rebuilt from the history of a user.
+        db.session.add(models.User(userid='snipper', display_name='Snipper'))
+        db.session.commit()
+        rebuild_mood_rollups('snipper')
+        try:
+            self.assertTrue(models.User.get_rollups_verified('snipper'))
+            self.assertEqual(HourlyMood(Resource).get('snipper', start=0, end=24), hours)
+            self.assertEqual(DailyMood(Resource).get('snipper', day_count=3), days)
+        finally:
+            models.HourlyRollup.replace_totals('snipper', {})
+            models.DailyRollup.replace_totals('snipper', {})
+            models.User.query.filter_by(userid='snipper').delete()
+            db.session.commit()
+
+    def test_mood_unknown_user(self):
+        for call in (lambda: HourlyMood(Resource).get('unknown_user', start=0, end=24),
+                     lambda: DailyMood(Resource).get('unknown_user', day_count=3)):
+            with self.assertRaises(HTTPException) as context:
+                call()
+            self.assertEqual(context.exception.code, 404)
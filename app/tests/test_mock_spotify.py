@@ -0,0 +1,93 @@
+"""
+    test_mock_spotify.py
+    ~~~~~~~~~~~~
+    This file contains tests for the local stand-in of the Spotify Web API.
+
+    :copyright: 2019 Moodify (High-Mood)
+    :authors:
+           "Stan van den Broek",
+           "Mitchell van den Bulk",
+           "Mo Diallo",
+           "Arthur van Eeden",
+           "Elijah Erven",
+           "Henok Ghebrenigus",
+           "Jonas van der Ham",
+           "Mounir El Kirafi",
+           "Esmeralda Knaap",
+           "Youri Reijne",
+           "Siwa Sardjoemissier",
+           "Barry de Vries",
+           "Jelle Witsen Elias"
+"""
+
+import calendar
+import threading
+import unittest
+from datetime import datetime
+from unittest import mock
+
+import requests
+
+from app.utils import spotify
+from mock_spotify import MockCatalog, MockSpotifyServer
+
+
+class TestMockSpotify(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = MockSpotifyServer(('localhost', 0), MockCatalog(track_count=500, artist_count=100))
+        cls.url = f"http://localhost:{cls.server.server_address[1]}"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.patches = [mock.patch('app.utils.spotify.API_URL', f"{self.url}/v1"),
+                        mock.patch('app.utils.spotify.ACCOUNTS_URL', self.url)]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+
+    def test_client_calls(self):
+        access_token, _ = spotify._refresh_access_token('mockuser')
+        self.assertEqual(spotify.get_user_info(access_token)['id'], 'mockuser')
+
+        played = spotify.get_recently_played(access_token)['items']
+        trackids = [item['track']['id'] for item in played]
+        self.assertEqual(len(played), 50)
+
+        features = spotify.get_audio_features(access_token, trackids)['audio_features']
+        self.assertEqual([feature['id'] for feature in features if feature],
+                         [trackid for trackid in trackids if self.server.catalog.features[trackid]])
+
+        artistids = [artist['id'] for artist in played[0]['track']['artists']]
+        self.assertEqual([artist['id'] for artist in spotify.get_artists(access_token, artistids)['artists']],
+                         artistids)
+
+        page = spotify.get_playlists_page(access_token, 0, 50)
+        self.assertEqual(page['total'], 30)
+
+    def test_recently_played_after(self):
+        access_token, _ = spotify._refresh_access_token('mockuser')
+        played = spotify.get_recently_played(access_token)['items']
+        # The cursor of the workers points to the last millisecond of the second latest play.
+        played_at = datetime.strptime(played[1]['played_at'], '%Y-%m-%dT%H:%M:%S.%fZ')
+        after = (calendar.timegm(played_at.timetuple()) + 1) * 1000 - 1
+
+        self.assertEqual(spotify.get_recently_played(access_token, after=after)['items'], played[:1])
+
+    def test_throttled(self):
+        self.server.throttle.probability = 1.0
+        try:
+            response = requests.get(f"{self.url}/v1/me", headers={'Authorization': 'Bearer mock-mockuser'})
+        finally:
+            self.server.throttle.probability = 0.0
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers['Retry-After'], '1')
@@ -0,0 +1,146 @@
+"""
+    test_utils_breaker.py
+    ~~~~~~~~~~~~
+    This file contains tests for the circuit breakers and the fallback of the recommendations.
+
+    :copyright: 2019 Moodify (High-Mood)
+    :authors:
+           "Stan van den Broek",
+           "Mitchell van den Bulk",
+           "Mo Diallo",
+           "Arthur van Eeden",
+           "Elijah Erven",
+           "Henok Ghebrenigus",
+           "Jonas van der Ham",
+           "Mounir El Kirafi",
+           "Esmeralda Knaap",
+           "Youri Reijne",
+           "Siwa Sardjoemissier",
+           "Barry de Vries",
+           "Jelle Witsen Elias"
+"""
+
+import unittest
+from unittest import mock
+
+import requests
+from flask_restplus import Resource
+from werkzeug.exceptions import HTTPException
+
+from app.API.playlist_calls import PlaylistList, PlaylistMood
+from app.tests.presets import UseTestSqlDB
+from app.utils import models, recommendations, spotify
+from app.utils.breaker import CircuitBreaker, CLOSED, HALF_OPEN, OPEN
+from app.utils.exceptions import CircuitOpenError, RateLimitedError
+from app.utils.ratelimit import RateLimiter
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    @staticmethod
+    def fail():
+        raise requests.exceptions.Timeout()
+
+    @staticmethod
+    def rate_limited():
+        raise RateLimitedError(5)
+
+    def test_open_and_probe(self):
+        breaker = CircuitBreaker('test', failure_threshold=2, reset_timeout=30)
+        with mock.patch('time.monotonic', return_value=100):
+            for _ in range(2):
+                self.assertRaises(requests.exceptions.Timeout, breaker.call, self.fail)
+            self.assertRaises(CircuitOpenError, breaker.call, lambda: 'called')
+        self.assertEqual(breaker.state, OPEN)
+
+        # After the reset timeout a failing probe opens the breaker again and a succeeding probe closes it.
+        with mock.patch('time.monotonic', return_value=130):
+            self.assertRaises(requests.exceptions.Timeout, breaker.call, self.fail)
+            self.assertRaises(CircuitOpenError, breaker.call, lambda: 'called')
+        with mock.patch('time.monotonic', return_value=160):
+            self.assertEqual(breaker.call(lambda: 'called'), 'called')
+        self.assertEqual(breaker.state, CLOSED)
+
+        metrics = breaker.get_metrics()
+        self.assertEqual((metrics['failures'], metrics['rejected'], metrics['probes'], metrics['opened']),
+                         (3, 2, 2, 2))
+
+    def test_rate_limited_probe(self):
+        breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=30)
+        with mock.patch('time.monotonic', return_value=100):
+            self.assertRaises(requests.exceptions.Timeout, breaker.call, self.fail)
+
+        # A probe held back by the rate limiter neither closes the breaker nor keeps the next call from probing.
+        with mock.patch('time.monotonic', return_value=130):
+            self.assertRaises(RateLimitedError, breaker.call, self.rate_limited)
+            self.assertEqual(breaker.state, HALF_OPEN)
+            self.assertRaises(requests.exceptions.Timeout, breaker.call, self.fail)
+        self.assertEqual(breaker.state, OPEN)
+
+    def test_probe_slot_held_until_probe_finishes(self):
+        breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=30)
+        with mock.patch('time.monotonic', return_value=100):
+            self.assertRaises(requests.exceptions.Timeout, breaker.call, self.fail)
+
+        # A call that started before the breaker opened finishes while the probe is still running.
+        def probe():
+            breaker._after_call(False, False)
+            self.assertTrue(breaker.probing)
+            return 'probed'
+
+        with mock.patch('time.monotonic', return_value=130):
+            self.assertEqual(breaker.call(probe), 'probed')
+        self.assertFalse(breaker.probing)
+
+    def test_client_errors_do_not_count(self):
+        breaker = CircuitBreaker('test', failure_threshold=1)
+        self.assertRaises(KeyError, breaker.call, {}.__getitem__, 'missing')
+        self.assertEqual(breaker.state, CLOSED)
+
+
+class TestRecommendationFallback(UseTestSqlDB, unittest.TestCase):
+    # The moods lie far from the songs of the other tests, which share the database.
+    populate_sql_with = [models.Songmood(songid='seed', excitedness=50.0, happiness=50.0),
+                         models.Songmood(songid='close', excitedness=49.9, happiness=50.2),
+                         models.Songmood(songid='far', excitedness=45.0, happiness=45.0)]
+
+    @mock.patch('app.utils.spotify.get_app_token', side_effect=CircuitOpenError('accounts'))
+    def test_local_recommendations(self, get_app_token):
+        recs = recommendations.recommend_input(['seed'], target=(50.0, 50.0), n=2)
+
+        self.assertEqual([rec['songid'] for rec in recs], ['close', 'far'])
+
+    @mock.patch('app.utils.spotify.get_session')
+    @mock.patch('app.utils.spotify.get_app_token', return_value='token')
+    def test_rate_limited_recommendations(self, get_app_token, get_session):
+        # Another process was told to back off, the request is not held up but served from the database.
+        limiter = RateLimiter(rate=10, burst=10)
+        limiter.pause(30)
+        with mock.patch('app.utils.spotify._rate_limiter', limiter):
+            recs = recommendations.recommend_input(['seed'], target=(50.0, 50.0), n=2)
+
+        self.assertEqual([rec['songid'] for rec in recs], ['close', 'far'])
+        get_session.assert_not_called()
+
+
+class TestPlaylistCalls(UseTestSqlDB, unittest.TestCase):
+    @mock.patch('app.utils.spotify.get_access_token')
+    def test_unknown_user(self, get_access_token):
+        for call in (lambda: PlaylistList(Resource).get('unknown_user'),
+                     lambda: PlaylistMood(Resource).get('unknown_user', 'playlist')):
+            with self.assertRaises(HTTPException) as context:
+                call()
+            self.assertEqual(context.exception.code, 404)
+
+        get_access_token.assert_not_called()
+
+    @mock.patch('time.sleep')
+    @mock.patch('app.utils.spotify.get_session')
+    def test_throttled_playlist_page_retried(self, get_session, sleep):
+        # An analysis pages many playlists at once, a throttled page is retried instead of failing the analysis.
+        page = {'total': 0, 'items': []}
+        get_session.return_value.request.side_effect = [mock.Mock(status_code=429, headers={'Retry-After': '0'}),
+                                                        mock.Mock(status_code=200, json=lambda: page)]
+        with mock.patch('app.utils.spotify._rate_limiter', RateLimiter(rate=100, burst=100)):
+            self.assertEqual(spotify.get_playlist_tracks_page('token', 'playlist'), page)
+
+        self.assertEqual(get_session.return_value.request.call_count, 2)
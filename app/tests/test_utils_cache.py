@@ -0,0 +1,46 @@
+"""
+    test_utils_cache.py
+    ~~~~~~~~~~~~
+    This file contains tests for the in memory response cache.
+
+    :copyright: 2019 Moodify (High-Mood)
+    :authors:
+           "Stan van den Broek",
+           "Mitchell van den Bulk",
+           "Mo Diallo",
+           "Arthur van Eeden",
+           "Elijah Erven",
+           "Henok Ghebrenigus",
+           "Jonas van der Ham",
+           "Mounir El Kirafi",
+           "Esmeralda Knaap",
+           "Youri Reijne",
+           "Siwa Sardjoemissier",
+           "Barry de Vries",
+           "Jelle Witsen Elias"
+"""
+
+import unittest
+from unittest import mock
+
+from app.utils.cache import TTLCache
+
+
+class TestTTLCache(unittest.TestCase):
+    def test_least_recently_used_removed(self):
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('c', 3)
+
+        self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')), (1, None, 3))
+
+    def test_entries_expire(self):
+        cache = TTLCache(ttl=60)
+        with mock.patch('time.time', return_value=1000):
+            cache.put('a', 1)
+        with mock.patch('time.time', return_value=1059):
+            self.assertEqual(cache.get('a'), 1)
+        with mock.patch('time.time', return_value=1060):
+            self.assertEqual(cache.get('a'), None)
@@ -0,0 +1,60 @@
+"""
+    test_utils_history.py
+    ~~~~~~~~~~~~
+    This file contains tests for the history stores.
+
+    :copyright: 2019 Moodify (High-Mood)
+    :authors:
+           "Stan van den Broek",
+           "Mitchell van den Bulk",
+           "Mo Diallo",
+           "Arthur van Eeden",
+           "Elijah Erven",
+           "Henok Ghebrenigus",
+           "Jonas van der Ham",
+           "Mounir El Kirafi",
+           "Esmeralda Knaap",
+           "Youri Reijne",
+           "Siwa Sardjoemissier",
+           "Barry de Vries",
+           "Jelle Witsen Elias"
+"""
+
+import unittest
+
+from app.tests.data.influx.k3_album import k3_album
+from app.tests.presets import UseTestSqlDB
+from app.utils.history import InfluxHistory, SQLHistory
+from app.utils.influx_memory import MemoryClient
+
+
+class TestSQLHistory(UseTestSqlDB, unittest.TestCase):
+    def setUp(self):
+        self.influx = InfluxHistory(MemoryClient(databases=['songs', 'moods']))
+        self.sql = SQLHistory()
+        for store in (self.influx, self.sql):
+            store.add_listens(k3_album)
+
+    def tearDown(self):
+        self.sql.delete_history('test_user')
+
+    def test_same_results_as_influx(self):
+        self.assertEqual(self.sql.get_songs('test_user'), self.influx.get_songs('test_user'))
+        self.assertEqual(list(self.sql.iter_songs('test_user', limit=5, epoch='s', columns=True)),
+                         list(self.influx.iter_songs('test_user', limit=5, epoch='s', columns=True)))
+        self.assertEqual(self.sql.get_top_songs('test_user', 1), [("035czDmDakmsSlElgid5d9", 2)])
+        self.assertEqual(self.sql.get_song_counts('test_user'), self.influx.get_song_counts('test_user'))
+        self.assertEqual(self.sql.get_last_played_at('test_user'), self.influx.get_last_played_at('test_user'))
+
+    def test_replace_listen(self):
+        self.sql.add_listens([{'measurement': 'test_user', 'time': "2019-03-12T10:47:35Z",
+                               'fields': {'songid': "other"}}])
+        self.assertEqual(len(self.sql.get_songs('test_user')), len(k3_album))
+        self.assertEqual(self.sql.get_songs('test_user')[-1]['songid'], "other")
+
+    def test_moods(self):
+        self.sql.add_moods([{'measurement': 'test_user', 'time': "2019-03-12T10:00:00Z", 'tags': {'window': '1h'},
+                             'fields': {'excitedness': 1.0, 'happiness': 0.5, 'songcount': 3}}])
+        self.assertEqual(self.sql.get_moods('test_user', '1h'), [{'time': "2019-03-12T10:00:00Z", 'excitedness': 1.0,
+                                                                  'happiness': 0.5, 'songcount': 3}])
+        self.assertEqual(self.sql.get_moods('test_user', '1d'), [])
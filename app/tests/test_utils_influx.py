@@ -20,11 +20,16 @@
            "Jelle Witsen Elias"
 """
 
+import gzip
 import unittest
+from datetime import datetime
+
+from influxdb.exceptions import InfluxDBServerError
 
 from app.tests.data.influx import k3_album
 from app.tests.presets import UseTestInfluxDB
 from app.utils import influx
+from app.utils.influx_memory import MemoryClient, convert_timestamp
 
 
 class TestSongs(UseTestInfluxDB, unittest.TestCase):
@@ -32,3 +37,90 @@ class TestSongs(UseTestInfluxDB, unittest.TestCase):
 
     def test_get_top_songs(self):
         self.assertEqual(influx.get_top_songs(self.cli, 'test_user', 1), [("035czDmDakmsSlElgid5d9", 2)])
+
+    def test_iter_songs(self):
+        songs = influx.get_songs(self.cli, 'test_user')
+        self.assertEqual(list(influx.iter_songs(self.cli, 'test_user', chunk_size=2)), songs)
+
+        times, songids = next(influx.iter_songs(self.cli, 'test_user', limit=3, epoch='s', columns=True))
+        self.assertEqual(songids, [song['songid'] for song in songs[:3]])
+
+    def test_invalid_duration(self):
+        self.assertRaises(ValueError, influx.get_songs, self.cli, 'test_user', duration="1d; drop database songs")
+
+
+class RecordingClient(object):
+    """Stands in for the InfluxDB client and records the requests, failing the first `failures` requests."""
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.requests = []
+
+    def request(self, url, method, params, data, expected_response_code, headers):
+        if self.failures:
+            self.failures -= 1
+            raise InfluxDBServerError("unavailable")
+        self.requests.append((params, gzip.decompress(data).decode('utf-8').splitlines()))
+
+
+class TestWriteBuffer(unittest.TestCase):
+    points = [{'measurement': 'test_user', 'time': f"2019-03-12T10:47:3{i}.282Z", 'fields': {'songid': str(i)}}
+              for i in range(5)]
+
+    def test_batches(self):
+        client = RecordingClient()
+        with influx.WriteBuffer(client, batch_size=2) as write_buffer:
+            write_buffer.add(self.points)
+            self.assertEqual(len(client.requests), 2)
+
+        self.assertEqual([len(lines) for _, lines in client.requests], [2, 2, 1])
+        self.assertEqual(client.requests[0][0], {'db': 'songs', 'precision': 's'})
+        self.assertEqual(client.requests[0][1][0], 'test_user songid="0" 1552387650')
+
+    def test_retry(self):
+        client = RecordingClient(failures=2)
+        write_buffer = influx.WriteBuffer(client, batch_size=10, retries=1)
+        written = []
+        write_buffer.add(self.points, on_write=lambda: written.append(True))
+
+        self.assertRaises(InfluxDBServerError, write_buffer.flush)
+        self.assertEqual(len(write_buffer.points), 5)
+        self.assertEqual(written, [])
+        write_buffer.flush()
+        self.assertEqual(len(client.requests[0][1]), 5)
+        self.assertEqual(written, [True])
+
+
+class TestMemoryClient(unittest.TestCase):
+    def setUp(self):
+        self.client = MemoryClient(databases=['songs'])
+        self.client.write_points(k3_album.k3_album, database='songs')
+
+    def test_same_results_as_influx(self):
+        songs = influx.get_songs(self.client, 'test_user')
+        self.assertEqual(songs[0], {'time': '2019-03-12T11:15:42Z', 'songid': '7A6cA4hdbjj7OERuUWdZw4'})
+        self.assertEqual(list(influx.iter_songs(self.client, 'test_user', chunk_size=2)), songs)
+        self.assertEqual(influx.get_top_songs(self.client, 'test_user', 1), [("035czDmDakmsSlElgid5d9", 2)])
+
+    def test_moods_per_window(self):
+        self.client.create_database(influx.MOODS)
+        self.client.write_points([{'measurement': 'test_user', 'time': '2019-03-12T10:00:00Z', 'tags': {'window': '1h'},
+                                   'fields': {'excitedness': 0.5, 'happiness': 0.25, 'songcount': 4}},
+                                  {'measurement': 'test_user', 'time': '2019-03-11T10:00:00Z',
+                                   'fields': {'excitedness': -0.5, 'happiness': 0.0, 'songcount': 2}}],
+                                 database=influx.MOODS)
+
+        self.assertDictEqual(influx.get_moods_per_window(self.client, 'test_user'), {
+            '': [{'time': '2019-03-11T10:00:00Z', 'excitedness': -0.5, 'happiness': 0.0, 'songcount': 2}],
+            '1h': [{'time': '2019-03-12T10:00:00Z', 'excitedness': 0.5, 'happiness': 0.25, 'songcount': 4}]})
+
+    def test_convert_timestamp(self):
+        # The InfluxDB client converts through floating point seconds, the stored times match it.
+        self.assertEqual(int(convert_timestamp('2019-06-24T10:57:20.282Z')), 1561373840282000128)
+        self.assertEqual(int(convert_timestamp(datetime(2019, 6, 24, 10, 57, 20), 's')), 1561373840)
+        self.assertEqual(convert_timestamp(1561373840, 's'), 1561373840)
+
+    def test_overwrite_point(self):
+        self.client.write_points([{'measurement': 'test_user', 'time': "2019-03-12T10:47:35Z",
+                                   'fields': {'songid': "other"}}], database='songs')
+        self.assertEqual(influx.get_songs(self.client, 'test_user')[-1]['songid'], "other")
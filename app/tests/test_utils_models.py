@@ -20,8 +20,11 @@
            "Jelle Witsen Elias"
 """
 
+import os
+import tempfile
 import unittest
 
+from app import app, db
 from app.utils import models
 from app.tests.presets import UseTestSqlDB
 
@@ -110,3 +113,112 @@ class TestSongs(UseTestSqlDB, unittest.TestCase):
                                delta=0.1)
         self.assertAlmostEqual(models.Songmood.get_moods([self.mood_info['songid']])[0].response_happiness, 9.7,
                                delta=0.1)
+
+
+class TestListenCounts(UseTestSqlDB, unittest.TestCase):
+    def test_add_listens(self):
+        models.SongCount.add_listens('counter', ['song_a', 'song_b', 'song_a'])
+        models.SongCount.add_listens('counter', ['song_a', 'song_c'])
+
+        self.assertEqual(models.SongCount.get_top('counter', 1), [('song_a', 3)])
+        self.assertDictEqual(models.SongCount.get_counts('counter'), {'song_a': 3, 'song_b': 1, 'song_c': 1})
+
+    def test_replace_counts(self):
+        models.ArtistCount.add_listens('replaced', ['artist_a'])
+        models.ArtistCount.replace_counts('replaced', {'artist_b': 2})
+
+        self.assertEqual(models.ArtistCount.get_top('replaced', 5), [('artist_b', 2)])
+
+
+class TestArtists(UseTestSqlDB, unittest.TestCase):
+    def test_unknown_and_stale_artists(self):
+        for artistid in ['known_a', 'known_b']:
+            models.Artist.create_if_not_exist({'artistid': artistid, 'name': artistid, 'genres': '', 'popularity': 1})
+        models.Artist.query.filter_by(artistid='known_a').update({'updated_at': datetime(2019, 6, 1)})
+        db.session.commit()
+
+        self.assertEqual(models.Artist.get_unknown_ids(['new', 'known_a', 'known_b']), ['new'])
+        self.assertEqual(models.Artist.get_stale_ids(datetime(2019, 7, 1), 10), ['known_a'])
+
+        models.Artist.update_artists([{'artistid': 'known_a', 'name': 'A', 'genres': 'pop', 'popularity': 80}])
+        self.assertEqual(models.Artist.get_stale_ids(datetime(2019, 7, 1), 10), [])
+        self.assertEqual(models.Artist.get_artists(['known_a'])[0].genres, 'pop')
+
+    def test_artists_unknown_to_spotify(self):
+        models.Artist.create_unknown(['tombstone', 'tombstone'])
+        models.Artist.query.filter_by(artistid='tombstone').update({'updated_at': datetime(2019, 6, 1)})
+        db.session.commit()
+
+        # They are not requested on ingest and not listed, but refreshed once stale like the other artists.
+        self.assertEqual(models.Artist.get_unknown_ids(['tombstone']), [])
+        self.assertEqual(models.Artist.get_artists(['tombstone']), [])
+        self.assertEqual(models.Artist.get_stale_ids(datetime(2019, 7, 1), 10), ['tombstone'])
+
+        models.Artist.update_artists([], unknown_ids=['tombstone'])
+        self.assertEqual(models.Artist.get_stale_ids(datetime(2019, 7, 1), 10), [])
+
+
+class TestMoodRollups(UseTestSqlDB, unittest.TestCase):
+    @staticmethod
+    def _totals(count, value):
+        return dict({metric: value * count for metric in models.MoodRollup.metrics}, count=count)
+
+    def test_hourly_rollups(self):
+        models.HourlyRollup.add_totals('rolled', {13: self._totals(2, 1.0), 20: self._totals(1, 1.0)})
+        models.HourlyRollup.add_totals('rolled', {13: self._totals(2, -2.0)})
+
+        hours = models.HourlyRollup.get_hours('rolled', 10, 14)
+        self.assertEqual([hour.bucket for hour in hours], [13])
+        self.assertEqual(hours[0].count, 4)
+        self.assertAlmostEqual(hours[0].get_averages()['loudness'], -0.5)
+
+    def test_daily_rollups(self):
+        models.DailyRollup.replace_totals('rolled', {datetime(2019, 6, 20).date(): self._totals(1, 1.0),
+                                                     datetime(2019, 6, 24).date(): self._totals(3, 2.0)})
+
+        days = models.DailyRollup.get_days('rolled', 1)
+        self.assertEqual([day.bucket.isoformat() for day in days], ['2019-06-24'])
+        self.assertAlmostEqual(days[0].get_averages()['tempo'], 2.0)
+
+
+class TestReadReplica(unittest.TestCase):
+    user_info = {'id': '113',
+                 'email': "such_email@email.com",
+                 'display_name': "Replica user",
+                 'country': "Earth",
+                 'product': "premium"}
+
+    @classmethod
+    def setUpClass(cls):
+        """Create a primary and a replica sqlite database in separate files."""
+        cls.default_sqlDB_uri = app.config['SQLALCHEMY_DATABASE_URI']
+        cls.directory = tempfile.TemporaryDirectory()
+
+        app.config['TESTING'] = True
+        app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(cls.directory.name, 'primary.db')}"
+        app.config['SQLALCHEMY_BINDS'] = {'replica': f"sqlite:///{os.path.join(cls.directory.name, 'replica.db')}"}
+        app.config['SQLALCHEMY_REPLICA_BINDS'] = ['replica']
+
+        db.session.remove()
+        db.create_all()
+        db.Model.metadata.create_all(bind=db.get_engine(app, bind='replica'))
+
+    @classmethod
+    def tearDownClass(cls):
+        db.session.remove()
+        app.config['SQLALCHEMY_DATABASE_URI'] = cls.default_sqlDB_uri
+        app.config['SQLALCHEMY_BINDS'] = {}
+        app.config['SQLALCHEMY_REPLICA_BINDS'] = []
+        cls.directory.cleanup()
+
+    def test_routing(self):
+        models.User.create_if_not_exist(self.user_info, "refresh_token")
+
+        # The user is only written to the primary, the replica has not caught up.
+        self.assertIsNone(models.User.get_user(self.user_info['id']))
+        with models.primary():
+            self.assertEqual(models.User.get_user(self.user_info['id']).userid, self.user_info['id'])
+            with models.read_replica():
+                self.assertIsNotNone(models.User.get_user(self.user_info['id']))
+
+        self.assertEqual(models.User.get_refresh_token(self.user_info['id']), "refresh_token")
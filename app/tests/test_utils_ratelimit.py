@@ -0,0 +1,58 @@
+"""
+    test_utils_ratelimit.py
+    ~~~~~~~~~~~~
+    This file contains tests for the rate limiter of the Spotify calls.
+
+    :copyright: 2019 Moodify (High-Mood)
+    :authors:
+           "Stan van den Broek",
+           "Mitchell van den Bulk",
+           "Mo Diallo",
+           "Arthur van Eeden",
+           "Elijah Erven",
+           "Henok Ghebrenigus",
+           "Jonas van der Ham",
+           "Mounir El Kirafi",
+           "Esmeralda Knaap",
+           "Youri Reijne",
+           "Siwa Sardjoemissier",
+           "Barry de Vries",
+           "Jelle Witsen Elias"
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from app.utils.exceptions import RateLimitedError
+from app.utils.ratelimit import RateLimiter
+
+
+class TestRateLimiter(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'ratelimit')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_shared_bucket(self):
+        limiter = RateLimiter(rate=50, burst=2, path=self.path)
+        self.assertEqual(limiter.acquire(), 0)
+        # A second limiter on the same file stands in for another process.
+        self.assertEqual(RateLimiter(rate=50, burst=2, path=self.path).acquire(), 0)
+        self.assertAlmostEqual(limiter.acquire(), 0.02, delta=0.01)
+
+    def test_pause(self):
+        limiter = RateLimiter(rate=50, burst=2)
+        limiter.pause(0.1)
+        self.assertAlmostEqual(limiter.acquire(), 0.12, delta=0.01)
+
+    def test_max_wait(self):
+        limiter = RateLimiter(rate=50, burst=2)
+        limiter.pause(10)
+        tokens, _ = limiter._load()
+        self.assertRaises(RateLimitedError, limiter.acquire, max_wait=1)
+        # A call that gives up does not take a token, so it does not delay the others.
+        self.assertAlmostEqual(limiter._load()[0], tokens, delta=1)
@@ -0,0 +1,96 @@
+"""
+    test_utils_spotify.py
+    ~~~~~~~~~~~~
+    This file contains tests for the communication with the Spotify API.
+
+    :copyright: 2019 Moodify (High-Mood)
+    :authors:
+           "Stan van den Broek",
+           "Mitchell van den Bulk",
+           "Mo Diallo",
+           "Arthur van Eeden",
+           "Elijah Erven",
+           "Henok Ghebrenigus",
+           "Jonas van der Ham",
+           "Mounir El Kirafi",
+           "Esmeralda Knaap",
+           "Youri Reijne",
+           "Siwa Sardjoemissier",
+           "Barry de Vries",
+           "Jelle Witsen Elias"
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from app.utils import spotify_async
+from app.utils.cache import DiskCache
+
+
+def get_audio_features(access_token, trackids):
+    """Stands in for Spotify, which returns the features in reverse and has none for ids starting with 'x'."""
+    return {'audio_features': [None if trackid.startswith('x') else {'id': trackid} for trackid in reversed(trackids)]}
+
+
+def get_artists(access_token, artistids):
+    return {'artists': [{'id': artistid, 'genres': [], 'popularity': 50} for artistid in artistids]}
+
+
+class TestAsyncSpotify(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = mock.patch('app.utils.spotify_async.catalog_cache', DiskCache())
+        self.cache.start()
+
+    def tearDown(self):
+        self.cache.stop()
+        shutil.rmtree(self.directory)
+
+    @mock.patch('app.utils.spotify.get_audio_features', side_effect=get_audio_features)
+    def test_get_all_audio_features(self, mocked):
+        trackids = [f"x{i}" if i % 7 == 0 else f"t{i}" for i in range(250)]
+        features = spotify_async.run(spotify_async.get_all_audio_features('token', trackids))
+
+        self.assertEqual(sorted(len(call[0][1]) for call in mocked.call_args_list), [50, 100, 100])
+        self.assertEqual(features, [None if trackid.startswith('x') else {'id': trackid} for trackid in trackids])
+
+    @mock.patch('app.utils.spotify.get_audio_features', side_effect=get_audio_features)
+    def test_cached_audio_features(self, mocked):
+        spotify_async.catalog_cache = DiskCache(os.path.join(self.directory, 'catalog.sqlite'))
+        spotify_async.run(spotify_async.get_all_audio_features('token', ['t1', 'x2']))
+        features = spotify_async.run(spotify_async.get_all_audio_features('token', ['t1', 'x2', 't3']))
+
+        # Only the uncached track is requested, the track without features is cached as well.
+        self.assertEqual([call[0][1] for call in mocked.call_args_list], [['t1', 'x2'], ['t3']])
+        self.assertEqual(features, [{'id': 't1'}, None, {'id': 't3'}])
+
+    @mock.patch('app.utils.spotify.get_artists', side_effect=get_artists)
+    def test_artists_expire(self, mocked):
+        spotify_async.catalog_cache = DiskCache(os.path.join(self.directory, 'catalog.sqlite'))
+        with mock.patch.dict('app.app.config', {'SPOTIFY_ARTIST_TTL': -1}):
+            spotify_async.run(spotify_async.get_all_artists('token', ['a1', 'a2']))
+        spotify_async.run(spotify_async.get_all_artists('token', ['a1']))
+        artists = spotify_async.run(spotify_async.get_all_artists('token', ['a1']))
+
+        self.assertEqual([call[0][1] for call in mocked.call_args_list], [['a1', 'a2'], ['a1']])
+        self.assertEqual(artists[0]['id'], 'a1')
+
+    @mock.patch('app.utils.models.User.get_refresh_token', return_value='refresh')
+    @mock.patch('app.utils.spotify.get_access_token', return_value='token')
+    @mock.patch('app.utils.spotify.get_playlists_page')
+    def test_iter_playlists(self, get_page, get_access_token, get_refresh_token):
+        def page(access_token, offset, limit):
+            items = [{'name': str(i), 'id': str(i), 'href': '', 'public': True, 'tracks': {'href': '', 'total': 1}}
+                     for i in range(offset, min(offset + limit, 120))]
+            return {'total': 120, 'items': items}
+        get_page.side_effect = page
+
+        for _ in range(2):
+            playlists = list(spotify_async.iter_playlists('user'))
+            self.assertEqual([playlist['id'] for playlist in playlists], [str(i) for i in range(120)])
+
+        self.assertEqual(sorted(call[0][1] for call in get_page.call_args_list), [0, 0, 50, 50, 100, 100])
+        self.assertEqual(get_access_token.call_count, 2)
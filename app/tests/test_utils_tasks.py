@@ -0,0 +1,200 @@
+"""
+    test_utils_tasks.py
+    ~~~~~~~~~~~~
+    This file contains tests for the ingest and worker tasks.
+
+    :copyright: 2019 Moodify (High-Mood)
+    :authors:
+           "Stan van den Broek",
+           "Mitchell van den Bulk",
+           "Mo Diallo",
+           "Arthur van Eeden",
+           "Elijah Erven",
+           "Henok Ghebrenigus",
+           "Jonas van der Ham",
+           "Mounir El Kirafi",
+           "Esmeralda Knaap",
+           "Youri Reijne",
+           "Siwa Sardjoemissier",
+           "Barry de Vries",
+           "Jelle Witsen Elias"
+"""
+
+import unittest
+from unittest import mock
+
+from datetime import datetime
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from app import db
+from app.tests.presets import UseTestSqlDB
+from app.utils import models, tasks
+from app.utils.database import PRIMARY, ROUTE_KEY
+from app.utils.history import ListenBuffer
+
+
+class TestMeanMoods(UseTestSqlDB, unittest.TestCase):
+    populate_sql_with = [models.Songmood(songid='song_a', excitedness=1.0, happiness=2.0),
+                         models.Songmood(songid='song_b', excitedness=3.0, happiness=-2.0),
+                         models.Songmood(songid='song_c', excitedness=None, happiness=None)]
+
+    def test_get_window_moods(self):
+        listens = {'user_a': ([900, 500, 100], ['song_a', 'song_b', 'song_a']),
+                   'user_b': ([950, 200], ['song_b', 'song_c']),
+                   'user_c': ([990, 980], ['song_c', 'unknown'])}
+        moods = tasks.get_window_moods(listens, {'1m': 60, '10m': 600}, 1000)
+
+        self.assertDictEqual(moods, {'user_a': {'10m': (2.0, 0.0, 2)},
+                                     'user_b': {'1m': (3.0, -2.0, 1), '10m': (3.0, -2.0, 1)}})
+
+
+class TestSongFeatures(UseTestSqlDB, unittest.TestCase):
+    populate_sql_with = [models.Song(songid='known', name='Known', danceability=0.5)]
+
+    @mock.patch('app.utils.spotify.get_app_token')
+    def test_known_songs_skip_spotify(self, get_app_token):
+        songs = tasks.update_song_features({'known': {'name': 'Known'}})
+
+        self.assertEqual([song.songid for song in songs], ['known'])
+        get_app_token.assert_not_called()
+
+    @mock.patch('app.utils.tasks.analyse_mood')
+    def test_known_songmoods_read_from_primary(self, analyse_mood):
+        routes = []
+        with mock.patch('app.utils.models.Songmood.get_moods',
+                        side_effect=lambda songids: routes.append(db.session.info.get(ROUTE_KEY)) or []):
+            tasks.update_songmoods([])
+
+        self.assertEqual(routes, [PRIMARY])
+        analyse_mood.assert_not_called()
+
+
+class TestPlaylistMoods(unittest.TestCase):
+    @staticmethod
+    def get_playlist_tracks_page(access_token, playlistid, offset, limit):
+        tracks = [{'id': f"{playlistid}{i}", 'name': str(i)} for i in range(offset, min(offset + limit, 150))]
+        return {'total': 150, 'items': [{'track': track} for track in tracks] + [{'track': None}]}
+
+    @staticmethod
+    def get_all_audio_features(access_token, trackids):
+        features = ['mode', 'time_signature', 'acousticness', 'danceability', 'energy', 'instrumentalness',
+                    'liveness', 'loudness', 'speechiness', 'valence', 'tempo']
+        return [None if trackid.endswith('7') else dict({feature: 0.5 for feature in features}, id=trackid)
+                for trackid in trackids]
+
+    @staticmethod
+    def analyse_mood(songs):
+        return [{'songid': song['songid'], 'excitedness': song['energy'], 'happiness': song['valence']}
+                for song in songs]
+
+    @mock.patch('app.utils.spotify.get_app_token', return_value='token')
+    def test_analyse_playlists(self, get_app_token):
+        async def get_all_audio_features(access_token, trackids):
+            return self.get_all_audio_features(access_token, trackids)
+
+        with mock.patch('app.utils.spotify.get_playlist_tracks_page', side_effect=self.get_playlist_tracks_page), \
+                mock.patch('app.utils.spotify_async.get_all_audio_features', side_effect=get_all_audio_features), \
+                mock.patch('app.utils.tasks.analyse_mood', side_effect=self.analyse_mood) as analyse_mood:
+            moods = tasks.analyse_playlists('token', ['a', 'b'])
+
+        # All tracks are scored in one batch.
+        self.assertEqual(analyse_mood.call_count, 1)
+        self.assertEqual([playlist['track_count'] for playlist in moods['playlists']], [150, 150])
+        tracks = moods['playlists'][0]['tracks']
+        self.assertEqual(tracks[7]['excitedness'], None)
+        self.assertAlmostEqual(tracks[0]['excitedness'], moods['playlists'][1]['excitedness'])
+        self.assertAlmostEqual(tracks[0]['happiness'], moods['happiness'])
+
+
+class TestRecentlyPlayedCursor(UseTestSqlDB, unittest.TestCase):
+    populate_sql_with = [models.User(userid='cursor', display_name='Cursor',
+                                     last_played_at=datetime(2019, 6, 1, 12, 0, 0)),
+                         models.User(userid='no_cursor', display_name='No cursor')]
+
+    @mock.patch('app.utils.spotify.get_recently_played', return_value={'items': []})
+    def test_after_cursor(self, get_recently_played):
+        tasks.get_latest_tracks('cursor', 'token')
+        tasks.get_latest_tracks('no_cursor', 'token')
+
+        # The rest of the second of the last stored listen is skipped, it was stored with second precision.
+        self.assertEqual(get_recently_played.call_args_list, [mock.call('token', after=1559390400999),
+                                                             mock.call('token', after=None)])
+
+    @mock.patch('app.utils.spotify_async.run')
+    @mock.patch('app.utils.history.get_store')
+    @mock.patch('app.utils.spotify.get_recently_played', return_value={'items': []})
+    def test_skip_user_without_new_plays(self, get_recently_played, get_store, run):
+        write_buffer = mock.Mock()
+        with mock.patch('app.utils.spotify.get_user_info', return_value={'id': 'cursor', 'display_name': ''}):
+            tasks.update_user_tracks('token', write_buffer)
+            tasks.update_user_tracks('token')
+
+        run.assert_not_called()
+        get_store.assert_not_called()
+        write_buffer.add.assert_not_called()
+        self.assertEqual(models.User.get_last_played_at('cursor'), datetime(2019, 6, 1, 12, 0, 0))
+
+
+class TestBufferedListens(UseTestSqlDB, unittest.TestCase):
+    populate_sql_with = [models.User(userid='buffered', display_name='Buffered',
+                                     last_played_at=datetime(2019, 6, 1, 12, 0, 0), counts_verified=True,
+                                     rollups_verified=True)]
+    tracks = [{'measurement': 'buffered', 'time': '2019-06-01T13:00:00Z', 'fields': {'songid': 'song_a'}}]
+
+    def update_user_tracks(self, write_buffer):
+        with mock.patch('app.utils.spotify.get_user_info', return_value={'id': 'buffered', 'display_name': ''}), \
+                mock.patch('app.utils.tasks.get_latest_tracks', return_value=(self.tracks, [])), \
+                mock.patch('app.utils.tasks.update_songmoods'):
+            tasks.update_user_tracks('token', write_buffer)
+
+    def test_failed_flush_keeps_cursor(self):
+        store = mock.Mock(errors=(SQLAlchemyError,))
+        store.add_listens.side_effect = SQLAlchemyError("unavailable")
+        write_buffer = ListenBuffer(store)
+        self.update_user_tracks(write_buffer)
+
+        self.assertRaises(SQLAlchemyError, write_buffer.flush)
+        self.assertEqual(models.User.get_last_played_at('buffered'), datetime(2019, 6, 1, 12, 0, 0))
+        self.assertEqual(write_buffer.points, self.tracks)
+
+        # Once the listens are stored the cursor moves on.
+        store.add_listens.side_effect = None
+        write_buffer.flush()
+        self.assertEqual(models.User.get_last_played_at('buffered'), datetime(2019, 6, 1, 13, 0, 0))
+
+
+class TestListenBackfill(UseTestSqlDB, unittest.TestCase):
+    populate_sql_with = [models.User(userid='backfilled', display_name='Backfilled'),
+                         models.Song(songid='backfilled_song', name='Backfilled', tempo=100.0),
+                         models.Songmood(songid='backfilled_song', excitedness=1.0, happiness=-1.0),
+                         models.SongArtist(songid='backfilled_song', artistid='backfilled_artist')]
+
+    def add_new_listens(self, time):
+        tracks = [{'measurement': 'backfilled', 'time': time, 'fields': {'songid': 'backfilled_song'}}]
+        tasks.add_new_listens('backfilled', tracks)
+
+    @mock.patch('app.utils.history.get_store')
+    def test_backfilled_from_history(self, get_store):
+        # The history holds more listens than this ingest: four earlier ones at 12:00 UTC and this one at 13:00.
+        history_times = [1559394000] + [1559390400] * 4
+        get_store.return_value.get_song_counts.return_value = {'backfilled_song': 5}
+        get_store.return_value.iter_songs.return_value = [(history_times, ['backfilled_song'] * 5)]
+        get_store.return_value.get_last_played_at.return_value = datetime(2019, 6, 1, 13, 0, 0)
+
+        # The counters and rollups are built from the history instead of from this ingest.
+        self.add_new_listens('2019-06-01T13:00:00Z')
+        self.assertTrue(models.User.get_counts_verified('backfilled'))
+        self.assertTrue(models.User.get_rollups_verified('backfilled'))
+        self.assertDictEqual(models.SongCount.get_counts('backfilled'), {'backfilled_song': 5})
+        self.assertDictEqual(models.ArtistCount.get_counts('backfilled'), {'backfilled_artist': 5})
+        self.assertEqual([(day.bucket.isoformat(), day.count) for day in models.DailyRollup.get_days('backfilled', 5)],
+                         [('2019-06-01', 5)])
+
+        # Once verified they are only increased with the new listens.
+        self.add_new_listens('2019-06-01T14:00:00Z')
+        self.assertDictEqual(models.SongCount.get_counts('backfilled'), {'backfilled_song': 6})
+        self.assertEqual([(hour.bucket, hour.count) for hour in models.HourlyRollup.get_hours('backfilled', 12, 14)],
+                         [(12, 4), (13, 1), (14, 1)])
+        get_store.return_value.get_song_counts.assert_called_once_with('backfilled')
+        get_store.return_value.iter_songs.assert_called_once()
@@ -0,0 +1,76 @@
+"""
+    test_utils_tokens.py
+    ~~~~~~~~~~~~
+    This file contains tests for the access token cache.
+
+    :copyright: 2019 Moodify (High-Mood)
+    :authors:
+           "Stan van den Broek",
+           "Mitchell van den Bulk",
+           "Mo Diallo",
+           "Arthur van Eeden",
+           "Elijah Erven",
+           "Henok Ghebrenigus",
+           "Jonas van der Ham",
+           "Mounir El Kirafi",
+           "Esmeralda Knaap",
+           "Youri Reijne",
+           "Siwa Sardjoemissier",
+           "Barry de Vries",
+           "Jelle Witsen Elias"
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from app.utils.tokens import TokenCache
+
+
+class TestTokenCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'tokens.sqlite')
+        self.requests = []
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def fetch(self, expires_in=3600):
+        self.requests.append(expires_in)
+        return f"token{len(self.requests)}", expires_in
+
+    def test_shared_between_caches(self):
+        self.assertEqual(TokenCache(self.path).get('refresh', self.fetch), "token1")
+        # A second cache stands in for another process.
+        self.assertEqual(TokenCache(self.path).get('refresh', self.fetch), "token1")
+        self.assertEqual(TokenCache(self.path).get('other', self.fetch), "token2")
+        self.assertEqual(len(self.requests), 2)
+
+    def test_store_private(self):
+        # Even a permissive umask does not expose the store, it is created private before sqlite writes to it.
+        umask = os.umask(0)
+        try:
+            TokenCache(self.path).get('refresh', self.fetch)
+        finally:
+            os.umask(umask)
+
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+
+    def test_refresh_before_expiry(self):
+        cache = TokenCache(self.path, margin=60)
+        self.assertEqual(cache.get('refresh', lambda: self.fetch(30)), "token1")
+        self.assertEqual(cache.get('refresh', self.fetch), "token2")
+        self.assertEqual(cache.get('refresh', self.fetch), "token2")
+
+    def test_single_flight(self):
+        cache = TokenCache()
+        threads = [threading.Thread(target=cache.get, args=('refresh', self.fetch)) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(self.requests), 1)
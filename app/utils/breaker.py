@@ -0,0 +1,158 @@
+"""
+    breaker.py
+    ~~~~~~~~~~~~
+    This file contains the circuit breakers of the Spotify endpoints, so request threads fail fast instead of waiting
+    on Spotify while it is slow or throttling.
+
+    :copyright: 2019 Moodify (High-Mood)
+    :authors:
+           "Stan van den Broek",
+           "Mitchell van den Bulk",
+           "Mo Diallo",
+           "Arthur van Eeden",
+           "Elijah Erven",
+           "Henok Ghebrenigus",
+           "Jonas van der Ham",
+           "Mounir El Kirafi",
+           "Esmeralda Knaap",
+           "Youri Reijne",
+           "Siwa Sardjoemissier",
+           "Barry de Vries",
+           "Jelle Witsen Elias"
+"""
+
+import threading
+import time
+from collections import Counter
+
+import requests
+
+from app.utils.exceptions import CircuitOpenError, RateLimitedError, StatusCodeError
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+def is_failure(error):
+    """
+    Tells whether an error means the endpoint is unhealthy, errors about the request itself (i.e. 404) do not count.
+    :param error: The exception raised by the call.
+    :return: True if the error counts as a failure.
+    """
+    if isinstance(error, requests.exceptions.RequestException):
+        return True
+    if isinstance(error, StatusCodeError):
+        return error.status_code == 429 or error.status_code >= 500
+
+    return False
+
+
+class CircuitBreaker(object):
+    """
+    Circuit breaker of one class of endpoints. After failure_threshold consecutive failures the breaker opens and
+    calls are rejected right away with CircuitOpenError. After reset_timeout seconds one call is let through to probe
+    the endpoint (half open), which closes the breaker when it succeeds and opens it again when it fails.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30, timeout=10, retries=3, max_wait=None):
+        """
+        :param name: Name of the class of endpoints.
+        :param failure_threshold: Number of consecutive failures that opens the breaker.
+        :param reset_timeout: Number of seconds the breaker stays open before it is probed.
+        :param timeout: Timeout in seconds of the requests to these endpoints.
+        :param retries: Number of retries of throttled requests to these endpoints.
+        :param max_wait: Maximum number of seconds a request to these endpoints waits for the rate limiter, None to
+                         wait as long as needed.
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.timeout = timeout
+        self.retries = retries
+        self.max_wait = max_wait
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self.probing = False
+        self.metrics = Counter()
+        self.lock = threading.Lock()
+
+    def call(self, function, *args, **kwargs):
+        """
+        Calls function through the breaker.
+        :param function: The function that calls the endpoint.
+        :return: The result of function.
+        :raises CircuitOpenError: If the breaker is open, function is not called then.
+        """
+        probe = self._before_call()
+        try:
+            result = function(*args, **kwargs)
+        except RateLimitedError:
+            # Our own rate limiter held the call back, so the endpoint was not called and the state is left as it is.
+            self._after_call(None, probe)
+            raise
+        except Exception as e:
+            self._after_call(not is_failure(e), probe)
+            raise
+
+        self._after_call(True, probe)
+        return result
+
+    def _before_call(self):
+        """
+        Counts a call and rejects it if the breaker is open.
+        :return: True if the call probes the endpoint while the breaker is half open.
+        :raises CircuitOpenError: If the breaker is open.
+        """
+        with self.lock:
+            self.metrics['calls'] += 1
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+            # While half open a single call probes the endpoint, the others are still rejected.
+            if self.state == OPEN or (self.state == HALF_OPEN and self.probing):
+                self.metrics['rejected'] += 1
+                raise CircuitOpenError(self.name)
+            if self.state == HALF_OPEN:
+                self.probing = True
+                self.metrics['probes'] += 1
+                return True
+
+            return False
+
+    def _after_call(self, succeeded, probe):
+        """
+        Records the outcome of a call.
+        :param succeeded: True if the endpoint is healthy, False if it failed and None if it was not called.
+        :param probe: True if the call held the probe of the half open breaker, only then the next probe is allowed.
+        """
+        with self.lock:
+            if probe:
+                self.probing = False
+            if succeeded is None:
+                return
+            if succeeded:
+                self.metrics['successes'] += 1
+                self.failures = 0
+                self.state = CLOSED
+                return
+
+            self.metrics['failures'] += 1
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.metrics['opened'] += 1
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+    def get_metrics(self):
+        """
+        Returns the state and the counters of the breaker.
+        :return: dict with the state and the number of calls, successes, failures, rejected calls, probes and times
+                 the breaker opened.
+        """
+        with self.lock:
+            metrics = {key: self.metrics[key] for key in ['calls', 'successes', 'failures', 'rejected', 'probes',
+                                                          'opened']}
+            metrics['state'] = self.state
+            return metrics
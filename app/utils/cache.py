@@ -0,0 +1,149 @@
+"""
+    cache.py
+    ~~~~~~~~~~~~
+    This file contains the disk cache of Spotify catalog objects, shared by all processes on the machine, and an in
+    memory cache of responses that are only valid for a short while.
+
+    :copyright: 2019 Moodify (High-Mood)
+    :authors:
+           "Stan van den Broek",
+           "Mitchell van den Bulk",
+           "Mo Diallo",
+           "Arthur van Eeden",
+           "Elijah Erven",
+           "Henok Ghebrenigus",
+           "Jonas van der Ham",
+           "Mounir El Kirafi",
+           "Esmeralda Knaap",
+           "Youri Reijne",
+           "Siwa Sardjoemissier",
+           "Barry de Vries",
+           "Jelle Witsen Elias"
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Maximum number of ids per lookup, older sqlite versions allow at most 999 variables per query.
+LOOKUP_SIZE = 500
+
+
+class DiskCache(object):
+    """
+    Caches JSON serializable objects of several kinds (i.e. 'audio_features', 'artists') by their Spotify id in a
+    sqlite file. An entry can expire after a TTL, and None can be cached to record that an id has no object, so it is
+    not requested again. Without a path nothing is cached.
+    """
+
+    def __init__(self, path=None):
+        """
+        :param path: Path of the sqlite file, None to disable the cache.
+        """
+        self.path = path
+        self.local = threading.local()
+
+    def get_many(self, kind, ids):
+        """
+        Looks up the cached objects of ids.
+        :param kind: Kind of the objects.
+        :param ids: List of Spotify ids.
+        :return: dict formatted as {id: object}, the object is None for cached misses and ids that are not cached or
+                 expired are left out.
+        """
+        if not self.path or not ids:
+            return {}
+
+        connection = self._connect()
+        now = time.time()
+        ids = list(ids)
+        found = {}
+        for i in range(0, len(ids), LOOKUP_SIZE):
+            chunk = ids[i:i + LOOKUP_SIZE]
+            rows = connection.execute(f'select id, data from catalog where kind = ? and id in '
+                                      f'({",".join("?" * len(chunk))}) and (expires_at is null or expires_at > ?)',
+                                      (kind, *chunk, now))
+            found.update((key, json.loads(data)) for key, data in rows)
+
+        return found
+
+    def put_many(self, kind, objects, ttl=None):
+        """
+        Caches objects.
+        :param kind: Kind of the objects.
+        :param objects: dict formatted as {id: object}, None records that the id has no object.
+        :param ttl: Number of seconds the objects are valid, None to keep them forever.
+        """
+        if not self.path or not objects:
+            return
+
+        expires_at = time.time() + ttl if ttl is not None else None
+        connection = self._connect()
+        with connection:
+            connection.execute('delete from catalog where expires_at < ?', (time.time(),))
+            connection.executemany('insert or replace into catalog values (?, ?, ?, ?)',
+                                   [(kind, key, json.dumps(value), expires_at) for key, value in objects.items()])
+
+    def _connect(self):
+        """Returns the connection of the current process and thread, creating it on first use."""
+        if getattr(self.local, 'pid', None) != os.getpid():
+            os.close(os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600))
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute('create table if not exists catalog '
+                               '(kind text, id text, data text, expires_at real, primary key (kind, id))')
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+
+        return self.local.connection
+
+
+class TTLCache(object):
+    """
+    Thread safe in memory cache of at most maxsize entries that are valid for ttl seconds, the least recently used
+    entry is removed when the cache is full.
+    """
+
+    def __init__(self, maxsize=1024, ttl=300):
+        """
+        :param maxsize: Maximum number of entries, 0 disables the cache.
+        :param ttl: Number of seconds an entry is valid.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Looks up an entry.
+        :param key: Hashable key of the entry.
+        :return: The cached value, None if the key is not cached or expired.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= time.time():
+                del self.entries[key]
+                return None
+
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value):
+        """
+        Caches a value.
+        :param key: Hashable key of the entry.
+        :param value: The value to cache.
+        """
+        if self.maxsize <= 0:
+            return
+
+        with self.lock:
+            self.entries[key] = (value, time.time() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
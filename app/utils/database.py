@@ -0,0 +1,59 @@
+"""
+    database.py
+    ~~~~~~~~~~~~
+    This file contains the SQLAlchemy session that routes read-only queries to the read replicas of the sql database.
+
+    :copyright: 2019 Moodify (High-Mood)
+    :authors:
+           "Stan van den Broek",
+           "Mitchell van den Bulk",
+           "Mo Diallo",
+           "Arthur van Eeden",
+           "Elijah Erven",
+           "Henok Ghebrenigus",
+           "Jonas van der Ham",
+           "Mounir El Kirafi",
+           "Esmeralda Knaap",
+           "Youri Reijne",
+           "Siwa Sardjoemissier",
+           "Barry de Vries",
+           "Jelle Witsen Elias"
+"""
+
+import random
+
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from sqlalchemy import orm
+
+# Keys used in the session info to store where queries should go.
+ROUTE_KEY = 'route'
+REPLICA_KEY = 'replica_bind'
+PRIMARY = 'primary'
+REPLICA = 'replica'
+
+
+class RoutingSession(SignallingSession):
+    """
+    Session that sends queries to a read replica when the session is marked as read-only.
+
+    Flushes always go to the primary database, so objects loaded from a replica can still be modified.
+    A session sticks to one replica so a single request sees a consistent view.
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        replicas = self.app.config.get('SQLALCHEMY_REPLICA_BINDS')
+
+        if replicas and self.info.get(ROUTE_KEY) == REPLICA and not self._flushing:
+            if REPLICA_KEY not in self.info:
+                self.info[REPLICA_KEY] = random.choice(replicas)
+
+            return get_state(self.app).db.get_engine(self.app, bind=self.info[REPLICA_KEY])
+
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """SQLAlchemy extension that uses the RoutingSession."""
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
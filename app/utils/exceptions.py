@@ -29,6 +29,7 @@ class StatusCodeError(Exception):
     """
 
     def __init__(self, response):
+        self.status_code = response.status_code
         if response.status_code == 204:
             super().__init__("204 NO CONTENT")
             return
@@ -36,10 +37,36 @@ class StatusCodeError(Exception):
             super().__init__(f"Timeout for {response.headers['Retry-After']} seconds")
             return
 
-        body = response.json()
+        try:
+            body = response.json()
+        except ValueError:
+            # Errors of proxies and load balancers (i.e. 502, 503) do not have a JSON body.
+            super().__init__(f"Status {response.status_code}")
+            return
+
         # Spotify authentication Error
         if 'error' and 'error_description' in body['error']:
             super().__init__(f"Error {body['error']['error']}: {body['error']['error_description']}")
         # Regular spotify Error
         elif 'status' and 'message' in body['error']:
             super().__init__(f"Status {body['error']['status']}: {body['error']['message']}")
+
+
+class CircuitOpenError(Exception):
+    """
+    A call was rejected because the circuit breaker of the endpoint is open.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        super().__init__(f"Circuit breaker '{name}' is open")
+
+
+class RateLimitedError(Exception):
+    """
+    A call was not made because it would have to wait longer than allowed for the rate limiter.
+    """
+
+    def __init__(self, wait):
+        self.wait = wait
+        super().__init__(f"Rate limited for {wait:.1f} seconds")
@@ -0,0 +1,331 @@
+"""
+    history.py
+    ~~~~~~~~~~~~
+    This file contains the stores that keep the listening histories and the mood series of the users, either in
+    InfluxDB or in the sql database.
+
+    :copyright: 2019 Moodify (High-Mood)
+    :authors:
+           "Stan van den Broek",
+           "Mitchell van den Bulk",
+           "Mo Diallo",
+           "Arthur van Eeden",
+           "Elijah Erven",
+           "Henok Ghebrenigus",
+           "Jonas van der Ham",
+           "Mounir El Kirafi",
+           "Esmeralda Knaap",
+           "Youri Reijne",
+           "Siwa Sardjoemissier",
+           "Barry de Vries",
+           "Jelle Witsen Elias"
+"""
+
+import calendar
+from abc import ABC, abstractmethod
+from collections import Counter
+from datetime import datetime, timedelta
+
+import requests
+from influxdb.exceptions import InfluxDBClientError, InfluxDBServerError
+from sqlalchemy.exc import SQLAlchemyError
+
+from app import app
+from app.utils import influx
+from app.utils.models import Listen, UserMood
+
+
+def get_store():
+    """
+    Returns the history store selected by HISTORY_BACKEND, either 'influxdb' or 'sql'.
+    :return: HistoryStore object.
+    """
+    if app.config.get('HISTORY_BACKEND', 'influxdb') == 'sql':
+        return SQLHistory()
+
+    return InfluxHistory()
+
+
+class HistoryStore(ABC):
+    """
+    Interface of the history stores. Listens and moods are passed as influx points, formatted as
+    {'measurement': userid, 'time': ..., 'tags': ..., 'fields': ...}, so the callers do not depend on the backend.
+    """
+    # Exceptions raised when the backend fails to store or return the history.
+    errors = ()
+
+    @abstractmethod
+    def add_listens(self, points):
+        """
+        Stores listens, a listen of a user at the same time as a stored one replaces it.
+        :param points: List of listens formatted as {'measurement': userid, 'time': ..., 'fields': {'songid': ...}}.
+        """
+
+    @abstractmethod
+    def write_buffer(self):
+        """
+        Returns a buffer that stores listens in large batches, use it as a context manager.
+        :return: Object with an add(points, on_write=None) and flush() method, on_write is called once the points
+                 are stored.
+        """
+
+    @abstractmethod
+    def iter_songs(self, userid, limit=None, duration=None, epoch=None, columns=False):
+        """
+        Yields the songs listened to by the user, most recent first, without loading the entire history at once.
+        :param userid: User id of the user.
+        :param limit: Limits the number of songs to be returned.
+        :param duration: Limits the time frame from where the songs are returned.
+        :param epoch: Return the time as epoch in this precision (i.e. 's', 'ms') instead of a RFC3339 string.
+        :param columns: Yield chunks as a tuple of lists (times, songids) instead of every song as a dict.
+        :return: Generator of songs formatted as {'time': time, 'songid': songid} or of (times, songids) chunks.
+        """
+
+    def get_songs(self, userid, limit=None, duration=None):
+        """
+        Returns the songs listened to by the user, most recent first.
+        :param userid: User id of the user.
+        :param limit: Limits the number of songs to be returned.
+        :param duration: Limits the time frame from where the songs are returned.
+        :return: List of songs formatted as {'time': time, 'songid': songid}.
+        """
+        return list(self.iter_songs(userid, limit, duration))
+
+    @abstractmethod
+    def get_recent_listens(self, userids, duration):
+        """
+        Returns the songs listened to by several users in the last duration.
+        :param userids: List of user ids.
+        :param duration: Limits the time frame from where the songs are returned.
+        :return: dict formatted as {userid: ([time, ...], [songid, ...])} with the times in seconds since the epoch,
+                 users without recent songs are left out.
+        """
+
+    @abstractmethod
+    def get_song_counts(self, userid, duration=None):
+        """
+        Counts the listens per song of the user.
+        :param userid: User id of the user.
+        :param duration: Limits the time frame from where the songs are counted.
+        :return: Counter of the listens per songid.
+        """
+
+    @abstractmethod
+    def get_top_songs(self, userid, count, duration=None):
+        """
+        Gets the top 'count' songs of the user. Only the SQL store groups and limits in the database, the InfluxDB
+        store counts a streamed scan of the duration.
+        :param userid: User id of the user.
+        :param count: Number of items to be returned.
+        :param duration: Limits the time frame from where the songs are counted.
+        :return: The top songs of the user as a list of tuples (songid, count).
+        """
+
+    @abstractmethod
+    def get_last_played_at(self, userid):
+        """
+        Gets the time of the latest listen of the user.
+        :param userid: User id of the user.
+        :return: datetime of the latest listen or None if the user has no history.
+        """
+
+    @abstractmethod
+    def add_moods(self, points):
+        """
+        Stores mean moods, formatted as {'measurement': userid, 'time': ..., 'tags': {'window': window},
+        'fields': {'excitedness': ..., 'happiness': ..., 'songcount': ...}}.
+        :param points: List of moods.
+        """
+
+    @abstractmethod
+    def get_moods(self, userid, window=None):
+        """
+        Returns the mean moods of the user, oldest first.
+        :param userid: User id of the user.
+        :param window: Only return the moods of this window (i.e. 1h, 1d, 1w etc).
+        :return: List of moods formatted as {'time': time, 'excitedness': ..., 'happiness': ..., 'songcount': ...}.
+        """
+
+    @abstractmethod
+    def delete_history(self, userid):
+        """
+        Deletes all listens and moods of the user.
+        :param userid: User id of the user.
+        """
+
+
+class InfluxHistory(HistoryStore):
+    """History store that keeps the history of every user in its own InfluxDB measurement."""
+    errors = (InfluxDBClientError, InfluxDBServerError, requests.exceptions.RequestException)
+
+    def __init__(self, client=None):
+        """
+        :param client: InfluxDB client object, defaults to the client of the current thread.
+        """
+        self.client = client or influx.get_client()
+
+    def add_listens(self, points):
+        self.client.write_points(points, database=influx.SONGS, batch_size=app.config.get('INFLUX_BATCH_SIZE', 5000))
+
+    def write_buffer(self):
+        return influx.WriteBuffer(self.client)
+
+    def iter_songs(self, userid, limit=None, duration=None, epoch=None, columns=False):
+        return influx.iter_songs(self.client, userid, limit, duration, epoch, columns)
+
+    def get_songs(self, userid, limit=None, duration=None):
+        return influx.get_songs(self.client, userid, limit, duration)
+
+    def get_recent_listens(self, userids, duration):
+        return influx.get_recent_listens(self.client, userids, duration)
+
+    def get_song_counts(self, userid, duration=None):
+        return influx.get_song_counts(self.client, userid, duration)
+
+    def get_top_songs(self, userid, count, duration=None):
+        return influx.get_top_songs(self.client, userid, count, duration)
+
+    def get_last_played_at(self, userid):
+        return influx.get_last_played_at(self.client, userid)
+
+    def add_moods(self, points):
+        self.client.write_points(points, database=influx.MOODS, batch_size=app.config.get('INFLUX_BATCH_SIZE', 5000))
+
+    def get_moods(self, userid, window=None):
+        return list(influx.get_mood(self.client, userid, window).get_points(measurement=userid))
+
+    def delete_history(self, userid):
+        self.client.query(f'delete from "{userid}"', database=influx.SONGS)
+        self.client.query(f'delete from "{userid}"', database=influx.MOODS)
+
+
+class SQLHistory(HistoryStore):
+    """
+    History store that keeps all listens in the listens table of the sql database, indexed on (userid, played_at).
+    Times are stored with second precision, like the ingest worker writes them to InfluxDB.
+    """
+    errors = (SQLAlchemyError,)
+
+    def add_listens(self, points):
+        Listen.add_listens([(point['measurement'], to_datetime(point['time']), point['fields']['songid'])
+                            for point in points])
+
+    def write_buffer(self):
+        return ListenBuffer(self)
+
+    def iter_songs(self, userid, limit=None, duration=None, epoch=None, columns=False):
+        chunk_size = app.config.get('INFLUX_CHUNK_SIZE', 10000)
+        remaining = limit or None
+        since = get_since(duration)
+        before = None
+
+        while remaining is None or remaining > 0:
+            size = chunk_size if remaining is None else min(chunk_size, remaining)
+            listens = Listen.get_listens(userid, since, before, size)
+
+            if not listens:
+                return
+
+            before = listens[-1][0]
+            times = [format_time(played_at, epoch) for played_at, _ in listens]
+            if columns:
+                yield times, [songid for _, songid in listens]
+            else:
+                yield from ({'time': played_at, 'songid': songid} for played_at, (_, songid) in zip(times, listens))
+
+            if len(listens) < size:
+                return
+            if remaining is not None:
+                remaining -= len(listens)
+
+    def get_recent_listens(self, userids, duration):
+        shard_size = app.config.get('INFLUX_USERS_PER_QUERY', 500)
+        since = get_since(duration)
+        listens = {}
+
+        for i in range(0, len(userids), shard_size):
+            for userid, played_at, songid in Listen.get_recent_listens(userids[i:i + shard_size], since):
+                times, songids = listens.setdefault(userid, ([], []))
+                times.append(format_time(played_at, 's'))
+                songids.append(songid)
+
+        return listens
+
+    def get_song_counts(self, userid, duration=None):
+        return Counter(dict(Listen.get_song_counts(userid, get_since(duration))))
+
+    def get_top_songs(self, userid, count, duration=None):
+        return [(songid, plays) for songid, plays in Listen.get_song_counts(userid, get_since(duration), count)]
+
+    def get_last_played_at(self, userid):
+        return Listen.get_last_played_at(userid)
+
+    def add_moods(self, points):
+        UserMood.add_moods([{'userid': point['measurement'],
+                             'window': point.get('tags', {}).get('window', ''),
+                             'time': to_datetime(point['time']),
+                             **point['fields']} for point in points])
+
+    def get_moods(self, userid, window=None):
+        return [{'time': format_time(mood.time),
+                 'excitedness': mood.excitedness,
+                 'happiness': mood.happiness,
+                 'songcount': mood.songcount} for mood in UserMood.get_moods(userid, window)]
+
+    def delete_history(self, userid):
+        Listen.delete_listens(userid)
+        UserMood.delete_moods(userid)
+
+
+class ListenBuffer(influx.BatchBuffer):
+    """
+    Collects listens, of any number of users, and stores them in batches of INFLUX_BATCH_SIZE listens.
+    A batch that fails stays in the buffer for the next flush.
+    Use it as a context manager to store the remaining listens on exit.
+    """
+
+    def __init__(self, store, batch_size=None):
+        """
+        :param store: HistoryStore to store the listens in.
+        :param batch_size: Number of listens per batch, defaults to INFLUX_BATCH_SIZE.
+        """
+        super().__init__(batch_size)
+        self.store = store
+        self.errors = store.errors
+
+    def _write(self, batch):
+        self.store.add_listens(batch)
+
+
+def get_since(duration):
+    """
+    Converts a duration to the moment it started.
+    :param duration: Duration string (i.e. 1h, 1d, 1w etc) or None.
+    :return: naive datetime in UTC or None.
+    """
+    return datetime.utcnow() - timedelta(seconds=influx.duration_seconds(duration)) if duration else None
+
+
+def to_datetime(timestamp):
+    """
+    Converts the time of a point to a naive datetime in UTC with second precision.
+    :param timestamp: RFC3339 timestamp string or datetime.
+    :return: datetime object.
+    """
+    if isinstance(timestamp, str):
+        timestamp = influx.parse_time(timestamp)
+
+    return timestamp.replace(microsecond=0)
+
+
+def format_time(played_at, epoch=None):
+    """
+    Formats a datetime like InfluxDB returns times.
+    :param played_at: naive datetime in UTC.
+    :param epoch: Return the time as epoch in this precision (i.e. 's', 'ms') instead of a RFC3339 string.
+    :return: RFC3339 string or integer.
+    """
+    if epoch:
+        return calendar.timegm(played_at.timetuple()) * 10 ** 9 // influx.EPOCH_NANOSECONDS[epoch]
+
+    return f"{played_at.isoformat()}Z"
@@ -20,29 +20,215 @@
            "Jelle Witsen Elias"
 """
 
+import gzip
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter
+
+import requests
+from dateutil.parser import isoparse
 from influxdb import InfluxDBClient
+from influxdb.exceptions import InfluxDBServerError
+from influxdb.line_protocol import make_lines
 
 from app import app
+from app.utils.influx_memory import MemoryClient
+
+SONGS = 'songs'
+MOODS = 'moods'
+# Nanoseconds per unit of the epoch precisions supported by InfluxDB.
+EPOCH_NANOSECONDS = {'h': 3600 * 10 ** 9, 'm': 60 * 10 ** 9, 's': 10 ** 9, 'ms': 10 ** 6, 'u': 10 ** 3, 'ns': 1}
+# Seconds per unit of the durations supported by InfluxDB.
+DURATION_SECONDS = {'w': 604800, 'd': 86400, 'h': 3600, 'm': 60, 's': 1, 'ms': 10 ** -3, 'u': 10 ** -6, 'µ': 10 ** -6,
+                    'ns': 10 ** -9}
+
+# Every thread keeps its own client, since the client and its session are not thread-safe.
+_local = threading.local()
+# The in-memory client is shared by all threads of the process, so they all see the same data.
+_memory_client = MemoryClient(databases=[SONGS, MOODS])
 
 
-def create_client(host, port, database='songs'):
+def get_client():
     """
-    Creates the connection to the influx database songs.
-    :param host: Host ip of the InfluxDB.
-    :param port: Host port of the InfluxDB.
-    :param database: database to use.
+    Returns the InfluxDB client of the current process and thread, creating it on first use.
+    The client keeps its HTTP connections alive, so they are reused by every query of this thread.
+    The database is not set on the client, it is passed along with every query and write instead.
+    When INFLUX_BACKEND is 'memory' the in-memory stand-in of the process is returned instead.
     :return: Client object from the InfluxDB.
     """
-    client = InfluxDBClient(host=host, port=port, username=app.config['INFLUX_USER'],
-                            password=app.config['INFLUX_PASSWORD'], database=database)
+    if app.config.get('INFLUX_BACKEND', 'influxdb') == 'memory':
+        return _memory_client
+
+    key = (os.getpid(), app.config['INFLUX_HOST'], app.config['INFLUX_PORT'])
+
+    if getattr(_local, 'key', None) != key:
+        _local.client = InfluxDBClient(host=app.config['INFLUX_HOST'], port=app.config['INFLUX_PORT'],
+                                       username=app.config['INFLUX_USER'], password=app.config['INFLUX_PASSWORD'],
+                                       timeout=app.config.get('INFLUX_TIMEOUT'),
+                                       retries=app.config.get('INFLUX_RETRIES', 3),
+                                       pool_size=app.config.get('INFLUX_POOL_SIZE', 10))
+        _local.key = key
+
+    return _local.client
+
+
+class BatchBuffer(object):
+    """
+    Collects points, of any number of users, and stores them in batches. A batch that fails with one of the errors
+    stays in the buffer for the next flush. Use it as a context manager to store the remaining points on exit.
+    Subclasses implement _write to store a batch.
+    """
+    # Exceptions of a failed write, other exceptions are not expected and do not keep the batch.
+    errors = ()
+
+    def __init__(self, batch_size=None):
+        """
+        :param batch_size: Number of points per batch, defaults to INFLUX_BATCH_SIZE.
+        """
+        self.batch_size = batch_size or app.config.get('INFLUX_BATCH_SIZE', 5000)
+        self.points = []
+        self.lock = threading.Lock()
+        # Callbacks waiting for their points to be written, as tuples (number of points added up to and including
+        # the points of the callback, callback).
+        self.callbacks = []
+        self.added = 0
+        self.written = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+    def add(self, points, on_write=None):
+        """
+        Adds points to the buffer and writes full batches.
+        :param points: List of points formatted as {'measurement': ..., 'time': ..., 'tags': ..., 'fields': ...}.
+        :param on_write: Function that is called once all these points are written, it is never called for points
+                         that are not written.
+        """
+        with self.lock:
+            self.points.extend(points)
+            self.added += len(points)
+            if on_write is not None:
+                self.callbacks.append((self.added, on_write))
+            full = len(self.points) >= self.batch_size
+
+        if full:
+            self.flush(full_batches_only=True)
+
+    def flush(self, full_batches_only=False):
+        """
+        Writes the buffered points.
+        :param full_batches_only: Only write complete batches and keep the remaining points buffered.
+        """
+        while True:
+            with self.lock:
+                if not self.points or (full_batches_only and len(self.points) < self.batch_size):
+                    return
+                batch = self.points[:self.batch_size]
+                del self.points[:self.batch_size]
+
+            try:
+                self._write(batch)
+            except self.errors:
+                # Keep the batch, so it is written with the next flush.
+                with self.lock:
+                    self.points[:0] = batch
+                raise
+
+            self._run_callbacks(len(batch))
+
+    def _write(self, batch):
+        raise NotImplementedError
+
+    def _run_callbacks(self, written):
+        """
+        Calls the callbacks whose points are all written. The points are written in the order they were added, so
+        this holds for the callbacks up to the number of written points.
+        :param written: Number of points that were just written.
+        """
+        with self.lock:
+            self.written += written
+
+        while True:
+            with self.lock:
+                if not self.callbacks or self.callbacks[0][0] > self.written:
+                    return
+                _, callback = self.callbacks.pop(0)
+
+            callback()
+
+
+class WriteBuffer(BatchBuffer):
+    """
+    Collects points, of any number of users, and writes them in large batches of gzip compressed line protocol.
+    Batches that fail are retried with a backoff, if they keep failing they stay in the buffer for the next flush.
+    Use it as a context manager to flush the remaining points on exit.
+    """
+    errors = (InfluxDBServerError, requests.exceptions.RequestException)
+
+    def __init__(self, client=None, database=SONGS, batch_size=None, precision='s', retries=None):
+        """
+        :param client: InfluxDB client object, defaults to the client of the current thread.
+        :param database: Database to write the points to.
+        :param batch_size: Number of points per write, defaults to INFLUX_BATCH_SIZE.
+        :param precision: Time precision of the points, either 's', 'ms', 'u' or 'n'.
+        :param retries: Number of retries of a failed batch, defaults to INFLUX_WRITE_RETRIES.
+        """
+        super().__init__(batch_size)
+        self.client = client or get_client()
+        self.database = database
+        self.precision = precision
+        self.retries = app.config.get('INFLUX_WRITE_RETRIES', 3) if retries is None else retries
+
+    def _write(self, batch):
+        if isinstance(self.client, MemoryClient):
+            self.client.write_points(batch, time_precision=self.precision, database=self.database)
+            return
+
+        data = gzip.compress(make_lines({'points': batch}, self.precision).encode('utf-8'))
+        headers = {'Content-Type': 'application/octet-stream', 'Content-Encoding': 'gzip'}
+        params = {'db': self.database, 'precision': self.precision}
 
-    return client
+        for attempt in range(self.retries + 1):
+            try:
+                self.client.request(url="write", method='POST', params=params, data=data,
+                                    expected_response_code=204, headers=headers)
+                return
+            except (InfluxDBServerError, requests.exceptions.RequestException):
+                if attempt == self.retries:
+                    raise
+                time.sleep(2 ** attempt * (1 + random.random()) / 10)
 
 
-def get_mood(client, userid):
-    client.switch_database('moods')
+def get_mood(client, userid, window=None):
+    """
+    Returns the mean moods of the user, oldest first.
+    :param client: InfluxDB client object.
+    :param userid: User id of the user.
+    :param window: Only return the moods of this window (i.e. 1h, 1d, 1w etc).
+    :return: ResultSet of the moods.
+    """
+    window_filter = f" where \"window\" = '{window}'" if window else ""
 
-    return client.query(f'select excitedness, happiness, songcount from "{userid}"')
+    return client.query(f'select excitedness, happiness, songcount from "{userid}"{window_filter}', database=MOODS)
+
+
+def get_moods_per_window(client, userid):
+    """
+    Returns all mean moods of the user per window, moods stored before they had a window are under ''.
+    :param client: InfluxDB client object.
+    :param userid: User id of the user.
+    :return: dict formatted as {window: [{'time': time, 'excitedness': ..., 'happiness': ..., 'songcount': ...}]}.
+    """
+    result = client.query(f'select excitedness, happiness, songcount from "{userid}" group by "window"',
+                          database=MOODS)
+
+    return {(tags or {}).get('window', ''): list(points) for (_, tags), points in result.items()}
 
 
 def get_top(items, count):
@@ -56,10 +242,7 @@ def get_top(items, count):
     if not items:
         return []
 
-    items_count = [(item, items.count(item)) for item in items if item]
-    top_items = sorted(set(items_count), key=lambda x: x[1], reverse=True)
-
-    return top_items[:count]
+    return Counter(item for item in items if item).most_common(count)
 
 
 def get_songs(client, userid, limit=None, duration=None):
@@ -76,12 +259,12 @@ def get_songs(client, userid, limit=None, duration=None):
 
     filters = ""
     if duration:
-        filters += f" where time > now()-{duration}"
+        filters += f" where time > now()-{check_duration(duration)}"
     filters += " order by time desc"
     if limit:
         filters += f" limit {limit}"
 
-    result = client.query(f'select songid from "{userid}"{filters}')
+    result = client.query(f'select songid from "{userid}"{filters}', database=SONGS)
 
     if not result:
         return []
@@ -89,14 +272,153 @@ def get_songs(client, userid, limit=None, duration=None):
     return list(result.get_points(measurement=userid))
 
 
-def get_top_songs(client, userid, count):
+def iter_songs(client, userid, limit=None, duration=None, epoch=None, columns=False, chunk_size=None):
     """
-    Gets the top 'count' songs of user
+    Yields the songs listened to by the user, most recent first, without loading the entire history at once.
+    The history is queried in chunks, every chunk continues before the oldest song of the previous chunk.
+    :param client: InfluxDB client object.
+    :param userid: User id of the user.
+    :param limit: Limits the number of songs to be returned.
+    :param duration: Limits the time frame from where the songs are returned.
+    :param epoch: Return the time as epoch in this precision (i.e. 's', 'ms') instead of a RFC3339 string.
+    :param columns: Yield every chunk as a tuple of lists (times, songids) instead of every song as a dict.
+    :param chunk_size: Number of songs per query, defaults to INFLUX_CHUNK_SIZE.
+    :return: Generator of songs formatted as {'time': time, 'songid': songid} or of (times, songids) chunks.
+    """
+    chunk_size = chunk_size or app.config.get('INFLUX_CHUNK_SIZE', 10000)
+    remaining = limit or None
+    duration_filter = [f"time > now()-{check_duration(duration)}"] if duration else []
+    cursor = []
+
+    while remaining is None or remaining > 0:
+        size = chunk_size if remaining is None else min(chunk_size, remaining)
+        filters = " and ".join(duration_filter + cursor)
+        filters = f" where {filters}" if filters else ""
+
+        # The cursor always uses exact nanosecond times, so no songs are skipped when converting to the epoch.
+        result = client.query(f'select songid from "{userid}"{filters} order by time desc limit {size}',
+                              database=SONGS, epoch='ns' if epoch else None)
+        points = list(result.get_points(measurement=userid))
+
+        if not points:
+            return
+
+        cursor = [f"time < {points[-1]['time']}" if epoch else f"time < '{points[-1]['time']}'"]
+        if epoch:
+            for point in points:
+                point['time'] //= EPOCH_NANOSECONDS[epoch]
+
+        if columns:
+            yield [point['time'] for point in points], [point['songid'] for point in points]
+        else:
+            yield from points
+
+        if len(points) < size:
+            return
+        if remaining is not None:
+            remaining -= len(points)
+
+
+def get_recent_listens(client, userids, duration):
+    """
+    Returns the songs listened to by several users in the last duration. The users are queried together, in shards
+    of INFLUX_USERS_PER_QUERY users per query.
+    :param client: InfluxDB client object.
+    :param userids: List of user ids.
+    :param duration: Limits the time frame from where the songs are returned.
+    :return: dict formatted as {userid: ([time, ...], [songid, ...])} with the times in seconds since the epoch,
+             users without recent songs are left out.
+    """
+    shard_size = app.config.get('INFLUX_USERS_PER_QUERY', 500)
+    check_duration(duration)
+    listens = {}
+
+    for i in range(0, len(userids), shard_size):
+        measurements = ",".join(f'"{userid}"' for userid in userids[i:i + shard_size])
+        # A POST request is used, since the list of measurements can be too long for an URL.
+        result = client.query(f'select songid from {measurements} where time > now()-{duration}',
+                              database=SONGS, epoch='s', method="POST")
+
+        for (measurement, _), points in result.items():
+            times, songids = listens.setdefault(measurement, ([], []))
+            for point in points:
+                times.append(point['time'])
+                songids.append(point['songid'])
+
+    return listens
+
+
+def duration_seconds(duration):
+    """
+    Converts an InfluxDB duration (i.e. 1h, 1d, 1w or 1h30m) to seconds.
+    :param duration: Duration string.
+    :return: Number of seconds.
+    """
+    parts = re.findall(r'(\d+)(ns|u|µ|ms|s|m|h|d|w)', duration)
+    if not parts or "".join(value + unit for value, unit in parts) != duration:
+        raise ValueError(f"Invalid duration '{duration}'")
+
+    return sum(int(value) * DURATION_SECONDS[unit] for value, unit in parts)
+
+
+def check_duration(duration):
+    """
+    Checks that a duration is valid before it is put into a query.
+    :param duration: Duration string (i.e. 1h, 1d, 1w or 1h30m).
+    :return: The duration.
+    :raises ValueError: If the duration is not valid.
+    """
+    duration_seconds(duration)
+    return duration
+
+
+def get_song_counts(client, userid, duration=None):
+    """
+    Counts the listens per song of the user. The songid is a field and not a tag, so InfluxQL cannot group on it and
+    the listens within the duration are streamed in chunks, only the counters are kept in memory.
+    :param client: InfluxDB client object.
+    :param userid: User id of the user.
+    :param duration: Limits the time frame from where the songs are counted.
+    :return: Counter of the listens per songid, songs with the same count are ordered on their most recent listen.
+    """
+    counts = Counter()
+    for _, songids in iter_songs(client, userid, duration=duration, columns=True):
+        counts.update(songid for songid in songids if songid)
+
+    return counts
+
+
+def get_top_songs(client, userid, count, duration=None):
+    """
+    Gets the top 'count' songs of user. The counting is not pushed down to InfluxDB, use the SQL history store when
+    the top songs over long durations are requested often.
     :param client: InfluxDB client object.
     :param userid: User id of the user.
     :param count: Number of items to be returned.
-    :return: The top songs of the user.
+    :param duration: Limits the time frame from where the songs are counted.
+    :return: The top songs of the user as a list of tuples (songid, count).
+    """
+    return get_song_counts(client, userid, duration).most_common(count)
+
+
+def get_last_played_at(client, userid):
+    """
+    Gets the time of the latest listen of the user.
+    :param client: InfluxDB client object.
+    :param userid: User id of the user.
+    :return: datetime of the latest listen or None if the user has no history.
+    """
+    result = client.query(f'select last(songid) from "{userid}"', database=SONGS)
+    points = list(result.get_points(measurement=userid))
+
+    return parse_time(points[0]['time']) if points else None
+
+
+def parse_time(timestamp):
+    """
+    Converts a RFC3339 timestamp, as used by InfluxDB and Spotify, to a naive datetime in UTC.
+    :param timestamp: RFC3339 timestamp string.
+    :return: datetime object.
     """
-    songs = get_songs(client, userid)
+    return isoparse(timestamp).replace(tzinfo=None)
 
-    return get_top([song['songid'] for song in songs], count)
@@ -0,0 +1,440 @@
+"""
+    influx_memory.py
+    ~~~~~~~~~~~~
+    This file contains an in-memory stand-in for the InfluxDB client, which can be used instead of a running InfluxDB
+    for tests, load tests and benchmarks.
+
+    :copyright: 2019 Moodify (High-Mood)
+    :authors:
+           "Stan van den Broek",
+           "Mitchell van den Bulk",
+           "Mo Diallo",
+           "Arthur van Eeden",
+           "Elijah Erven",
+           "Henok Ghebrenigus",
+           "Jonas van der Ham",
+           "Mounir El Kirafi",
+           "Esmeralda Knaap",
+           "Youri Reijne",
+           "Siwa Sardjoemissier",
+           "Barry de Vries",
+           "Jelle Witsen Elias"
+"""
+
+import bisect
+import calendar
+import datetime
+import re
+import threading
+import time
+
+from dateutil.parser import isoparse, parse
+from influxdb.exceptions import InfluxDBClientError
+from influxdb.resultset import ResultSet
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+# Nanoseconds per unit of the write precisions and epochs.
+PRECISION_NANOSECONDS = {None: 1, 'n': 1, 'ns': 1, 'u': 10 ** 3, 'ms': 10 ** 6, 's': 10 ** 9, 'm': 60 * 10 ** 9,
+                         'h': 3600 * 10 ** 9}
+# Nanoseconds per unit of the durations in a query.
+DURATION_NANOSECONDS = {'w': 604800 * 10 ** 9, 'd': 86400 * 10 ** 9, 'h': 3600 * 10 ** 9, 'm': 60 * 10 ** 9,
+                        's': 10 ** 9, 'ms': 10 ** 6, 'u': 10 ** 3, 'µ': 10 ** 3, 'ns': 1}
+
+SELECT = re.compile(r'^select (?P<fields>.+?) from (?P<source>\S+)(?: where (?P<where>.+?))?'
+                    r'(?: group by (?P<group>.+?))?(?: order by time (?P<order>asc|desc))?(?: limit (?P<limit>\d+))?$',
+                    re.IGNORECASE | re.DOTALL)
+DELETE = re.compile(r'^delete from (?P<source>\S+)(?: where (?P<where>.+))?$', re.IGNORECASE | re.DOTALL)
+CONDITION = re.compile(r'^(?P<key>"[^"]+"|\w+) *(?P<operator>>=|<=|!=|=|>|<) *(?P<value>.+)$')
+FUNCTION = re.compile(r'^(?P<function>\w+)\((?P<arguments>.*)\)(?: as (?P<alias>"[^"]+"|\w+))?$', re.IGNORECASE)
+TIMESTAMP = re.compile(r'^(?P<seconds>.+T\d\d:\d\d:\d\d)(?:\.(?P<fraction>\d{1,9}))?Z$')
+
+
+class Measurement(object):
+    """The points of one measurement, kept sorted on time in parallel lists."""
+
+    def __init__(self):
+        self.times = []
+        self.points = []
+
+    def insert(self, timestamp, tags, fields):
+        """
+        Inserts a point, a point with the same time and tags as an existing point overwrites its fields.
+        :param timestamp: Time of the point in nanoseconds since the epoch.
+        :param tags: dict of the tags of the point.
+        :param fields: dict of the fields of the point.
+        """
+        index = bisect.bisect_right(self.times, timestamp)
+
+        i = index
+        while i > 0 and self.times[i - 1] == timestamp:
+            i -= 1
+            if self.points[i][0] == tags:
+                self.points[i][1].update(fields)
+                return
+
+        self.times.insert(index, timestamp)
+        self.points.insert(index, (tags, dict(fields)))
+
+    def range(self, lower=None, upper=None):
+        """
+        Returns the indices of the points within a time range.
+        :param lower: Tuple (time, inclusive) of the lower bound or None.
+        :param upper: Tuple (time, inclusive) of the upper bound or None.
+        :return: range of indices, ordered on time.
+        """
+        start, end = 0, len(self.times)
+        if lower:
+            start = (bisect.bisect_left if lower[1] else bisect.bisect_right)(self.times, lower[0])
+        if upper:
+            end = (bisect.bisect_right if upper[1] else bisect.bisect_left)(self.times, upper[0])
+
+        return range(start, max(start, end))
+
+
+class MemoryClient(object):
+    """
+    Stand-in for the InfluxDB client that keeps every database in memory. It supports the InfluxQL used by this
+    application: selecting fields, count and last, filtering on time and tags, grouping by tags, ordering on time,
+    limits and deleting points. One client is meant to be shared, so it is thread-safe.
+    """
+
+    def __init__(self, databases=()):
+        """
+        :param databases: Names of the databases to create.
+        """
+        self.databases = {database: {} for database in databases}
+        self.database = None
+        self.lock = threading.RLock()
+
+    def create_database(self, dbname):
+        with self.lock:
+            self.databases.setdefault(dbname, {})
+
+    def drop_database(self, dbname):
+        with self.lock:
+            self.databases.pop(dbname, None)
+
+    def switch_database(self, database):
+        self.database = database
+
+    def get_list_database(self):
+        return [{'name': database} for database in self.databases]
+
+    def close(self):
+        pass
+
+    def write_points(self, points, time_precision=None, database=None, retention_policy=None, tags=None,
+                     batch_size=None, protocol='json'):
+        """
+        Writes points formatted as {'measurement': ..., 'time': ..., 'tags': ..., 'fields': ...}.
+        :param points: List of points.
+        :param time_precision: Precision of the times, either 's', 'm', 'ms', 'u' or None for nanoseconds.
+        :param database: Database to write to, defaults to the database of the client.
+        :param retention_policy: Ignored, there are no retention policies.
+        :param tags: Tags added to every point.
+        :param batch_size: Ignored, all points are written at once.
+        :param protocol: Only 'json' is supported.
+        :return: True.
+        """
+        if protocol != 'json':
+            raise InfluxDBClientError("Only the json protocol is supported")
+
+        now = time.time()
+        with self.lock:
+            measurements = self._get_database(database or self.database, 404)
+            for point in points:
+                # Like InfluxDB, the times are truncated to the precision.
+                if 'time' in point:
+                    timestamp = int(convert_timestamp(point['time'], time_precision))
+                else:
+                    timestamp = int(now * 10 ** 9) // PRECISION_NANOSECONDS[time_precision]
+                point_tags = {key: str(value) for key, value in {**(tags or {}), **point.get('tags', {})}.items()}
+                measurement = measurements.setdefault(point['measurement'], Measurement())
+                measurement.insert(timestamp * PRECISION_NANOSECONDS[time_precision], point_tags, point['fields'])
+
+        return True
+
+    def query(self, query, params=None, epoch=None, expected_response_code=200, database=None, raise_errors=True,
+              chunked=False, chunk_size=0, method="GET"):
+        """
+        Executes a single InfluxQL select or delete statement.
+        :param query: The InfluxQL statement.
+        :param epoch: Return the time as epoch in this precision (i.e. 's', 'ms') instead of a RFC3339 string.
+        :param database: Database to query, defaults to the database of the client.
+        :return: ResultSet, like the InfluxDB client.
+        """
+        query = query.strip()
+        now = int(time.time() * 10 ** 9)
+
+        with self.lock:
+            measurements = self._get_database(database or self.database, 200)
+            delete = DELETE.match(query)
+            if delete:
+                self._delete(measurements, delete, now)
+                return ResultSet({})
+
+            series = self._select(measurements, query, now)
+
+        for result in series:
+            for row in result['values']:
+                row[0] = row[0] // PRECISION_NANOSECONDS[epoch] if epoch else format_time(row[0])
+
+        return ResultSet({'series': series} if series else {})
+
+    def _get_database(self, database, status_code):
+        if database not in self.databases:
+            raise InfluxDBClientError(f"database not found: {database}", status_code)
+
+        return self.databases[database]
+
+    def _delete(self, measurements, statement, now):
+        lower, upper, tag_filters = parse_where(statement.group('where'), now)
+
+        for name in match_measurements(measurements, statement.group('source')):
+            measurement = measurements[name]
+            removed = {i for i in measurement.range(lower, upper) if matches(measurement.points[i][0], tag_filters)}
+            measurement.times = [t for i, t in enumerate(measurement.times) if i not in removed]
+            measurement.points = [point for i, point in enumerate(measurement.points) if i not in removed]
+            if not measurement.times:
+                del measurements[name]
+
+    def _select(self, measurements, query, now):
+        """
+        Executes a select statement.
+        :return: List of series formatted as {'name': ..., 'tags': ..., 'columns': ..., 'values': ...}, the times are
+                 in nanoseconds.
+        """
+        statement = SELECT.match(query)
+        if not statement:
+            raise InfluxDBClientError(f"unsupported query: {query}")
+
+        lower, upper, tag_filters = parse_where(statement.group('where'), now)
+        group_by = [tag.strip().strip('"') for tag in statement.group('group').split(',')] \
+            if statement.group('group') else []
+        descending = (statement.group('order') or '').lower() == 'desc'
+        limit = int(statement.group('limit')) if statement.group('limit') else None
+        fields = [parse_field(field) for field in split_arguments(statement.group('fields'))]
+
+        # Collect the matching points of every series as (time, tags, fields), ordered on time.
+        series = {}
+        # Plain selects without groups stop at the limit, so only the returned points are visited.
+        plain = not group_by and all(function is None for function, _, _ in fields)
+        keys = [key for _, (key,), _ in fields]
+        for name in match_measurements(measurements, statement.group('source')):
+            measurement = measurements[name]
+            indices = measurement.range(lower, upper)
+            groups = {}
+            for i in reversed(indices) if descending else indices:
+                tags, point_fields = measurement.points[i]
+                if not matches(tags, tag_filters):
+                    continue
+                rows = groups.setdefault(tuple((tag, tags.get(tag, '')) for tag in group_by), [])
+                if plain:
+                    if not any(point_fields.get(key, tags.get(key)) is not None for key in keys):
+                        continue
+                    if limit is not None and len(rows) == limit:
+                        break
+                rows.append((measurement.times[i], tags, point_fields))
+            for tags, rows in groups.items():
+                series[(name, tags)] = rows[::-1] if descending else rows
+
+        results = []
+        for (name, tags), rows in sorted(series.items()):
+            columns, values = select_fields(fields, rows, lower)
+            if descending:
+                values.reverse()
+            if limit is not None:
+                values = values[:limit]
+            if values:
+                result = {'name': name, 'columns': columns, 'values': values}
+                if tags:
+                    result['tags'] = dict(tags)
+                results.append(result)
+
+        return results
+
+
+def select_fields(fields, rows, lower):
+    """
+    Computes the selected columns of the rows of one series.
+    :param fields: List of parsed fields (function, arguments, name).
+    :param rows: List of rows (time, tags, fields) ordered on time.
+    :param lower: The lower bound of the time range, used as the time of aggregations.
+    :return: Tuple (columns, values).
+    """
+    columns = ['time'] + [name for _, _, name in fields]
+
+    def value(row, key):
+        return row[2].get(key, row[1].get(key))
+
+    if all(function is None for function, _, _ in fields):
+        values = [[row[0]] + [value(row, key) for _, (key,), _ in fields] for row in rows]
+        return columns, [row for row in values if any(column is not None for column in row[1:])]
+
+    row = [lower[0] if lower else 0]
+    for function, (key,), _ in fields:
+        present = [candidate for candidate in rows if value(candidate, key) is not None]
+        if function == 'count':
+            row.append(len(present))
+        elif function == 'last':
+            if not present:
+                return columns, []
+            row.append(value(present[-1], key))
+            if len(fields) == 1:
+                row[0] = present[-1][0]
+        else:
+            raise InfluxDBClientError(f"unsupported function: {function}")
+
+    return columns, [row] if any(row[1:]) else []
+
+
+def parse_field(field):
+    """
+    Parses a selected field, i.e. 'songid', or 'count(songid) as plays'.
+    :param field: Field expression.
+    :return: Tuple (function or None, arguments, column name).
+    """
+    function = FUNCTION.match(field)
+    if function:
+        arguments = [argument.strip().strip('"') for argument in split_arguments(function.group('arguments'))]
+        name = function.group('alias') or function.group('function')
+        return function.group('function').lower(), arguments, name.strip('"')
+
+    return None, [field.strip('"')], field.strip('"')
+
+
+def split_arguments(text):
+    """
+    Splits a comma separated list, without splitting within parentheses.
+    :param text: Comma separated list.
+    :return: List of stripped items.
+    """
+    items, depth, start = [], 0, 0
+    for i, character in enumerate(text):
+        depth += {'(': 1, ')': -1}.get(character, 0)
+        if character == ',' and depth == 0:
+            items.append(text[start:i].strip())
+            start = i + 1
+
+    return items + [text[start:].strip()]
+
+
+def parse_where(where, now):
+    """
+    Parses a where clause of conditions joined by 'and'.
+    :param where: The where clause or None.
+    :param now: The current time in nanoseconds.
+    :return: Tuple (lower, upper, tag_filters), the bounds are tuples (time, inclusive) or None and the tag filters
+             are tuples (key, operator, value).
+    """
+    lower, upper, tag_filters = None, None, []
+
+    for condition in re.split(r' and ', where or '', flags=re.IGNORECASE):
+        if not condition.strip():
+            continue
+        match = CONDITION.match(condition.strip())
+        if not match:
+            raise InfluxDBClientError(f"unsupported condition: {condition}")
+
+        key, operator, value = match.group('key').strip('"'), match.group('operator'), match.group('value').strip()
+        if key == 'time':
+            bound = (parse_time_value(value, now), '=' in operator)
+            if operator.startswith('>'):
+                lower = bound if lower is None or bound[0] > lower[0] else lower
+            else:
+                upper = bound if upper is None or bound[0] < upper[0] else upper
+        else:
+            tag_filters.append((key, operator, value.strip("'")))
+
+    return lower, upper, tag_filters
+
+
+def parse_time_value(value, now):
+    """
+    Parses the time of a condition: now()-duration, a RFC3339 string or nanoseconds since the epoch.
+    :param value: The value of the condition.
+    :param now: The current time in nanoseconds.
+    :return: Time in nanoseconds since the epoch.
+    """
+    value = value.replace(' ', '')
+    if value.startswith('now()'):
+        offset = value[len('now()'):]
+        parts = re.findall(r'(\d+)(ns|u|µ|ms|s|m|h|d|w)', offset[1:])
+        nanoseconds = sum(int(amount) * DURATION_NANOSECONDS[unit] for amount, unit in parts)
+        return now - nanoseconds if offset.startswith('-') else now + nanoseconds
+
+    if value.startswith("'"):
+        timestamp = TIMESTAMP.match(value.strip("'"))
+        if not timestamp:
+            raise InfluxDBClientError(f"invalid time: {value}")
+        seconds = calendar.timegm(isoparse(timestamp.group('seconds')).timetuple())
+        return seconds * 10 ** 9 + int((timestamp.group('fraction') or '').ljust(9, '0'))
+
+    return int(value)
+
+
+def convert_timestamp(timestamp, precision=None):
+    """
+    Converts the time of a written point to the write precision, like the InfluxDB client does before sending it.
+    The client converts through floating point seconds, so strings and datetimes lose the same nanoseconds here.
+    :param timestamp: Integer in the write precision, RFC3339 string or datetime, naive datetimes are in UTC.
+    :param precision: Write precision of the point.
+    :return: Time in the write precision.
+    """
+    if isinstance(timestamp, int):
+        return timestamp
+
+    if isinstance(timestamp, str):
+        timestamp = parse(timestamp)
+
+    if isinstance(timestamp, datetime.datetime):
+        if not timestamp.tzinfo:
+            timestamp = timestamp.replace(tzinfo=datetime.timezone.utc)
+
+        nanoseconds = (timestamp - EPOCH).total_seconds() * 1e9
+        return nanoseconds / PRECISION_NANOSECONDS[precision]
+
+    raise ValueError(timestamp)
+
+
+def format_time(nanoseconds):
+    """
+    Formats a time as RFC3339 string with nanosecond precision, like InfluxDB.
+    :param nanoseconds: Time in nanoseconds since the epoch.
+    :return: RFC3339 string.
+    """
+    seconds, fraction = divmod(nanoseconds, 10 ** 9)
+    text = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(seconds))
+
+    return f"{text}.{fraction:09d}".rstrip('0') + 'Z' if fraction else text + 'Z'
+
+
+def matches(tags, tag_filters):
+    """
+    Checks the tags of a point against tag filters, a missing tag equals an empty string.
+    :param tags: dict of the tags of the point.
+    :param tag_filters: List of tuples (key, operator, value).
+    :return: True if all filters match.
+    """
+    for key, operator, value in tag_filters:
+        if operator not in ('=', '!='):
+            raise InfluxDBClientError(f"unsupported operator on {key}: {operator}")
+        if (tags.get(key, '') == value) != (operator == '='):
+            return False
+
+    return True
+
+
+def match_measurements(measurements, source):
+    """
+    Returns the names of the measurements of a from clause, either a list of names or a /regex/.
+    :param measurements: dict of the measurements of the database.
+    :param source: The from clause.
+    :return: List of measurement names that exist.
+    """
+    if source.startswith('/') and source.endswith('/'):
+        pattern = re.compile(source[1:-1])
+        return sorted(name for name in measurements if pattern.search(name))
+
+    names = (name.strip().strip('"') for name in split_arguments(source))
+    return [name for name in names if name in measurements]
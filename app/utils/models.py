@@ -21,8 +21,54 @@
 """
 
 import datetime
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+
+from sqlalchemy.ext.declarative import declared_attr
 
 from app import db
+from app.utils.database import ROUTE_KEY, PRIMARY, REPLICA
+
+
+@contextmanager
+def _route(target):
+    """Route the queries of the current session to target for the duration of the block."""
+    info = db.session.info
+    previous = info.get(ROUTE_KEY)
+    # Once pinned to the primary database, nested read-only blocks do not move away from it.
+    if previous != PRIMARY:
+        info[ROUTE_KEY] = target
+    try:
+        yield
+    finally:
+        info[ROUTE_KEY] = previous
+
+
+def primary():
+    """
+    Pin all queries within the block to the primary database, used for read-after-write paths.
+    """
+    return _route(PRIMARY)
+
+
+def read_replica():
+    """
+    Route all reads within the block to a read replica, if one is configured.
+    """
+    return _route(REPLICA)
+
+
+def read_only(func):
+    """
+    Decorator that routes the reads of func to a read replica, if one is configured.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with read_replica():
+            return func(*args, **kwargs)
+
+    return wrapper
 
 
 class User(db.Model):
@@ -39,6 +85,11 @@ class User(db.Model):
     is_premium = db.Column(db.Boolean(), default=False)
     refresh_token = db.Column(db.String(300))
     user_is_active = db.Column(db.Boolean())
+    last_played_at = db.Column(db.DateTime())
+    # The listen counters only cover the entire history once they were counted from it by verify_listen_counts.
+    counts_verified = db.Column(db.Boolean(), default=False, nullable=False)
+    # Likewise the mood rollups only cover the entire history once they were rebuilt from it.
+    rollups_verified = db.Column(db.Boolean(), default=False, nullable=False)
 
     @staticmethod
     def create_if_not_exist(json_info, refresh_token):
@@ -62,6 +113,7 @@ class User(db.Model):
             db.session.commit()
 
     @staticmethod
+    @read_only
     def get_user(userid):
         """
         Get a user based on it's userid.
@@ -82,6 +134,70 @@ class User(db.Model):
         """Get a list of all refresh tokens."""
         return [r.refresh_token for r in db.session.query(User.refresh_token)]
 
+    @staticmethod
+    def get_last_played_at(userid):
+        """
+        Get the time of the latest listen of the user that was ingested.
+        :param userid: unique identifier for a user.
+        :return: datetime of the latest listen or None if nothing was ingested yet.
+        """
+        user = User.query.filter_by(userid=userid).first()
+        return user.last_played_at if user else None
+
+    @staticmethod
+    def set_last_played_at(userid, played_at):
+        """
+        Set the time of the latest listen of the user that was ingested.
+        :param userid: unique identifier for a user.
+        :param played_at: datetime of the latest listen.
+        """
+        user = User.query.filter_by(userid=userid).first()
+        if user:
+            user.last_played_at = played_at
+            db.session.commit()
+
+    @staticmethod
+    def get_counts_verified(userid):
+        """
+        Check whether the listen counters of the user were counted from the entire history.
+        :param userid: unique identifier for a user.
+        :return: True if the counters cover the entire history.
+        """
+        user = User.query.filter_by(userid=userid).first()
+        return bool(user and user.counts_verified)
+
+    @staticmethod
+    def set_counts_verified(userid):
+        """
+        Mark the listen counters of the user as counted from the entire history.
+        :param userid: unique identifier for a user.
+        """
+        user = User.query.filter_by(userid=userid).first()
+        if user and not user.counts_verified:
+            user.counts_verified = True
+            db.session.commit()
+
+    @staticmethod
+    def get_rollups_verified(userid):
+        """
+        Check whether the mood rollups of the user were rebuilt from the entire history.
+        :param userid: unique identifier for a user.
+        :return: True if the rollups cover the entire history.
+        """
+        user = User.query.filter_by(userid=userid).first()
+        return bool(user and user.rollups_verified)
+
+    @staticmethod
+    def set_rollups_verified(userid):
+        """
+        Mark the mood rollups of the user as rebuilt from the entire history.
+        :param userid: unique identifier for a user.
+        """
+        user = User.query.filter_by(userid=userid).first()
+        if user and not user.rollups_verified:
+            user.rollups_verified = True
+            db.session.commit()
+
     @staticmethod
     def get_refresh_token(userid):
         """
@@ -167,6 +283,7 @@ class Song(db.Model):
         return Song.get_song(songid).name
 
     @staticmethod
+    @read_only
     def get_songs_with_mood(songids):
         """
         Get the song and songmood objects specified by songids.
@@ -204,6 +321,9 @@ class Artist(db.Model):
     name = db.Column(db.String(300))
     genres = db.Column(db.String(300))
     popularity = db.Column(db.Integer())
+    # Moment the genres and popularity were last fetched from Spotify. Artists that Spotify does not know are kept
+    # without a name, so they are only requested again once they are stale.
+    updated_at = db.Column(db.DateTime(), default=datetime.datetime.utcnow, index=True)
 
     @staticmethod
     def create_if_not_exist(json_info):
@@ -221,6 +341,80 @@ class Artist(db.Model):
             db.session.add(artist)
             db.session.commit()
 
+    @staticmethod
+    def create_unknown(artistids):
+        """
+        Create artists that Spotify returned no artist object for, without a name, if they do not exist already.
+        :param artistids: list of unique identifier for artists.
+        """
+        if not artistids:
+            return
+
+        known = {artistid for artistid, in
+                 db.session.query(Artist.artistid).filter(Artist.artistid.in_(artistids)).all()}
+        db.session.add_all([Artist(artistid=artistid) for artistid in set(artistids) - known])
+        db.session.commit()
+
+    @staticmethod
+    def get_unknown_ids(artistids):
+        """
+        Get the artistids that are not in the database yet, read from the primary so artists that were just added are
+        not fetched again.
+        :param artistids: list of unique identifier for artists.
+        :return: list of the unknown artistids in the order of artistids.
+        """
+        if not artistids:
+            return []
+
+        with primary():
+            known = {artistid for artistid, in
+                     db.session.query(Artist.artistid).filter(Artist.artistid.in_(artistids)).all()}
+
+        return [artistid for artistid in artistids if artistid not in known]
+
+    @staticmethod
+    def get_stale_ids(before, limit):
+        """
+        Get the artists that were last updated before a moment, the longest not updated first.
+        :param before: datetime object.
+        :param limit: Maximum number of artistids.
+        :return: list of artistids.
+        """
+        return [artistid for artistid, in db.session.query(Artist.artistid).filter(
+            (Artist.updated_at < before) | (Artist.updated_at.is_(None))).order_by(
+            Artist.updated_at).limit(limit).all()]
+
+    @staticmethod
+    def update_artists(json_infos, unknown_ids=()):
+        """
+        Update the genres and popularity of artists.
+        :param json_infos: list of dicts with the artistid, name, genres and popularity of an artist.
+        :param unknown_ids: list of artistids that Spotify returned no artist object for, they keep their features but
+                            are marked updated, so they are not requested again until they are stale.
+        """
+        now = datetime.datetime.utcnow()
+        for json_info in json_infos:
+            Artist.query.filter_by(artistid=json_info['artistid']).update({
+                'name': json_info['name'],
+                'genres': json_info['genres'],
+                'popularity': json_info['popularity'],
+                'updated_at': now
+            })
+        if unknown_ids:
+            Artist.query.filter(Artist.artistid.in_(unknown_ids)).update({'updated_at': now},
+                                                                         synchronize_session=False)
+
+        db.session.commit()
+
+    @staticmethod
+    def get_artists(artistids):
+        """
+        Get all artists specified by artistids.
+        :param artistids: list of unique identifier for artists.
+        :return: list of artist objects with artistid in artistids, artists unknown to Spotify are left out.
+        """
+        return Artist.query.filter(Artist.artistid.in_(artistids), Artist.name.isnot(None)).all()
+
 
 class Songmood(db.Model):
     """
@@ -253,6 +447,7 @@ class Songmood(db.Model):
             db.session.commit()
 
     @staticmethod
+    @read_only
     def get_moods(songids):
         """
         Get the songmoods specified by songids
@@ -261,6 +456,23 @@ class Songmood(db.Model):
         """
         return Songmood.query.filter(Songmood.songid.in_(songids)).all()
 
+    @staticmethod
+    @read_only
+    def get_closest(excitedness, happiness, limit, exclude=()):
+        """
+        Get the songmoods closest to a mood, used to recommend songs without Spotify.
+        :param excitedness: excitedness of the mood.
+        :param happiness: happiness of the mood.
+        :param limit: maximum number of songmoods.
+        :param exclude: list of songids that are left out.
+        :return: list of songmood objects, the closest first.
+        """
+        distance = (Songmood.excitedness - excitedness) * (Songmood.excitedness - excitedness) + \
+                   (Songmood.happiness - happiness) * (Songmood.happiness - happiness)
+
+        return Songmood.query.filter(Songmood.excitedness.isnot(None), Songmood.songid.notin_(list(exclude))) \
+            .order_by(distance).limit(limit).all()
+
     @staticmethod
     def update_response_mood(songid, user_excitedness, user_happiness):
         """
@@ -307,3 +519,395 @@ class SongArtist(db.Model):
 
             db.session.add(song_artist)
             db.session.commit()
+
+    @staticmethod
+    def get_artistids(songids):
+        """
+        Get the artists of the songs specified by songids.
+        :param songids: list of unique identifier for songs.
+        :return: dict formatted as {songid: [artistid, ...]}.
+        """
+        links = db.session.query(SongArtist.songid, SongArtist.artistid).filter(SongArtist.songid.in_(songids))
+        artistids = {}
+        for songid, artistid in links:
+            artistids.setdefault(songid, []).append(artistid)
+
+        return artistids
+
+    @staticmethod
+    def count_artists(song_counts):
+        """
+        Count the listens per artist from the listens per song.
+        :param song_counts: dict formatted as {songid: count}.
+        :return: Counter formatted as {artistid: count}.
+        """
+        artistids = SongArtist.get_artistids(list(song_counts.keys()))
+
+        artist_counts = Counter()
+        for songid, count in song_counts.items():
+            for artistid in artistids.get(songid, []):
+                artist_counts[artistid] += count
+
+        return artist_counts
+
+
+class ListenCount(object):
+    """
+    Mixin for the listen counters of a user, which are updated on every ingest to answer top queries without
+    counting the history. Subclasses define the `key` column that is counted.
+    """
+    count = db.Column(db.Integer(), default=0)
+
+    @declared_attr
+    def userid(cls):
+        return db.Column(db.String(200), db.ForeignKey("users.userid"))
+
+    @classmethod
+    def add_listens(cls, userid, ids):
+        """
+        Add one listen for every id in ids to the counters of a user.
+        :param userid: unique identifier for a user.
+        :param ids: list of listened ids, an id can occur multiple times.
+        """
+        counts = Counter(ids)
+        if not counts:
+            return
+
+        counters = cls.query.filter(cls.userid == userid, cls.key.in_(counts.keys())).all()
+        for counter in counters:
+            counter.count += counts.pop(counter.key)
+        for key, count in counts.items():
+            db.session.add(cls(userid=userid, key=key, count=count))
+
+        db.session.commit()
+
+    @classmethod
+    def replace_counts(cls, userid, counts):
+        """
+        Replace all counters of a user.
+        :param userid: unique identifier for a user.
+        :param counts: dict formatted as {id: count}.
+        """
+        cls.query.filter(cls.userid == userid).delete(synchronize_session=False)
+        db.session.add_all([cls(userid=userid, key=key, count=count) for key, count in counts.items()])
+        db.session.commit()
+
+    @classmethod
+    def get_counts(cls, userid):
+        """
+        Get all counters of a user.
+        :param userid: unique identifier for a user.
+        :return: dict formatted as {id: count}.
+        """
+        return {counter.key: counter.count for counter in cls.query.filter(cls.userid == userid)}
+
+    @classmethod
+    @read_only
+    def get_top(cls, userid, n):
+        """
+        Get the n most listened ids of a user, this uses the (userid, count) index.
+        :param userid: unique identifier for a user.
+        :param n: number of ids to return.
+        :return: list of tuples (id, count), most listened first.
+        """
+        counters = cls.query.filter(cls.userid == userid).order_by(cls.count.desc()).limit(n)
+        return [(counter.key, counter.count) for counter in counters]
+
+
+class SongCount(ListenCount, db.Model):
+    """
+    Database model counting the listens per song of a user.
+    """
+    __tablename__ = "song_counts"
+    key = db.Column('songid', db.String(200))
+
+    __table_args__ = (db.PrimaryKeyConstraint('userid', 'songid'),
+                      db.Index('ix_song_counts_userid_count', 'userid', 'count'))
+
+
+class ArtistCount(ListenCount, db.Model):
+    """
+    Database model counting the listens per artist of a user.
+    """
+    __tablename__ = "artist_counts"
+    key = db.Column('artistid', db.String(200))
+
+    __table_args__ = (db.PrimaryKeyConstraint('userid', 'artistid'),
+                      db.Index('ix_artist_counts_userid_count', 'userid', 'count'))
+
+
+class MoodRollup(object):
+    """
+    Mixin for the rolled up listens of a user per time bucket, which are updated on every ingest. Every row stores
+    the listen count and the sums of the moods and features, so averages are read without the history.
+    Subclasses define the `bucket` column holding the time bucket.
+    """
+    metrics = ['excitedness', 'happiness', 'acousticness', 'danceability', 'duration_ms', 'energy',
+               'instrumentalness', 'key', 'liveness', 'loudness', 'mode', 'speechiness', 'tempo', 'valence']
+
+    count = db.Column(db.Integer(), default=0)
+    excitedness = db.Column(db.Float(), default=0.0)
+    happiness = db.Column(db.Float(), default=0.0)
+    acousticness = db.Column(db.Float(), default=0.0)
+    danceability = db.Column(db.Float(), default=0.0)
+    duration_ms = db.Column(db.Float(), default=0.0)
+    energy = db.Column(db.Float(), default=0.0)
+    instrumentalness = db.Column(db.Float(), default=0.0)
+    key = db.Column(db.Float(), default=0.0)
+    liveness = db.Column(db.Float(), default=0.0)
+    loudness = db.Column(db.Float(), default=0.0)
+    mode = db.Column(db.Float(), default=0.0)
+    speechiness = db.Column(db.Float(), default=0.0)
+    tempo = db.Column(db.Float(), default=0.0)
+    valence = db.Column(db.Float(), default=0.0)
+
+    @declared_attr
+    def userid(cls):
+        return db.Column(db.String(200), db.ForeignKey("users.userid"))
+
+    def get_averages(self):
+        """
+        Get the average moods and features of the listens in this bucket.
+        :return: dict formatted as {metric: average}.
+        """
+        return MoodRollup.get_total_averages({key: getattr(self, key) for key in ['count'] + self.metrics})
+
+    @staticmethod
+    def get_total_averages(total):
+        """
+        Get the average moods and features per listen of summed listens.
+        :param total: dict formatted as {'count': listen count, metric: sum of metric, ...}.
+        :return: dict formatted as {metric: average}.
+        """
+        return {metric: (total[metric] or 0.0) / total['count'] if total['count'] else 0.0
+                for metric in MoodRollup.metrics}
+
+    @classmethod
+    def add_totals(cls, userid, totals):
+        """
+        Add listens to the rollups of a user.
+        :param userid: unique identifier for a user.
+        :param totals: dict formatted as {bucket: {'count': listen count, metric: sum of metric, ...}}.
+        """
+        if not totals:
+            return
+
+        rollups = {rollup.bucket: rollup for rollup in
+                   cls.query.filter(cls.userid == userid, cls.bucket.in_(list(totals.keys())))}
+
+        for bucket, total in totals.items():
+            if bucket not in rollups:
+                rollups[bucket] = cls(userid=userid, bucket=bucket, count=0)
+                db.session.add(rollups[bucket])
+
+            rollup = rollups[bucket]
+            rollup.count = (rollup.count or 0) + total['count']
+            for metric in cls.metrics:
+                setattr(rollup, metric, (getattr(rollup, metric) or 0.0) + total[metric])
+
+        db.session.commit()
+
+    @classmethod
+    def replace_totals(cls, userid, totals):
+        """
+        Replace all rollups of a user.
+        :param userid: unique identifier for a user.
+        :param totals: dict formatted as {bucket: {'count': listen count, metric: sum of metric, ...}}.
+        """
+        cls.query.filter(cls.userid == userid).delete(synchronize_session=False)
+        db.session.commit()
+        cls.add_totals(userid, totals)
+
+
+class HourlyRollup(MoodRollup, db.Model):
+    """
+    Database model rolling up the listens of a user per hour of the day (0 - 23, UTC).
+    """
+    __tablename__ = "hourly_rollups"
+    bucket = db.Column('hour', db.Integer())
+
+    __table_args__ = (db.PrimaryKeyConstraint('userid', 'hour'),)
+
+    @staticmethod
+    @read_only
+    def get_hours(userid, start_hour, end_hour):
+        """
+        Get the rollups of a user within an hourly timeframe.
+        :param userid: unique identifier for a user.
+        :param start_hour: lower bound of the timeframe in hours.
+        :param end_hour: upper bound of the timeframe in hours.
+        :return: list of rollup objects ordered by hour.
+        """
+        return HourlyRollup.query.filter(HourlyRollup.userid == userid, HourlyRollup.bucket >= start_hour,
+                                         HourlyRollup.bucket <= end_hour).order_by(HourlyRollup.bucket).all()
+
+
+class DailyRollup(MoodRollup, db.Model):
+    """
+    Database model rolling up the listens of a user per day (UTC).
+    """
+    __tablename__ = "daily_rollups"
+    bucket = db.Column('date', db.Date())
+
+    __table_args__ = (db.PrimaryKeyConstraint('userid', 'date'),)
+
+    @staticmethod
+    @read_only
+    def get_days(userid, day_count):
+        """
+        Get the rollups of the most recent days of a user.
+        :param userid: unique identifier for a user.
+        :param day_count: number of days to return.
+        :return: list of rollup objects, most recent day first.
+        """
+        return DailyRollup.query.filter(DailyRollup.userid == userid).order_by(
+            DailyRollup.bucket.desc()).limit(day_count).all()
+
+
+class Listen(db.Model):
+    """
+    Database model for a listen of a user, used by the sql history store. The primary key (userid, played_at) is the
+    index of every history query. The table has no foreign keys, so it can be partitioned on userid or played_at.
+    """
+    __tablename__ = "listens"
+    userid = db.Column(db.String(200))
+    played_at = db.Column(db.DateTime())
+    songid = db.Column(db.String(200))
+
+    __table_args__ = (db.PrimaryKeyConstraint('userid', 'played_at'),)
+
+    @staticmethod
+    def add_listens(listens):
+        """
+        Add listens, a listen of a user at the same time as an existing one replaces it.
+        :param listens: list of tuples (userid, played_at, songid).
+        """
+        new = {(userid, played_at): songid for userid, played_at, songid in listens}
+        if not new:
+            return
+
+        first, last = min(played_at for _, played_at in new), max(played_at for _, played_at in new)
+        existing = Listen.query.filter(Listen.userid.in_(set(userid for userid, _ in new)),
+                                       Listen.played_at >= first, Listen.played_at <= last)
+        for listen in existing:
+            key = (listen.userid, listen.played_at)
+            if key in new:
+                listen.songid = new.pop(key)
+
+        if new:
+            db.session.execute(Listen.__table__.insert(), [{'userid': userid, 'played_at': played_at, 'songid': songid}
+                                                           for (userid, played_at), songid in new.items()])
+        db.session.commit()
+
+    @staticmethod
+    def get_listens(userid, since=None, before=None, limit=None):
+        """
+        Get the listens of a user, most recent first.
+        :param userid: unique identifier for a user.
+        :param since: only return listens after this datetime.
+        :param before: only return listens before this datetime.
+        :param limit: maximum number of listens to return.
+        :return: list of tuples (played_at, songid).
+        """
+        query = db.session.query(Listen.played_at, Listen.songid).filter(Listen.userid == userid)
+        if since:
+            query = query.filter(Listen.played_at > since)
+        if before:
+            query = query.filter(Listen.played_at < before)
+
+        return query.order_by(Listen.played_at.desc()).limit(limit).all()
+
+    @staticmethod
+    def get_recent_listens(userids, since):
+        """
+        Get the listens of several users since a moment.
+        :param userids: list of unique identifiers for users.
+        :param since: only return listens after this datetime.
+        :return: list of tuples (userid, played_at, songid).
+        """
+        return db.session.query(Listen.userid, Listen.played_at, Listen.songid).filter(
+            Listen.userid.in_(userids), Listen.played_at > since).all()
+
+    @staticmethod
+    def get_song_counts(userid, since=None, limit=None):
+        """
+        Count the listens per song of a user.
+        :param userid: unique identifier for a user.
+        :param since: only count listens after this datetime.
+        :param limit: only return the limit most listened songs.
+        :return: list of tuples (songid, count), most listened first and the most recent first on ties.
+        """
+        count = db.func.count(Listen.songid)
+        query = db.session.query(Listen.songid, count).filter(Listen.userid == userid)
+        if since:
+            query = query.filter(Listen.played_at > since)
+
+        return query.group_by(Listen.songid).order_by(count.desc(), db.func.max(Listen.played_at).desc()).limit(
+            limit).all()
+
+    @staticmethod
+    def get_last_played_at(userid):
+        """
+        Get the time of the latest listen of a user.
+        :param userid: unique identifier for a user.
+        :return: datetime of the latest listen or None if the user has no listens.
+        """
+        return db.session.query(db.func.max(Listen.played_at)).filter(Listen.userid == userid).scalar()
+
+    @staticmethod
+    def delete_listens(userid):
+        """
+        Delete all listens of a user.
+        :param userid: unique identifier for a user.
+        """
+        Listen.query.filter(Listen.userid == userid).delete(synchronize_session=False)
+        db.session.commit()
+
+
+class UserMood(db.Model):
+    """
+    Database model for the mean mood of a user over a time window at a moment, used by the sql history store.
+    """
+    __tablename__ = "user_moods"
+    userid = db.Column(db.String(200))
+    window = db.Column(db.String(20), default='')
+    time = db.Column(db.DateTime())
+    excitedness = db.Column(db.Float())
+    happiness = db.Column(db.Float())
+    songcount = db.Column(db.Integer())
+
+    __table_args__ = (db.PrimaryKeyConstraint('userid', 'window', 'time'),)
+
+    @staticmethod
+    def add_moods(moods):
+        """
+        Add the moods of users, a mood at the same time as an existing one replaces it.
+        :param moods: list of dicts with the userid, window, time, excitedness, happiness and songcount.
+        """
+        for mood in moods:
+            db.session.merge(UserMood(**mood))
+
+        db.session.commit()
+
+    @staticmethod
+    def get_moods(userid, window=None):
+        """
+        Get the moods of a user, oldest first.
+        :param userid: unique identifier for a user.
+        :param window: only return the moods of this window.
+        :return: list of usermood objects.
+        """
+        query = UserMood.query.filter(UserMood.userid == userid)
+        if window is not None:
+            query = query.filter(UserMood.window == window)
+
+        return query.order_by(UserMood.time).all()
+
+    @staticmethod
+    def delete_moods(userid):
+        """
+        Delete all moods of a user.
+        :param userid: unique identifier for a user.
+        """
+        UserMood.query.filter(UserMood.userid == userid).delete(synchronize_session=False)
+        db.session.commit()
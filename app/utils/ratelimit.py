@@ -0,0 +1,121 @@
+"""
+    ratelimit.py
+    ~~~~~~~~~~~~
+    This file contains the token bucket that paces the calls to the Spotify API of all processes on the machine.
+
+    :copyright: 2019 Moodify (High-Mood)
+    :authors:
+           "Stan van den Broek",
+           "Mitchell van den Bulk",
+           "Mo Diallo",
+           "Arthur van Eeden",
+           "Elijah Erven",
+           "Henok Ghebrenigus",
+           "Jonas van der Ham",
+           "Mounir El Kirafi",
+           "Esmeralda Knaap",
+           "Youri Reijne",
+           "Siwa Sardjoemissier",
+           "Barry de Vries",
+           "Jelle Witsen Elias"
+"""
+
+import fcntl
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+
+from app.utils.exceptions import RateLimitedError
+
+# The shared state is the number of tokens and the time they were counted, as two doubles.
+STATE = struct.Struct('dd')
+
+
+class RateLimiter(object):
+    """
+    Token bucket that allows `rate` calls per second with bursts of `burst` calls. If a path is given, the bucket is
+    stored in that file and shared by all processes using it, the file is locked while the bucket is updated.
+    A call that finds the bucket empty reserves the next token, so waiting calls are served in order.
+    """
+
+    def __init__(self, rate, burst, path=None):
+        """
+        :param rate: Number of calls per second.
+        :param burst: Maximum number of calls at once after being idle.
+        :param path: Path of the file shared across processes, None to only limit within this process.
+        """
+        self.rate = rate
+        self.burst = burst
+        self.path = path
+        self.state = (burst, time.time())
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def acquire(self, max_wait=None):
+        """
+        Takes a token from the bucket, waiting until it is available.
+        :param max_wait: Maximum number of seconds to wait, None to wait as long as needed.
+        :return: Number of seconds waited.
+        :raises RateLimitedError: If the token is not available within max_wait seconds, no token is taken then.
+        """
+        with self._locked() as (tokens, now):
+            tokens -= 1
+            wait = -tokens / self.rate if tokens < 0 else 0
+            if max_wait is not None and wait > max_wait:
+                raise RateLimitedError(wait)
+            self._store(tokens, now)
+
+        if wait:
+            time.sleep(wait)
+
+        return wait
+
+    def pause(self, seconds):
+        """
+        Empties the bucket for `seconds`, i.e. after Spotify responded that the calls are throttled.
+        :param seconds: Number of seconds no calls are allowed.
+        """
+        with self._locked() as (tokens, now):
+            self._store(min(tokens, -seconds * self.rate), now)
+
+    @contextmanager
+    def _locked(self):
+        """Holds the lock of the bucket within the block, yielding the refilled tokens and the current time."""
+        with self.lock:
+            if not self.path:
+                yield self._load()
+                return
+
+            fcntl.flock(self._get_file(), fcntl.LOCK_EX)
+            try:
+                yield self._load()
+            finally:
+                fcntl.flock(self._get_file(), fcntl.LOCK_UN)
+
+    def _get_file(self):
+        """Returns the file descriptor of the shared state for the current process, creating the file if needed."""
+        if getattr(self.local, 'pid', None) != os.getpid():
+            self.local.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            self.local.pid = os.getpid()
+
+        return self.local.fd
+
+    def _load(self):
+        """Returns the tokens in the bucket, refilled up to now, and the current time."""
+        if self.path:
+            data = os.pread(self._get_file(), STATE.size, 0)
+            tokens, updated_at = STATE.unpack(data) if len(data) == STATE.size else (self.burst, time.time())
+        else:
+            tokens, updated_at = self.state
+
+        now = time.time()
+        return min(self.burst, tokens + max(0.0, now - updated_at) * self.rate), now
+
+    def _store(self, tokens, now):
+        if self.path:
+            os.pwrite(self._get_file(), STATE.pack(tokens, now), 0)
+        else:
+            self.state = (tokens, now)
+
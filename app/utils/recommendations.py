@@ -22,12 +22,23 @@
 
 import statistics
 
+import requests
 from scipy.spatial import distance
 
+from app import app
 from app.utils import spotify
-from app.utils.models import User
+from app.utils.cache import TTLCache
+from app.utils.exceptions import CircuitOpenError, RateLimitedError, StatusCodeError
+from app.utils.models import Songmood
 from app.utils.tasks import get_features_moods
 
+# Number of candidates requested from Spotify per recommendation query.
+CANDIDATE_COUNT = 50
+
+# The candidates of a query and their moods are fairly stable, so they are reused for a few minutes.
+_candidates = TTLCache(app.config.get('RECOMMENDATION_CACHE_SIZE', 1024),
+                       app.config.get('RECOMMENDATION_CACHE_TTL', 300))
+
 
 def order_songs(songs, target, n):
     """
@@ -90,27 +101,23 @@ def calculate_target_mood(target, current):
     return 0.6 *target[0] + 0.4 * current[0], 0.6 * target[1] + 0.4 * current[1]
 
 
-def recommend_input(tracks, userid, target=(0.0, 0.0), n=5):
+def recommend_input(tracks, target=(0.0, 0.0), n=5):
     """
     Find recommendations given max 5 song ID's.
     The recommendations are based on the given songs and the given target mood.
     :param tracks: list of given songs.
-    :param userid: Spotify user id of the user.
     :param target: the target mood formatted as: (excitedness, happiness).
     :param n: the amount of recommendations that are returned, standard is 5.
     :return: ascending list of n dictionaries formatted as:
         [{'songid': actual song id, excitedness: actual excitedness, happiness: actual happiness}].
     """
-    access_token = spotify.get_access_token(User.get_refresh_token(userid))
+    return find_song_recommendations(tracks, target, n, _get_parameter_string())
 
-    return find_song_recommendations(access_token, tracks, target, n, _get_parameter_string())
 
-
-def recommend_metric(tracks, userid, metric, excitedness, happiness, n=5):
+def recommend_metric(tracks, metric, excitedness, happiness, n=5):
     """
     Find recommendations based on the last 5 songs, the given metric and the current mood.
     :param tracks: list of given songs.
-    :param userid: Spotify user id of the user.
     :param metric: keywords for moods and events, the possible keywords are: sad, mellow, angry, excited, dance, study,
         karaoke, neutral.
     :param excitedness: the excitedness of a user.
@@ -134,22 +141,20 @@ def recommend_metric(tracks, userid, metric, excitedness, happiness, n=5):
                                                max_loudness=-4, max_speechiness=0.2),
               'neutral': _get_parameter_string()}
 
-    access_token = spotify.get_access_token(User.get_refresh_token(userid))
-
     # Calculates the target mood and recommends songs based on this target.
     if metric in moods:
         target = calculate_target_mood(moods[metric], (excitedness, happiness))
-        return find_song_recommendations(access_token, tracks, target, n, _get_parameter_string())
+        return find_song_recommendations(tracks, target, n, _get_parameter_string())
 
     # Recommends songs based on parameters corresponding to events, the target mood is the current mood.
     if metric in events:
-        return find_song_recommendations(access_token, tracks, (excitedness, happiness), n, events[metric])
+        return find_song_recommendations(tracks, (excitedness, happiness), n, events[metric])
 
 
-def find_song_recommendations(access_token, tracks, target, n, params):
+def find_song_recommendations(tracks, target, n, params):
     """
-    Find recommendations based on the last 5 songs, the given metric and the current mood.
-    :param access_token: A valid access token from the Spotify Accounts service.
+    Find recommendations based on the last 5 songs, the given metric and the current mood. When Spotify is
+    unavailable the recommendations are picked from the scored songs in our own database instead.
     :param tracks: list of given songs.
     :param target: the target mood formatted as: (excitedness, happiness).
     :param n: the amount of recommendations that are returned, standard is 5.
@@ -158,11 +163,37 @@ def find_song_recommendations(access_token, tracks, target, n, params):
         [{'songid': actual song id, excitedness: actual excitedness, happiness: actual happiness}].
     """
     track_string = '%2C'.join(tracks[:5])
-    response = spotify.get_recommendations(access_token, 50, track_string, params)
+    key = (track_string, params, CANDIDATE_COUNT)
+    moods = _candidates.get(key)
+
+    if moods is None:
+        try:
+            # Recommendations do not need the scope of the user, so the token of the app is used.
+            response = spotify.get_recommendations(spotify.get_app_token(), CANDIDATE_COUNT, track_string, params)
+
+            song_recommendation = response['tracks']
+            recommendations = {song['id']: {'name': song['name']} for song in song_recommendation}
+
+            moods = get_features_moods(recommendations)
+        except (CircuitOpenError, RateLimitedError, requests.exceptions.RequestException, StatusCodeError):
+            return recommend_local(tracks, target, n)
 
-    song_recommendation = response['tracks']
-    recommendations = {song['id']: {'name': song['name']} for song in song_recommendation}
+        _candidates.put(key, moods)
 
-    moods = get_features_moods(recommendations)
+    # order_songs modifies the songs, so it gets copies of the cached songs.
+    return order_songs([dict(song) for song in moods], target, n)
+
+
+def recommend_local(tracks, target, n):
+    """
+    Find recommendations among the scored songs in our own database, used when Spotify is unavailable.
+    :param tracks: list of given songs, which are not recommended.
+    :param target: the target mood formatted as: (excitedness, happiness).
+    :param n: the amount of recommendations that are returned.
+    :return: ascending list of n dictionaries formatted as:
+        [{'songid': actual song id, excitedness: actual excitedness, happiness: actual happiness}].
+    """
+    songmoods = Songmood.get_closest(target[0], target[1], n, exclude=tracks)
 
-    return order_songs(moods, target, n)
+    return [{'songid': songmood.songid, 'excitedness': songmood.excitedness, 'happiness': songmood.happiness}
+            for songmood in songmoods]
@@ -20,13 +20,119 @@
            "Jelle Witsen Elias"
 """
 
+import os
+import random
+import threading
+import time
+from collections import Counter
+
 import requests
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
 
+from app import app, get_instance_file
+from app.utils.breaker import CircuitBreaker
 from app.utils.exceptions import StatusCodeError
-from app.utils.models import User
+from app.utils.ratelimit import RateLimiter
+from app.utils.tokens import TokenCache
 from config import SPOTIFY_CLIENT, SPOTIFY_SECRET
 
+# Base urls of the Web API and the Accounts service, they can point to a local stand-in such as mock_spotify.py.
+API_URL = app.config.get('SPOTIFY_API_URL', 'https://api.spotify.com/v1')
+ACCOUNTS_URL = app.config.get('SPOTIFY_ACCOUNTS_URL', 'https://accounts.spotify.com')
+
+# Every thread keeps its own session, since a session is not thread-safe.
+_local = threading.local()
+# Access tokens are valid for an hour, so they are cached and shared by all processes using the same store.
+_access_tokens = TokenCache(get_instance_file(app.config.get('SPOTIFY_TOKEN_STORE')),
+                            app.config.get('SPOTIFY_TOKEN_MARGIN', 60))
+# Spotify limits the calls of the whole application, so all processes on the machine share one bucket.
+_rate_limiter = RateLimiter(app.config.get('SPOTIFY_RATE', 10), app.config.get('SPOTIFY_BURST', 20),
+                            get_instance_file(app.config.get('SPOTIFY_RATE_LIMIT_FILE')))
+# Every class of endpoints has its own circuit breaker, so one slow class does not hold up the others. The classes
+# that are called while a page or API request waits use a shorter timeout and do not retry throttled calls.
+_interactive = ['recommendations', 'playlists']
+_breakers = {name: CircuitBreaker(name, app.config.get('SPOTIFY_BREAKER_FAILURES', 5),
+                                  app.config.get('SPOTIFY_BREAKER_RESET', 30),
+                                  app.config.get('SPOTIFY_INTERACTIVE_TIMEOUT', 3) if name in _interactive else
+                                  app.config.get('SPOTIFY_TIMEOUT', 10),
+                                  0 if name in _interactive else app.config.get('SPOTIFY_RETRIES', 3),
+                                  app.config.get('SPOTIFY_INTERACTIVE_MAX_WAIT', 1) if name in _interactive else None)
+             for name in ['accounts', 'user', 'catalog', *_interactive]}
+# Counters of the calls of this process, see get_metrics.
+_metrics = Counter()
+_metrics_lock = threading.Lock()
+
+
+def get_session():
+    """
+    Returns the HTTP session of the current process and thread, creating it on first use.
+    The session keeps its connections to the Spotify hosts alive, so they are reused by every call of this thread.
+    :return: requests Session object.
+    """
+    if getattr(_local, 'pid', None) != os.getpid():
+        adapter = HTTPAdapter(pool_connections=app.config.get('SPOTIFY_POOL_HOSTS', 4),
+                              pool_maxsize=app.config.get('SPOTIFY_POOL_SIZE', 10))
+        _local.session = requests.Session()
+        _local.session.mount('https://', adapter)
+        _local.session.mount('http://', adapter)
+        _local.pid = os.getpid()
+
+    return _local.session
+
+
+def _request(method, url, timeout=None, retries=None, max_wait=None, **kwargs):
+    """
+    Sends a request with the session of the current thread, paced by the rate limiter. Throttled requests are retried
+    after the delay Spotify asks for, with a jittered backoff.
+    :param timeout: Timeout in seconds, SPOTIFY_TIMEOUT if not given.
+    :param retries: Number of retries of throttled requests, SPOTIFY_RETRIES if not given.
+    :param max_wait: Maximum number of seconds to wait for the rate limiter, None to wait as long as needed.
+    :return: The response, which is only a 429 response if all retries were throttled as well.
+    :raises RateLimitedError: If the rate limiter would hold the request longer than max_wait.
+    """
+    timeout = app.config.get('SPOTIFY_TIMEOUT', 10) if timeout is None else timeout
+    retries = app.config.get('SPOTIFY_RETRIES', 3) if retries is None else retries
+
+    for attempt in range(retries + 1):
+        wait = _rate_limiter.acquire(max_wait)
+        response = get_session().request(method, url, timeout=timeout, **kwargs)
+        _count(requests=1, limiter_waits=1 if wait else 0, limiter_wait_seconds=wait,
+               throttled=1 if response.status_code == 429 else 0)
+
+        if response.status_code != 429 or attempt == retries:
+            return response
+
+        # Every process waits for the advertised delay, the jitter spreads the retries.
+        delay = float(response.headers.get('Retry-After', 1))
+        _rate_limiter.pause(delay)
+        time.sleep(delay + random.random() * 2 ** attempt)
+
+    return response
+
+
+def _count(**counts):
+    with _metrics_lock:
+        _metrics.update(counts)
+
+
+def get_metrics():
+    """
+    Returns the counters of the Spotify calls of this process.
+    :return: dict with the number of requests, the number of throttled (429) responses, the number of times the rate
+             limiter made a call wait and the total number of seconds waited.
+    """
+    with _metrics_lock:
+        return {key: _metrics[key] for key in ['requests', 'throttled', 'limiter_waits', 'limiter_wait_seconds']}
+
+
+def get_breaker_metrics():
+    """
+    Returns the state and counters of the circuit breakers of this process.
+    :return: dict formatted as {class of endpoints: metrics}, see CircuitBreaker.get_metrics.
+    """
+    return {name: breaker.get_metrics() for name, breaker in _breakers.items()}
+
 
 def get_artists(access_token, artistids):
     """
@@ -36,9 +142,9 @@ def get_artists(access_token, artistids):
     :return: Response body which contains a list of object whose key is "artists" and
              whose value is an array of artist objects in JSON format.
     """
-    url = "https://api.spotify.com/v1/artists?ids={}".format(",".join(artistids))
+    url = "{}/artists?ids={}".format(API_URL, ",".join(artistids))
 
-    return _get_basic_request(access_token, url)
+    return _get_basic_request(access_token, url, 'catalog')
 
 
 def get_audio_features(access_token, trackids):
@@ -49,22 +155,25 @@ def get_audio_features(access_token, trackids):
     :return: Response body contains an object whose key is "artists" and
              whose value is an array of artist objects in JSON format.
     """
-    url = "https://api.spotify.com/v1/audio-features/?ids={}".format(",".join(trackids))
+    url = "{}/audio-features/?ids={}".format(API_URL, ",".join(trackids))
 
-    return _get_basic_request(access_token, url)
+    return _get_basic_request(access_token, url, 'catalog')
 
 
-def get_recently_played(access_token, limit=50):
+def get_recently_played(access_token, limit=50, after=None):
     """
     Gets tracks from the current user’s recently played tracks.
     :param access_token: A valid access token from the Spotify Accounts service.
     :param limit: The maximum number of items to return.
+    :param after: Unix timestamp in milliseconds, only tracks played after this moment are returned.
     :return: Response body contains an array of play history objects
             (wrapped in a cursor-based paging object) in JSON format.
     """
-    url = "https://api.spotify.com/v1/me/player/recently-played?limit={}".format(limit)
+    url = "{}/me/player/recently-played?limit={}".format(API_URL, limit)
+    if after is not None:
+        url += "&after={}".format(after)
 
-    return _get_basic_request(access_token, url)
+    return _get_basic_request(access_token, url, 'user')
 
 
 def get_user_info(access_token):
@@ -73,9 +182,9 @@ def get_user_info(access_token):
     :param access_token: A valid access token from the Spotify Accounts service.
     :return: Response body contains a user object in JSON format.
     """
-    url = "https://api.spotify.com/v1/me"
+    url = f"{API_URL}/me"
 
-    return _get_basic_request(access_token, url)
+    return _get_basic_request(access_token, url, 'user')
 
 
 def get_recommendations(access_token, recommendation_count, track_string, param_string):
@@ -88,64 +197,128 @@ def get_recommendations(access_token, recommendation_count, track_string, param_
                          selected track attribute’s value can be provided.
     :return: A response body contains a recommendations response object in JSON format.
     """
-    url = "https://api.spotify.com/v1/recommendations?limit=" + \
+    url = f"{API_URL}/recommendations?limit=" + \
           f"{recommendation_count}&seed_tracks={track_string}{param_string}"
 
-    return _get_basic_request(access_token, url)
+    return _get_basic_request(access_token, url, 'recommendations')
 
 
-def _get_basic_request(access_token, url):
-    """ Handles basic requests to the Spotify API. """
-    headers = {'Authorization': "Bearer {}".format(access_token)}
-    response = requests.get(url, headers=headers)
+def _get_basic_request(access_token, url, endpoint):
+    """ Handles basic requests to the Spotify API through the circuit breaker of the class of endpoints. """
+    breaker = _breakers[endpoint]
 
-    if response.status_code != 200:
-        if response.status_code == 429:
-            __import__('time').sleep(int(response.headers['Retry-After']))
-        else:
+    def get():
+        headers = {'Authorization': "Bearer {}".format(access_token)}
+        response = _request('GET', url, breaker.timeout, breaker.retries, breaker.max_wait, headers=headers)
+
+        if response.status_code != 200:
             raise StatusCodeError(response)
 
-    return response.json()
+        return response.json()
+
+    return breaker.call(get)
 
 
 def get_access_token(refresh_token):
     """
-    Gets a new access token for the user.
+    Gets an access token for the user, a cached token is returned until shortly before it expires.
+    :param refresh_token: The refresh token returned from the authorization code exchange.
+    :return: The access token for the user.
+    """
+    return _access_tokens.get(refresh_token, lambda: _breakers['accounts'].call(_refresh_access_token, refresh_token))
+
+
+def get_app_token():
+    """
+    Gets an access token of the app itself through the client credentials flow, it can be used for catalog calls
+    (audio features, artists and recommendations) that do not need the scope of a user. A cached token is returned
+    until shortly before it expires.
+    :return: The access token for the app.
+    """
+    return _access_tokens.get(f"client_credentials:{SPOTIFY_CLIENT}",
+                              lambda: _breakers['accounts'].call(_request_app_token))
+
+
+def _request_app_token():
+    """
+    Requests a new access token for the app.
+    :return: Tuple (access token, number of seconds it is valid).
+    """
+    url = f"{ACCOUNTS_URL}/api/token"
+
+    body = {"grant_type": "client_credentials"}
+
+    response = _request('POST', url, data=body, auth=HTTPBasicAuth(SPOTIFY_CLIENT, SPOTIFY_SECRET))
+
+    if response.status_code != 200:
+        raise StatusCodeError(response)
+
+    json_data = response.json()
+
+    return json_data["access_token"], json_data["expires_in"]
+
+
+def _refresh_access_token(refresh_token):
+    """
+    Requests a new access token for the user.
     :param refresh_token: The refresh token returned from the authorization code exchange.
-    :return: Response body contains the new access token for the user in JSON format.
+    :return: Tuple (access token, number of seconds it is valid).
     """
-    url = "https://accounts.spotify.com/api/token"
+    url = f"{ACCOUNTS_URL}/api/token"
 
     body = {"grant_type": "refresh_token",
             "refresh_token": refresh_token}
 
-    response = requests.post(url, data=body, auth=HTTPBasicAuth(SPOTIFY_CLIENT, SPOTIFY_SECRET))
+    response = _request('POST', url, data=body, auth=HTTPBasicAuth(SPOTIFY_CLIENT, SPOTIFY_SECRET))
 
     if response.status_code != 200:
         raise StatusCodeError(response)
 
-    return response.json()["access_token"]
+    json_data = response.json()
 
+    return json_data["access_token"], json_data["expires_in"]
 
-def get_playlists(userid, url=None, output=[]):
-    access_token = get_access_token(User.get_refresh_token(userid))
-    if not url:
-        url = "https://api.spotify.com/v1/me/playlists"
-    headers = {'Authorization': "Bearer {}".format(access_token)}
-    response = requests.get(url, headers=headers)
 
-    json_data = response.json()
+def get_playlists_page(access_token, offset=0, limit=50):
+    """
+    Gets one page of the playlists of the current user.
+    :param access_token: A valid access token from the Spotify Accounts service.
+    :param offset: The index of the first playlist to return.
+    :param limit: The maximum number of playlists to return.
+    :return: Response body contains an array of simplified playlist objects
+             (wrapped in a paging object) in JSON format.
+    """
+    url = "{}/me/playlists?limit={}&offset={}".format(API_URL, limit, offset)
 
-    for item in json_data["items"]:
-        resp = {"name": item['name'],
-                "id": item['id'],
-                'href': item['href'],
-                'public': item['public'],
-                'track_href': item['tracks']['href'],
-                'track_count': item['tracks']['total'], }
-        output.append(resp)
+    return _get_basic_request(access_token, url, 'playlists')
 
-    if json_data['next']:
-        return get_playlists(userid, json_data['next'], output)
 
-    return output
+def get_playlist_tracks_page(access_token, playlistid, offset=0, limit=100):
+    """
+    Gets one page of the tracks of a playlist, only the id and name of the tracks are returned.
+    :param access_token: A valid access token from the Spotify Accounts service.
+    :param playlistid: The Spotify ID for the playlist.
+    :param offset: The index of the first track to return.
+    :param limit: The maximum number of tracks to return, at most 100.
+    :return: Response body contains the total and an array of playlist track objects in JSON format.
+    """
+    url = "{}/playlists/{}/tracks?limit={}&offset={}&fields=total,items(track(id,name))" \
+        .format(API_URL, playlistid, limit, offset)
+
+    # An analysis requests many pages at once, so throttled pages are retried like the other catalog calls instead
+    # of failing the entire analysis.
+    return _get_basic_request(access_token, url, 'catalog')
+
+
+def format_playlist(item):
+    """
+    Formats a simplified playlist object as returned by the playlist endpoint.
+    :param item: Simplified playlist object.
+    :return: dict with the name, id, href, public, track_href and track_count of the playlist.
+    """
+    return {"name": item['name'],
+            "id": item['id'],
+            'href': item['href'],
+            'public': item['public'],
+            'track_href': item['tracks']['href'],
+            'track_count': item['tracks']['total'], }
@@ -0,0 +1,209 @@
+"""
+    spotify_async.py
+    ~~~~~~~~~~~~
+    This file contains asyncio variants of the functions that communicate with the Spotify API, so independent calls
+    can be made concurrently.
+
+    :copyright: 2019 Moodify (High-Mood)
+    :authors:
+           "Stan van den Broek",
+           "Mitchell van den Bulk",
+           "Mo Diallo",
+           "Arthur van Eeden",
+           "Elijah Erven",
+           "Henok Ghebrenigus",
+           "Jonas van der Ham",
+           "Mounir El Kirafi",
+           "Esmeralda Knaap",
+           "Youri Reijne",
+           "Siwa Sardjoemissier",
+           "Barry de Vries",
+           "Jelle Witsen Elias"
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from app import app, get_instance_file
+from app.utils import spotify
+from app.utils.cache import DiskCache
+from app.utils.models import User
+
+# The calls run on a bounded pool of threads, every thread keeps its own session and all calls share the rate
+# limiter and token cache of the synchronous client.
+_executor = ThreadPoolExecutor(max_workers=app.config.get('SPOTIFY_CONCURRENCY', 8))
+
+# Audio features never change, so they are cached forever. Tracks without audio features may get them later and the
+# popularity and genres of artists change, so those entries expire.
+catalog_cache = DiskCache(get_instance_file(app.config.get('SPOTIFY_CATALOG_CACHE')))
+AUDIO_FEATURES = 'audio_features'
+ARTISTS = 'artists'
+
+
+def run(coroutine):
+    """
+    Runs a coroutine on a new event loop, so it can be used from any thread.
+    :param coroutine: The coroutine to run.
+    :return: The result of the coroutine.
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+async def _call(function, *args, **kwargs):
+    return await asyncio.get_event_loop().run_in_executor(_executor, partial(function, *args, **kwargs))
+
+
+async def get_artists(access_token, artistids):
+    """
+    Gets Spotify catalog information for several artists based on their Spotify IDs.
+    :param access_token: A valid access token from the Spotify Accounts service.
+    :param artistids: A list of the Spotify IDs for the artists.
+    :return: Response body which contains a list of object whose key is "artists" and
+             whose value is an array of artist objects in JSON format.
+    """
+    return await _call(spotify.get_artists, access_token, artistids)
+
+
+async def get_audio_features(access_token, trackids):
+    """
+    Gets the audio features for several tracks based on their Spotify IDs.
+    :param access_token: A valid access token from the Spotify Accounts service.
+    :param trackids: A list of the Spotify IDs for the tracks.
+    :return: Response body contains an object whose key is "audio_features" and
+             whose value is an array of audio features objects in JSON format.
+    """
+    return await _call(spotify.get_audio_features, access_token, trackids)
+
+
+async def get_all_audio_features(access_token, trackids, chunk_size=100):
+    """
+    Gets the audio features for any number of tracks. Tracks in the catalog cache are not requested, the others are
+    requested in chunks of at most 100 tracks (the limit of Spotify) that are requested concurrently.
+    :param access_token: A valid access token from the Spotify Accounts service.
+    :param trackids: A list of the Spotify IDs for the tracks.
+    :param chunk_size: Number of tracks per request.
+    :return: List of audio features objects in the order of trackids, None for tracks without audio features.
+    """
+    features = catalog_cache.get_many(AUDIO_FEATURES, trackids)
+    missing = list(dict.fromkeys(trackid for trackid in trackids if trackid not in features))
+
+    chunks = [missing[i:i + chunk_size] for i in range(0, len(missing), chunk_size)]
+    responses = await asyncio.gather(*(get_audio_features(access_token, chunk) for chunk in chunks))
+
+    found = {feature['id']: feature for response in responses for feature in response['audio_features'] if feature}
+    catalog_cache.put_many(AUDIO_FEATURES, found)
+    catalog_cache.put_many(AUDIO_FEATURES, {trackid: None for trackid in missing if trackid not in found},
+                           ttl=app.config.get('SPOTIFY_NEGATIVE_TTL', 7 * 24 * 3600))
+    features.update(found)
+
+    return [features.get(trackid) for trackid in trackids]
+
+
+async def get_all_artists(access_token, artistids, chunk_size=50):
+    """
+    Gets the artist objects for any number of artists. Artists in the catalog cache are not requested, the others are
+    requested in chunks of at most 50 artists (the limit of Spotify) that are requested concurrently.
+    :param access_token: A valid access token from the Spotify Accounts service.
+    :param artistids: A list of the Spotify IDs for the artists.
+    :param chunk_size: Number of artists per request.
+    :return: List of artist objects in the order of artistids, None for unknown artists.
+    """
+    artists = catalog_cache.get_many(ARTISTS, artistids)
+    missing = list(dict.fromkeys(artistid for artistid in artistids if artistid not in artists))
+
+    chunks = [missing[i:i + chunk_size] for i in range(0, len(missing), chunk_size)]
+    responses = await asyncio.gather(*(get_artists(access_token, chunk) for chunk in chunks))
+
+    found = {artist['id']: artist for response in responses for artist in response['artists'] if artist}
+    catalog_cache.put_many(ARTISTS, found, ttl=app.config.get('SPOTIFY_ARTIST_TTL', 24 * 3600))
+    artists.update(found)
+
+    return [artists.get(artistid) for artistid in artistids]
+
+
+async def get_recently_played(access_token, limit=50, after=None):
+    """
+    Gets tracks from the current user’s recently played tracks.
+    :param access_token: A valid access token from the Spotify Accounts service.
+    :param limit: The maximum number of items to return.
+    :param after: Unix timestamp in milliseconds, only tracks played after this moment are returned.
+    :return: Response body contains an array of play history objects
+            (wrapped in a cursor-based paging object) in JSON format.
+    """
+    return await _call(spotify.get_recently_played, access_token, limit, after)
+
+
+async def get_recommendations(access_token, recommendation_count, track_string, param_string):
+    """
+    Gets song recommendations based on the given parameters.
+    :param access_token: A valid access token from the Spotify Accounts service.
+    :param recommendation_count: The target size of the list of recommended tracks.
+    :param track_string: A comma separated list of Spotify IDs for a seed track.
+    :param param_string: For each tunable track attribute, a range on the
+                         selected track attribute’s value can be provided.
+    :return: A response body contains a recommendations response object in JSON format.
+    """
+    return await _call(spotify.get_recommendations, access_token, recommendation_count, track_string, param_string)
+
+
+def iter_playlists(userid, page_size=50):
+    """
+    Generator over the playlists of the user. The token is requested once, the first page tells the total number of
+    playlists and the remaining pages are requested concurrently, the playlists are yielded in order as the pages
+    arrive.
+    :param userid: Spotify user id of the user.
+    :param page_size: Number of playlists per request, at most 50.
+    :return: Generator of playlists.
+    """
+    access_token = spotify.get_access_token(User.get_refresh_token(userid))
+    first = spotify.get_playlists_page(access_token, 0, page_size)
+    yield from map(spotify.format_playlist, first['items'])
+
+    pages = _executor.map(partial(spotify.get_playlists_page, access_token, limit=page_size),
+                          range(page_size, first['total'], page_size))
+    for page in pages:
+        yield from map(spotify.format_playlist, page['items'])
+
+
+async def get_playlist_tracks(access_token, playlistid, page_size=100):
+    """
+    Gets all tracks of a playlist, the first page tells the total number of tracks and the remaining pages are
+    requested concurrently.
+    :param access_token: A valid access token from the Spotify Accounts service.
+    :param playlistid: The Spotify ID for the playlist.
+    :param page_size: Number of tracks per request, at most 100.
+    :return: List of tracks formatted as {'id': id, 'name': name}, local and removed tracks are left out.
+    """
+    first = await _call(spotify.get_playlist_tracks_page, access_token, playlistid, 0, page_size)
+    pages = await asyncio.gather(*(_call(spotify.get_playlist_tracks_page, access_token, playlistid, offset, page_size)
+                                   for offset in range(page_size, first['total'], page_size)))
+
+    return [item['track'] for page in [first, *pages] for item in page['items']
+            if item['track'] and item['track']['id']]
+
+
+async def get_playlists_tracks(access_token, playlistids):
+    """
+    Gets all tracks of several playlists concurrently.
+    :param access_token: A valid access token from the Spotify Accounts service.
+    :param playlistids: A list of the Spotify IDs for the playlists.
+    :return: List with the tracks of every playlist in the order of playlistids, see get_playlist_tracks.
+    """
+    return await asyncio.gather(*(get_playlist_tracks(access_token, playlistid) for playlistid in playlistids))
+
+
+async def get_catalog(access_token, trackids, artistids):
+    """
+    Gets the audio features of the tracks and the information of the artists concurrently.
+    :param access_token: A valid access token from the Spotify Accounts service.
+    :param trackids: A list of the Spotify IDs for the tracks.
+    :param artistids: A list of the Spotify IDs for the artists.
+    :return: Tuple (list of audio features in the order of trackids, list of artist objects in the order of artistids).
+    """
+    return tuple(await asyncio.gather(get_all_audio_features(access_token, trackids),
+                                      get_all_artists(access_token, artistids)))
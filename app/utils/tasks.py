@@ -20,12 +20,16 @@
            "Jelle Witsen Elias"
 """
 
-import sys
+import calendar
+import time
+from collections import Counter, defaultdict
 from datetime import datetime
 
-from app import app
-from app.utils import influx, spotify
-from app.utils.models import User, Song, Artist, Songmood, SongArtist
+import numpy as np
+
+from app.utils import history, influx, spotify, spotify_async
+from app.utils.models import User, Song, Artist, Songmood, SongArtist, SongCount, ArtistCount, MoodRollup, \
+    HourlyRollup, DailyRollup, primary
 from moodanalysis.moodAnalysis import analyse_mood
 
 
@@ -35,23 +39,58 @@ def add_artist_genres(artist_ids, access_token):
     :param artist_ids: List of artist ids.
     :param access_token: A valid access token from the Spotify Accounts service.
     """
-    if not artist_ids:
+    # Only artists that are not in the database yet are requested, known artists are kept up to date by
+    # refresh_stale_artists.
+    unknown_ids = Artist.get_unknown_ids(list(artist_ids.keys()))
+    if not unknown_ids:
         return
-    # The list of artists can be larger then 50, which is the limit of artists you can request to Spotify, so
-    # we split the artists up in chunks of maximum 50 artists.
-    n = 50
-    keys_list = list(artist_ids.keys())
-    artist_ids_chunks = [keys_list[i * n:(i + 1) * n] for i in range((len(keys_list) + n - 1) // n)]
-    for artist_ids_list in artist_ids_chunks:
-        artists_info = spotify.get_artists(access_token, artist_ids_list)
-
-        for artist_info in artists_info['artists']:
-            Artist.create_if_not_exist({
-                'artistid': artist_info['id'],
-                'name': artist_info['name'],
-                'genres': ', '.join(artist_info['genres']),
-                'popularity': artist_info['popularity']
-            })
+
+    store_artists(unknown_ids, spotify_async.run(spotify_async.get_all_artists(access_token, unknown_ids)))
+
+
+def refresh_stale_artists(access_token, max_age, limit):
+    """
+    Updates the genres and popularity of the artists that were not updated for a while, at most limit artists per
+    call so the Spotify traffic is bounded.
+    :param access_token: A valid access token from the Spotify Accounts service.
+    :param max_age: timedelta object, artists updated longer ago are refreshed.
+    :param limit: Maximum number of artists to refresh.
+    :return: Number of refreshed artists.
+    """
+    artistids = Artist.get_stale_ids(datetime.utcnow() - max_age, limit)
+    if not artistids:
+        return 0
+
+    artists = spotify_async.run(spotify_async.get_all_artists(access_token, artistids))
+    Artist.update_artists([{
+        'artistid': artist_info['id'],
+        'name': artist_info['name'],
+        'genres': ', '.join(artist_info['genres']),
+        'popularity': artist_info['popularity']
+    } for artist_info in artists if artist_info is not None],
+        [artistid for artistid, artist_info in zip(artistids, artists) if artist_info is None])
+
+    return len(artistids)
+
+
+def store_artists(artistids, artists):
+    """
+    Adds the artists with there genres to the SQL database.
+    :param artistids: List of the requested artist ids.
+    :param artists: List of artist objects in the order of artistids, None for unknown artists.
+    """
+    for artist_info in artists:
+        if artist_info is None:
+            continue
+        Artist.create_if_not_exist({
+            'artistid': artist_info['id'],
+            'name': artist_info['name'],
+            'genres': ', '.join(artist_info['genres']),
+            'popularity': artist_info['popularity']
+        })
+
+    # Unknown artists are stored as well, otherwise every ingest would request them again.
+    Artist.create_unknown([artistid for artistid, artist_info in zip(artistids, artists) if artist_info is None])
 
 
 def add_audio_features(tracks, access_token):
@@ -63,19 +102,30 @@ def add_audio_features(tracks, access_token):
     """
     if not tracks:
         return
-    track_ids = list(tracks.keys())
-    audio_features = spotify.get_audio_features(access_token, track_ids)
 
+    audio_features = spotify_async.run(spotify_async.get_all_audio_features(access_token, list(tracks.keys())))
+
+    return store_audio_features(tracks, audio_features)
+
+
+def store_audio_features(tracks, audio_features):
+    """
+    Adds the tracks with there audio features to the SQL database.
+    :param tracks: dict of the tracks formatted as {track id: {'name': name}}.
+    :param audio_features: List of audio features objects in the order of tracks, None for tracks without them.
+    :return: A list of audio features per song to be able to do mood analysis later.
+    """
+    track_ids = list(tracks.keys())
     spotify_features = ['duration_ms', 'key', 'mode', 'time_signature', 'acousticness',
                         'danceability', 'energy', 'instrumentalness', 'liveness',
                         'loudness', 'speechiness', 'valence', 'tempo']
 
     tracks_features = []
-    for i, features in enumerate(audio_features['audio_features']):
+    for i, features in enumerate(audio_features):
         track_features = {'songid': track_ids[i]}
         for feature in spotify_features:
             # Some songs do not have audio_features.
-            if not audio_features:
+            if not features:
                 track_features[feature] = None
             else:
                 # We explicitly cast these to the sure there are no type conflicts in our database.
@@ -114,14 +164,28 @@ def add_song_artist_link(song_artist_links):
         SongArtist.create_if_not_exist(link)
 
 
+def get_after_cursor(user_id):
+    """
+    Gets the cursor to fetch only the tracks the user played since the last stored listen.
+    :param user_id: Spotify user id of the user.
+    :return: Unix timestamp in milliseconds for the after parameter of Spotify, None if nothing was stored yet.
+    """
+    last_played_at = User.get_last_played_at(user_id)
+    if last_played_at is None:
+        return None
+
+    # The cursor is stored with second precision, so the rest of that second was already stored as well.
+    return (calendar.timegm(last_played_at.utctimetuple()) + 1) * 1000 - 1
+
+
 def get_latest_tracks(user_id, access_token):
     """
-    Gets the 50 most recent tracks from that the user listened to and stores multiple aspects of them.
+    Gets the tracks the user listened to since the last run (at most 50) and stores multiple aspects of them.
     :param user_id: Spotify user id of the user.
     :param access_token: A valid access token from the Spotify Accounts service.
-    :return: The 50 most recent tracks for the timescale database and there audio features for mood analysis.
+    :return: The new tracks for the timescale database and there audio features for mood analysis.
     """
-    recently_played = spotify.get_recently_played(access_token)
+    recently_played = spotify.get_recently_played(access_token, after=get_after_cursor(user_id))
 
     if not recently_played['items']:
         return None, None
@@ -141,32 +205,172 @@ def get_latest_tracks(user_id, access_token):
                                       'artistid': artist['id']})
         tracks[track['track']['id']] = {'name': track['track']['name']}
 
-    tracks_features = add_audio_features(tracks, access_token)
-    add_artist_genres(artists, access_token)
+    # The audio features and the artist chunks are independent, so they are requested concurrently.
+    # Known artists are not requested again, they are kept up to date by refresh_stale_artists.
+    unknown_artistids = Artist.get_unknown_ids(list(artists.keys()))
+    audio_features, artists_info = spotify_async.run(
+        spotify_async.get_catalog(spotify.get_app_token(), list(tracks.keys()), unknown_artistids))
+    tracks_features = store_audio_features(tracks, audio_features)
+    store_artists(unknown_artistids, artists_info)
     add_song_artist_link(track_artist_link)
 
     return latest_tracks, tracks_features
 
 
-def update_user_tracks(access_token):
+def update_user_tracks(access_token, write_buffer=None):
     """
     Gets the latest tracks the user listened to and updates the databases accordingly.
     :param access_token: A valid access token from the Spotify Accounts service.
+    :param write_buffer: Write buffer of the history store to add the tracks to, if not given they are written right
+                         away. The counters of the user are updated once the buffer has written the tracks.
     """
     user_data = spotify.get_user_info(access_token)
     tracks, tracks_features = get_latest_tracks(user_data['id'], access_token)
 
-    # If the user does not have listened to any tracks we just skip them.
+    # If the user did not listen to any new tracks we just skip them.
     current_time = datetime.now().strftime("%H:%M:%S")
 
-    client = influx.create_client(app.config['INFLUX_HOST'], app.config['INFLUX_PORT'])
     if tracks:
         update_songmoods(tracks_features)
-        client.write_points(tracks)
+        # The counters and the cursor of the user only move on once the listens are stored, so listens of a write
+        # that failed are fetched again in the next run.
+        if write_buffer is None:
+            history.get_store().add_listens(tracks)
+            add_new_listens(user_data['id'], tracks)
+        else:
+            write_buffer.add(tracks, on_write=lambda: add_new_listens(user_data['id'], tracks))
         print(f"[{current_time}] Successfully stored the data for '{user_data['display_name']}'")
     else:
-        print(f"[{current_time}] Could not find any tracks for '{user_data['display_name']}', skipping",
-              file=sys.stderr)
+        print(f"[{current_time}] No new tracks for '{user_data['display_name']}', skipping")
+
+
+def add_new_listens(userid, tracks):
+    """
+    Adds the listens that were not added before to the song and artist counters and the mood rollups of the user.
+    :param userid: Spotify user id of the user.
+    :param tracks: List of listens formatted as influx points.
+    """
+    last_played_at = User.get_last_played_at(userid)
+    # The history can be stored with second precision, so listens are compared on whole seconds.
+    new_tracks = [(influx.parse_time(track['time']).replace(microsecond=0), track['fields']['songid'])
+                  for track in tracks]
+    new_tracks = [(played_at, songid) for played_at, songid in new_tracks
+                  if last_played_at is None or played_at > last_played_at]
+
+    if not new_tracks:
+        return
+
+    songids = [songid for _, songid in new_tracks]
+    if User.get_counts_verified(userid):
+        artistids = SongArtist.get_artistids(set(songids))
+        SongCount.add_listens(userid, songids)
+        ArtistCount.add_listens(userid, [artistid for songid in songids for artistid in artistids.get(songid, [])])
+    else:
+        # Counters of users that listened before they were kept would only start at these listens, so they are
+        # counted from the history once, which already includes these listens.
+        verify_listen_counts(userid)
+
+    if User.get_rollups_verified(userid):
+        # The moods of new songs were just written, so they are read from the primary database.
+        with primary():
+            metrics = get_listen_metrics(set(songids))
+        HourlyRollup.add_totals(userid, sum_listen_metrics(
+            [(played_at.hour, songid, 1) for played_at, songid in new_tracks], metrics))
+        DailyRollup.add_totals(userid, sum_listen_metrics(
+            [(played_at.date(), songid, 1) for played_at, songid in new_tracks], metrics))
+    else:
+        # Like the counters, the rollups of users that listened before they were kept are rebuilt once.
+        rebuild_mood_rollups(userid)
+
+    User.set_last_played_at(userid, max(played_at for played_at, _ in new_tracks))
+
+
+def get_listen_metrics(songids):
+    """
+    Gets the moods and features that are rolled up for every listen.
+    :param songids: List of song ids.
+    :return: dict formatted as {songid: {metric: value}}, songs without mood are left out.
+    """
+    metrics = {}
+    for songmood, song in Song.get_songs_with_mood(list(songids)):
+        # The moods are stored on the songmood, all features on the song. Missing values count as 0.
+        source = {'excitedness': songmood, 'happiness': songmood}
+        metrics[song.songid] = {metric: getattr(source.get(metric, song), metric) or 0.0
+                                for metric in MoodRollup.metrics}
+
+    return metrics
+
+
+def sum_listen_metrics(listens, metrics):
+    """
+    Sums the moods and features of listens per bucket.
+    :param listens: List of tuples (bucket, songid, listen count).
+    :param metrics: dict formatted as {songid: {metric: value}}.
+    :return: dict formatted as {bucket: {'count': listen count, metric: sum of metric}}.
+    """
+    totals = {}
+    for bucket, songid, count in listens:
+        if songid not in metrics:
+            continue
+
+        total = totals.setdefault(bucket, dict.fromkeys(['count'] + MoodRollup.metrics, 0))
+        total['count'] += count
+        for metric, value in metrics[songid].items():
+            total[metric] += value * count
+
+    return totals
+
+
+def rebuild_mood_rollups(userid):
+    """
+    Recomputes the hourly and daily mood rollups of the user from the entire history.
+    :param userid: Spotify user id of the user.
+    """
+    store = history.get_store()
+    hours = defaultdict(Counter)
+    days = defaultdict(Counter)
+    for times, songids in store.iter_songs(userid, epoch='s', columns=True):
+        for timestamp, songid in zip(times, songids):
+            played_at = datetime.utcfromtimestamp(timestamp)
+            hours[played_at.hour][songid] += 1
+            days[played_at.date()][songid] += 1
+
+    # The moods of songs that were just ingested are read from the primary database.
+    with primary():
+        metrics = get_listen_metrics(set(songid for songs in hours.values() for songid in songs))
+
+    HourlyRollup.replace_totals(userid, sum_listen_metrics(
+        [(hour, songid, count) for hour, songs in hours.items() for songid, count in songs.items()], metrics))
+    DailyRollup.replace_totals(userid, sum_listen_metrics(
+        [(day, songid, count) for day, songs in days.items() for songid, count in songs.items()], metrics))
+    # Listens up to the latest one in the history are now included, so later ingests do not add them again.
+    User.set_last_played_at(userid, store.get_last_played_at(userid))
+    User.set_rollups_verified(userid)
+
+
+def verify_listen_counts(userid):
+    """
+    Recounts the listens of the user from the full history and corrects the song and artist counters if they
+    drifted from it.
+    :param userid: Spotify user id of the user.
+    :return: True if the counters were correct.
+    """
+    store = history.get_store()
+    song_counts = store.get_song_counts(userid)
+    artist_counts = SongArtist.count_artists(song_counts)
+
+    correct = True
+    if SongCount.get_counts(userid) != song_counts:
+        SongCount.replace_counts(userid, song_counts)
+        correct = False
+    if ArtistCount.get_counts(userid) != artist_counts:
+        ArtistCount.replace_counts(userid, artist_counts)
+        correct = False
+
+    User.set_last_played_at(userid, store.get_last_played_at(userid))
+    User.set_counts_verified(userid)
+
+    return correct
 
 
 def get_last_n_minutes(duration, userid):
@@ -175,10 +379,8 @@ def get_last_n_minutes(duration, userid):
     :param duration: Duration to generate mean mood for (i.e. 1h, 1d, 1w etc).
     :param userid: Spotify user id of the user.
     """
-    client = influx.create_client(app.config['INFLUX_HOST'], app.config['INFLUX_PORT'])
-    client.switch_database('songs')
-
-    song_history = influx.get_songs(client, userid, duration=duration)
+    store = history.get_store()
+    song_history = store.get_songs(userid, duration=duration)
 
     current_time = datetime.now().strftime("%H:%M:%S")
 
@@ -200,26 +402,121 @@ def get_last_n_minutes(duration, userid):
         mean_happiness += mood.happiness
 
     data = [{'measurement': userid,
-             'time': f"'{datetime.now().isoformat()}Z'",
+             'time': f"{datetime.utcnow().isoformat()}Z",
+             'tags': {'window': duration},
              'fields': {
                  'excitedness': mean_excitedness / song_count,
                  'happiness': mean_happiness / song_count,
                  'songcount': song_count
              }}]
 
-    client.switch_database('moods')
-    client.write_points(data)
+    store.add_moods(data)
 
     print(f'[{current_time}] updated moods for {userid}')
 
 
+def update_all_moods(durations, userids=None):
+    """
+    Updates the mean excitedness and happiness of all users with their songs in the last `duration`, for several
+    durations at once. The history of the longest duration is read with one query per shard of users, the moods
+    are looked up once and all means are written with one batched write.
+    :param durations: List of durations to generate mean moods for (i.e. ['1h', '1d', '1w']).
+    :param userids: List of Spotify user ids, defaults to all users.
+    """
+    store = history.get_store()
+    userids = userids or User.get_all_userids()
+    current_time = datetime.now().strftime("%H:%M:%S")
+
+    windows = {duration: influx.duration_seconds(duration) for duration in durations}
+    longest = max(windows, key=windows.get)
+    now = int(time.time())
+
+    moods = get_window_moods(store.get_recent_listens(userids, longest), windows, now)
+
+    if not moods:
+        print(f'[{current_time}] no recent moods found in the last {longest}')
+        return
+
+    timestamp = f"{datetime.utcfromtimestamp(now).isoformat()}Z"
+    data = [{'measurement': userid,
+             'time': timestamp,
+             'tags': {'window': window},
+             'fields': {
+                 'excitedness': excitedness,
+                 'happiness': happiness,
+                 'songcount': song_count
+             }} for userid, user_moods in moods.items()
+            for window, (excitedness, happiness, song_count) in user_moods.items()]
+
+    store.add_moods(data)
+
+    print(f'[{current_time}] updated {", ".join(durations)} moods for {len(moods)} users')
+
+
+def get_window_moods(listens, windows, now):
+    """
+    Computes the mean mood of several users for several time windows, every distinct song of a user counts once.
+    The songs are sorted per user from new to old, so every window is a prefix of them and its sums are read from
+    the prefix sums.
+    :param listens: dict formatted as {userid: ([time, ...], [songid, ...])} with times in seconds since the epoch.
+    :param windows: dict formatted as {window name: window length in seconds}.
+    :param now: End of all windows in seconds since the epoch.
+    :return: dict formatted as {userid: {window name: (mean excitedness, mean happiness, song count)}}, windows
+             without any known mood are left out.
+    """
+    latest = {}
+    for userid, (times, songids) in listens.items():
+        for played_at, songid in zip(times, songids):
+            if played_at > latest.get((userid, songid), float('-inf')):
+                latest[(userid, songid)] = played_at
+
+    moods = {mood.songid: mood for mood in Songmood.get_moods(list({songid for _, songid in latest}))
+             if mood.excitedness is not None and mood.happiness is not None}
+    pairs = [(userid, songid, played_at) for (userid, songid), played_at in latest.items() if songid in moods]
+
+    if not pairs:
+        return {}
+
+    userids = sorted({userid for userid, _, _ in pairs})
+    user_index = {userid: i for i, userid in enumerate(userids)}
+
+    # Sort on user first and on the age of the latest listen second, by combining both in one key.
+    users = np.array([user_index[userid] for userid, _, _ in pairs], dtype=np.int64)
+    ages = np.maximum(now - np.array([played_at for _, _, played_at in pairs], dtype=np.int64), 0)
+    span = int(ages.max()) + 1
+    keys = users * span + ages
+    order = np.argsort(keys, kind='mergesort')
+    keys = keys[order]
+
+    excitedness = np.concatenate(([0.0], np.cumsum([moods[pairs[i][1]].excitedness for i in order])))
+    happiness = np.concatenate(([0.0], np.cumsum([moods[pairs[i][1]].happiness for i in order])))
+
+    offsets = np.arange(len(userids), dtype=np.int64) * span
+    starts = np.searchsorted(keys, offsets)
+
+    result = {}
+    for window, seconds in windows.items():
+        # Every song of a user that is younger than the window lies between the start of the user and this end.
+        ends = np.searchsorted(keys, offsets + min(int(np.ceil(seconds)), span))
+        for i in np.nonzero(ends > starts)[0]:
+            song_count = int(ends[i] - starts[i])
+            result.setdefault(userids[i], {})[window] = (
+                float(excitedness[ends[i]] - excitedness[starts[i]]) / song_count,
+                float(happiness[ends[i]] - happiness[starts[i]]) / song_count,
+                song_count)
+
+    return result
+
+
 def update_songmoods(tracks_features):
     """
     Updates songmoods.
     :param tracks_features: List of tracks features.
     """
     songids = [track['songid'] for track in tracks_features]
-    songmoods = Songmood.get_moods(songids)
+    # A replica that lags behind misses the songmoods that were just created, which would be analysed again.
+    with primary():
+        songmoods = Songmood.get_moods(songids)
     found_ids = [songmood.songid for songmood in songmoods]
     analysis_tracks = [track for track in tracks_features if track['songid'] not in found_ids]
 
@@ -238,8 +535,14 @@ def get_features_moods(tracks):
     :param tracks: dict of tracks formatted as: {'songid': {'name': 'actual song name'}}
     :return: list of dictionaries containing features and mood per song.
     """
-    update_song_features(tracks)
-    songs = Song.get_songs(tracks.keys())
+    # The moods are read right after they are written, so the replicas might not have them yet.
+    with primary():
+        return _get_features_moods(tracks)
+
+
+def _get_features_moods(tracks):
+    """ Gather all audio features and moods for given tracks from the primary database. """
+    songs = update_song_features(tracks)
     tracks_features = []
     for song in songs:
         tracks_features.append({
@@ -303,17 +606,63 @@ def link_features_mood(tracks=None, get_responses=False):
 
 def update_song_features(tracks):
     """
-    Update the song features for the given tracks.
+    Update the song features for the given tracks, Spotify is only called for tracks that are not in the database.
     :param tracks: dict of tracks formatted as: {'songid': {'name': 'actual song name'}}
+    :return: list of song objects of the tracks.
     """
     songs = Song.get_songs(tracks.keys())
-    found_ids = [song.songid for song in songs]
-    not_found_ids = [song_id for song_id in tracks.keys() if song_id not in found_ids]
-    new_tracks = {}
+    found_ids = {song.songid for song in songs}
+    new_tracks = {song_id: track for song_id, track in tracks.items() if song_id not in found_ids}
+
+    if not new_tracks:
+        return songs
+
+    add_audio_features(new_tracks, spotify.get_app_token())
+
+    return songs + Song.get_songs(new_tracks.keys())
+
+
+def analyse_playlists(access_token, playlistids):
+    """
+    Analyses the moods of the tracks of playlists. The tracks of all playlists are paged concurrently, the audio
+    features are resolved through the catalog cache and the moods of all tracks are predicted in one batch.
+    :param access_token: A valid access token of the user from the Spotify Accounts service.
+    :param playlistids: List of Spotify playlist ids.
+    :return: dict formatted as {'excitedness': mean, 'happiness': mean, 'playlists': [{'playlistid': id,
+             'excitedness': mean, 'happiness': mean, 'track_count': count, 'tracks': [{'songid': id, 'name': name,
+             'excitedness': excitedness, 'happiness': happiness}]}]}, the moods are None when unknown.
+    """
+    playlists_tracks = spotify_async.run(spotify_async.get_playlists_tracks(access_token, playlistids))
+    trackids = list(dict.fromkeys(track['id'] for tracks in playlists_tracks for track in tracks))
+
+    audio_features = spotify_async.run(spotify_async.get_all_audio_features(spotify.get_app_token(), trackids))
+    mood_features = ['mode', 'time_signature', 'acousticness', 'danceability', 'energy', 'instrumentalness',
+                     'liveness', 'loudness', 'speechiness', 'valence', 'tempo']
+    songs = [dict({feature: float(features[feature]) for feature in mood_features}, songid=trackid)
+             for trackid, features in zip(trackids, audio_features) if features and features['danceability']]
+    moods = {mood['songid']: mood for mood in analyse_mood(songs)} if songs else {}
+
+    def mean_mood(songids):
+        scored = [moods[songid] for songid in songids if songid in moods]
+        if not scored:
+            return None, None
+        return (float(np.mean([mood['excitedness'] for mood in scored])),
+                float(np.mean([mood['happiness'] for mood in scored])))
+
+    playlists = []
+    for playlistid, tracks in zip(playlistids, playlists_tracks):
+        excitedness, happiness = mean_mood([track['id'] for track in tracks])
+        playlists.append({
+            'playlistid': playlistid,
+            'excitedness': excitedness,
+            'happiness': happiness,
+            'track_count': len(tracks),
+            'tracks': [{'songid': track['id'],
+                        'name': track['name'],
+                        'excitedness': moods.get(track['id'], {}).get('excitedness'),
+                        'happiness': moods.get(track['id'], {}).get('happiness')} for track in tracks]
+        })
 
-    for song_id in not_found_ids:
-        new_tracks[song_id] = tracks[song_id]
+    excitedness, happiness = mean_mood(trackids)
 
-    refresh_token = User.get_refresh_token('snipy12')
-    access_token = spotify.get_access_token(refresh_token)
-    add_audio_features(new_tracks, access_token)
+    return {'excitedness': excitedness, 'happiness': happiness, 'playlists': playlists}
@@ -0,0 +1,123 @@
+"""
+    tokens.py
+    ~~~~~~~~~~~~
+    This file contains the cache of access tokens, which keeps every token until shortly before it expires.
+
+    :copyright: 2019 Moodify (High-Mood)
+    :authors:
+           "Stan van den Broek",
+           "Mitchell van den Bulk",
+           "Mo Diallo",
+           "Arthur van Eeden",
+           "Elijah Erven",
+           "Henok Ghebrenigus",
+           "Jonas van der Ham",
+           "Mounir El Kirafi",
+           "Esmeralda Knaap",
+           "Youri Reijne",
+           "Siwa Sardjoemissier",
+           "Barry de Vries",
+           "Jelle Witsen Elias"
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+
+class TokenCache(object):
+    """
+    Caches access tokens in memory and, if a path is given, in a small sqlite store shared by all processes on the
+    machine. A token is only requested once at a time: other threads wait for the thread requesting it and other
+    processes for the process holding the write lock of the store. Keys are stored hashed, since they can be secrets
+    themselves.
+    """
+
+    def __init__(self, path=None, margin=60):
+        """
+        :param path: Path of the sqlite store shared across processes, None to only cache within this process.
+        :param margin: Number of seconds before expiry that a token is refreshed.
+        """
+        self.path = path
+        self.margin = margin
+        self.tokens = {}
+        self.locks = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def get(self, key, fetch):
+        """
+        Returns the cached token of key, requesting a new one if it is missing or about to expire.
+        :param key: Key of the token, i.e. the refresh token it is requested with.
+        :param fetch: Function requesting a new token, returning a tuple (access_token, expires_in).
+        :return: A valid access token.
+        """
+        key = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        token = self._fresh(self.tokens.get(key))
+        if token:
+            return token
+
+        with self._get_lock(key):
+            token = self._fresh(self.tokens.get(key))
+            if token:
+                return token
+
+            entry = self._get_shared(key, fetch) if self.path else self._fetch(fetch)
+            self.tokens[key] = entry
+
+            return entry[0]
+
+    def _get_lock(self, key):
+        with self.lock:
+            return self.locks.setdefault(key, threading.Lock())
+
+    def _fresh(self, entry):
+        """Returns the token of a (token, expires_at) entry if it does not expire within the margin."""
+        if entry and entry[1] - self.margin > time.time():
+            return entry[0]
+
+        return None
+
+    @staticmethod
+    def _fetch(fetch):
+        token, expires_in = fetch()
+        return token, time.time() + expires_in
+
+    def _connect(self):
+        """Returns the connection to the store of the current process and thread, creating it on first use."""
+        if getattr(self.local, 'pid', None) != os.getpid():
+            # The store holds secrets, so it is created readable by its owner only before sqlite opens it.
+            os.close(os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600))
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute('create table if not exists tokens '
+                               '(key text primary key, access_token text, expires_at real)')
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+
+        return self.local.connection
+
+    def _get_shared(self, key, fetch):
+        """Returns the (token, expires_at) entry of key from the store, requesting it if it is not fresh."""
+        connection = self._connect()
+        query = 'select access_token, expires_at from tokens where key = ?'
+
+        entry = connection.execute(query, (key,)).fetchone()
+        if self._fresh(entry):
+            return entry
+
+        # The write lock makes other processes wait for this request instead of requesting the same token.
+        connection.execute('begin immediate')
+        try:
+            entry = connection.execute(query, (key,)).fetchone()
+            if not self._fresh(entry):
+                entry = self._fetch(fetch)
+                connection.execute('delete from tokens where expires_at < ?', (time.time(),))
+                connection.execute('insert or replace into tokens values (?, ?, ?)', (key, *entry))
+            connection.execute('commit')
+        except Exception:
+            connection.execute('rollback')
+            raise
+
+        return tuple(entry)
@@ -28,8 +28,8 @@ from flask import send_from_directory, render_template, redirect, request, sessi
 from app import app
 from app import spotifysso
 from app.API.track_calls import TopSongs
-from app.utils import influx, spotify
-from app.utils.models import User, Song
+from app.utils import history, spotify
+from app.utils.models import User, Song, primary
 from app.utils.tasks import update_user_tracks
 
 
@@ -46,10 +46,12 @@ def index():
         return render_template("index.html", **locals())
     else:
 
-        client = influx.create_client(app.config['INFLUX_HOST'], app.config['INFLUX_PORT'])
+        store = history.get_store()
         userid = session['json_info']['id']
-        access_token = spotify.get_access_token(session['json_info']['refresh_token'])
-        all_songs = set([Song.get_song_name(song['songid']) for song in influx.get_songs(client, userid)])
+        songids = set()
+        for _, chunk in store.iter_songs(userid, columns=True):
+            songids.update(chunk)
+        all_songs = set(song.name for song in Song.get_songs(list(songids)))
 
         return render_template("dashboard.html", **locals(), text=session['json_info']['display_name'],
                                id=session['json_info']['id'], song_history=all_songs)
@@ -94,11 +96,13 @@ def authorized():
     scopes = resp['scope'].split(" ")
 
     json_user_info = spotify.get_user_info(access_token)
-    User.create_if_not_exist(json_user_info, refresh_token)
-    session['json_info'] = json_user_info
-    session['json_info']['refresh_token'] = refresh_token
+    # The new user and its tracks are read back right away, so this stays on the primary database.
+    with primary():
+        User.create_if_not_exist(json_user_info, refresh_token)
+        session['json_info'] = json_user_info
+        session['json_info']['refresh_token'] = refresh_token
 
-    update_user_tracks(access_token)
+        update_user_tracks(access_token)
 
     return redirect(url_for('index'))
 
@@ -0,0 +1,40 @@
+"""
+    backfill_mood_rollups.py
+    ~~~~~~~~~~~~
+    This file rebuilds the hourly and daily mood rollups of all users from their entire listening history. Until then
+    the mood endpoints read the history of users, or the ingest worker rebuilds their rollups on their next listens.
+
+    :copyright: 2019 Moodify (High-Mood)
+    :authors:
+           "Stan van den Broek",
+           "Mitchell van den Bulk",
+           "Mo Diallo",
+           "Arthur van Eeden",
+           "Elijah Erven",
+           "Henok Ghebrenigus",
+           "Jonas van der Ham",
+           "Mounir El Kirafi",
+           "Esmeralda Knaap",
+           "Youri Reijne",
+           "Siwa Sardjoemissier",
+           "Barry de Vries",
+           "Jelle Witsen Elias"
+"""
+
+import sys
+
+from app.utils.models import User
+from app.utils.tasks import rebuild_mood_rollups
+
+
+def main():
+    # We Limit the traceback to keep the log files clear.
+    sys.tracebacklimit = 0
+
+    for userid in User.get_all_userids():
+        rebuild_mood_rollups(userid)
+        print(f"Rebuilt the mood rollups of '{userid}'")
+
+
+if __name__ == '__main__':
+    main()
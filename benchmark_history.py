@@ -0,0 +1,120 @@
+"""
+    benchmark_history.py
+    ~~~~~~~~~~~~
+    This file compares the history stores on the query mix of the application. It stores a generated history for a
+    number of benchmark users in both stores, times every query and removes the benchmark users afterwards.
+    Set INFLUX_BACKEND to 'memory' to run it without InfluxDB.
+
+    :copyright: 2019 Moodify (High-Mood)
+    :authors:
+           "Stan van den Broek",
+           "Mitchell van den Bulk",
+           "Mo Diallo",
+           "Arthur van Eeden",
+           "Elijah Erven",
+           "Henok Ghebrenigus",
+           "Jonas van der Ham",
+           "Mounir El Kirafi",
+           "Esmeralda Knaap",
+           "Youri Reijne",
+           "Siwa Sardjoemissier",
+           "Barry de Vries",
+           "Jelle Witsen Elias"
+"""
+
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from app.utils.history import InfluxHistory, SQLHistory
+
+
+def generate_listens(userids, listen_count, song_count=2000):
+    """
+    Generates a history of listens for every user, spread over the last 30 days.
+    :param userids: List of user ids.
+    :param listen_count: Number of listens per user.
+    :param song_count: Number of distinct songs to pick from.
+    :return: List of listens formatted as influx points.
+    """
+    now = datetime.utcnow().replace(microsecond=0)
+    points = []
+    for userid in userids:
+        for seconds in sorted(random.sample(range(30 * 24 * 3600), listen_count)):
+            songid = f"song{random.randrange(song_count)}"
+            points.append({'measurement': userid,
+                           'time': f"{(now - timedelta(seconds=seconds)).isoformat()}Z",
+                           'fields': {'songid': songid}})
+
+    return points
+
+
+def get_queries(userids):
+    """
+    Returns the query mix of the application.
+    :param userids: List of user ids.
+    :return: List of tuples (name, function that runs the query on a store).
+    """
+    def full_history(store, userid):
+        return sum(len(times) for times, _ in store.iter_songs(userid, epoch='s', columns=True))
+
+    return [
+        ('history', lambda store, userid: store.get_songs(userid, 50)),
+        ('full history', full_history),
+        ('top songs', lambda store, userid: store.get_top_songs(userid, 10)),
+        ('top songs 1w', lambda store, userid: store.get_top_songs(userid, 10, '1w')),
+        ('recent listens', lambda store, userid: store.get_recent_listens(userids, '1d')),
+    ]
+
+
+def benchmark(store, userids, repeats):
+    """
+    Times every query of the query mix.
+    :param store: HistoryStore to query.
+    :param userids: List of user ids.
+    :param repeats: Number of times every query is run per user.
+    :return: dict formatted as {name: mean time in milliseconds}.
+    """
+    timings = {}
+    for name, query in get_queries(userids):
+        start = time.perf_counter()
+        for _ in range(repeats):
+            for userid in userids:
+                query(store, userid)
+        timings[name] = (time.perf_counter() - start) * 1000 / (repeats * len(userids))
+
+    return timings
+
+
+def main():
+    user_count, listen_count = int(sys.argv[1]), int(sys.argv[2])
+    repeats = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+    userids = [f"benchmark_user_{i}" for i in range(user_count)]
+    stores = {'influxdb': InfluxHistory(), 'sql': SQLHistory()}
+    points = generate_listens(userids, listen_count)
+
+    results = {}
+    try:
+        for name, store in stores.items():
+            start = time.perf_counter()
+            with store.write_buffer() as write_buffer:
+                write_buffer.add(points)
+            print(f"Stored {len(points)} listens in {name} in {time.perf_counter() - start:.2f}s")
+
+            results[name] = benchmark(store, userids, repeats)
+    finally:
+        for store in stores.values():
+            for userid in userids:
+                store.delete_history(userid)
+
+    print(f"{'query (ms)':<16}" + "".join(f"{name:>12}" for name in results))
+    for query in results['influxdb']:
+        print(f"{query:<16}" + "".join(f"{timings.get(query, 0):>12.2f}" for timings in results.values()))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2:
+        main()
+    else:
+        print('Add the size of the benchmark: benchmark_history.py <users> <listens per user> [repeats]')
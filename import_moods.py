@@ -21,16 +21,14 @@
            "Jelle Witsen Elias"
 """
 
-from app import app
 from app import db
 from app.utils import influx
 from app.utils.models import Song, Songmood
 from moodanalysis.moodAnalysis import analyse_mood
 
 if __name__ == "__main__":
-    client = influx.create_client(app.config['INFLUX_HOST'], app.config['INFLUX_PORT'])
-    client.switch_database('songs')
-    all_data = client.query('select "songid"  from /.*/').raw['series']
+    client = influx.get_client()
+    all_data = client.query('select "songid"  from /.*/', database=influx.SONGS).raw['series']
     all_values = [data['values'] for data in all_data]
     flattened_data = [x for sublist in all_values for x in sublist]
     data = [x[1] for x in flattened_data]
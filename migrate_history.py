@@ -0,0 +1,60 @@
+"""
+    migrate_history.py
+    ~~~~~~~~~~~~
+    This file copies the listening histories of all users from InfluxDB to the listens table of the sql database,
+    run it before switching HISTORY_BACKEND to 'sql'. Listens that were copied before are replaced, so it can be run
+    again to copy the listens stored in the meantime. The mean moods of every window are copied to the user_moods
+    table the same way.
+
+    :copyright: 2019 Moodify (High-Mood)
+    :authors:
+           "Stan van den Broek",
+           "Mitchell van den Bulk",
+           "Mo Diallo",
+           "Arthur van Eeden",
+           "Elijah Erven",
+           "Henok Ghebrenigus",
+           "Jonas van der Ham",
+           "Mounir El Kirafi",
+           "Esmeralda Knaap",
+           "Youri Reijne",
+           "Siwa Sardjoemissier",
+           "Barry de Vries",
+           "Jelle Witsen Elias"
+"""
+
+import sys
+
+from app.utils import influx
+from app.utils.history import InfluxHistory, SQLHistory
+from app.utils.models import User
+
+
+def main():
+    # We Limit the traceback to keep the log files clear.
+    sys.tracebacklimit = 0
+
+    source = InfluxHistory()
+    target = SQLHistory()
+    userids = sys.argv[1:] or User.get_all_userids()
+
+    for userid in userids:
+        count = 0
+        with target.write_buffer() as write_buffer:
+            for times, songids in source.iter_songs(userid, columns=True):
+                write_buffer.add([{'measurement': userid, 'time': time, 'fields': {'songid': songid}}
+                                  for time, songid in zip(times, songids)])
+                count += len(times)
+
+        moods = [{'measurement': userid, 'time': mood['time'], 'tags': {'window': window},
+                  'fields': {'excitedness': mood['excitedness'], 'happiness': mood['happiness'],
+                             'songcount': mood['songcount']}}
+                 for window, window_moods in influx.get_moods_per_window(source.client, userid).items()
+                 for mood in window_moods]
+        target.add_moods(moods)
+
+        print(f"Copied {count} listens and {len(moods)} moods of '{userid}'")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,298 @@
+"""
+    mock_spotify.py
+    ~~~~~~~~~~~~
+    This file contains a local stand-in of the Spotify Web API and Accounts service, serving a seeded synthetic
+    catalog so the workers and recommendations can be load tested without credentials or network access. Point
+    SPOTIFY_API_URL and SPOTIFY_ACCOUNTS_URL in the config to it.
+
+    :copyright: 2019 Moodify (High-Mood)
+    :authors:
+           "Stan van den Broek",
+           "Mitchell van den Bulk",
+           "Mo Diallo",
+           "Arthur van Eeden",
+           "Elijah Erven",
+           "Henok Ghebrenigus",
+           "Jonas van der Ham",
+           "Mounir El Kirafi",
+           "Esmeralda Knaap",
+           "Youri Reijne",
+           "Siwa Sardjoemissier",
+           "Barry de Vries",
+           "Jelle Witsen Elias"
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs
+
+FEATURES = ['danceability', 'energy', 'speechiness', 'acousticness', 'instrumentalness', 'liveness', 'valence']
+GENRES = ['pop', 'rock', 'hip hop', 'jazz', 'classical', 'edm', 'indie', 'metal', 'folk', 'r&b']
+# A user of the stand-in plays a track every this number of seconds.
+PLAY_INTERVAL = 210
+
+
+class MockCatalog(object):
+    """Synthetic catalog of tracks, artists, users and playlists that is the same for every run with the same seed."""
+
+    def __init__(self, seed=0, track_count=10000, artist_count=2000, playlist_count=30, playlist_size=500):
+        """
+        :param seed: Seed of the catalog.
+        :param track_count: Number of tracks.
+        :param artist_count: Number of artists.
+        :param playlist_count: Number of playlists per user.
+        :param playlist_size: Maximum number of tracks per playlist.
+        """
+        self.seed = seed
+        self.playlist_count = playlist_count
+        self.playlist_size = playlist_size
+        rng = random.Random(seed)
+
+        self.artists = {}
+        for i in range(artist_count):
+            artistid = f"mockartist{i:012d}"
+            self.artists[artistid] = {'id': artistid,
+                                      'name': f"Artist {i}",
+                                      'genres': rng.sample(GENRES, rng.randint(0, 3)),
+                                      'popularity': rng.randint(0, 100),
+                                      'type': 'artist'}
+        artistids = list(self.artists.keys())
+
+        self.tracks = {}
+        self.features = {}
+        for i in range(track_count):
+            trackid = f"mocktrack{i:013d}"
+            self.tracks[trackid] = {'id': trackid,
+                                    'name': f"Track {i}",
+                                    'artists': [{'id': artistid, 'name': self.artists[artistid]['name']}
+                                                for artistid in rng.sample(artistids, rng.randint(1, 2))],
+                                    'type': 'track'}
+            # Like on Spotify, a few tracks do not have audio features.
+            if rng.random() < 0.01:
+                self.features[trackid] = None
+                continue
+            features = {feature: round(rng.random(), 4) for feature in FEATURES}
+            features.update({'id': trackid,
+                             'duration_ms': rng.randint(90000, 420000),
+                             'key': rng.randint(0, 11),
+                             'mode': rng.randint(0, 1),
+                             'time_signature': rng.choice([3, 4, 4, 4, 5]),
+                             'loudness': round(rng.uniform(-30, 0), 3),
+                             'tempo': round(rng.uniform(60, 200), 3),
+                             'type': 'audio_features'})
+            self.features[trackid] = features
+        self.trackids = list(self.tracks.keys())
+
+    def _track(self, *key):
+        """Returns the track picked for a key, the same key always gives the same track."""
+        return self.tracks[self.trackids[random.Random(f"{self.seed}:{key}").randrange(len(self.trackids))]]
+
+    def get_user(self, userid):
+        return {'id': userid,
+                'display_name': f"Mock {userid}",
+                'email': f"{userid}@example.com",
+                'country': 'NL',
+                'product': 'premium',
+                'type': 'user'}
+
+    def get_recently_played(self, userid, limit, after=None):
+        """
+        Returns the plays of a user, the user played a track every PLAY_INTERVAL seconds since the epoch.
+        :param userid: Id of the user.
+        :param limit: Maximum number of plays.
+        :param after: Unix timestamp in milliseconds, only plays after it are returned, the oldest first.
+        :return: List of play history objects, the latest first.
+        """
+        latest = int(time.time()) // PLAY_INTERVAL
+        if after is None:
+            plays = range(latest - limit + 1, latest + 1)
+        else:
+            first = after // 1000 // PLAY_INTERVAL + 1
+            plays = range(first, min(first + limit, latest + 1))
+
+        return [{'track': self._track(userid, play),
+                 'played_at': f"{datetime.utcfromtimestamp(play * PLAY_INTERVAL).isoformat()}.000Z"}
+                for play in reversed(plays)]
+
+    def get_recommendations(self, seeds, limit):
+        return [self._track(seeds, i) for i in range(limit)]
+
+    def get_playlists(self, userid, offset, limit):
+        return [{'id': f"mockplaylist{i:04d}{userid}",
+                 'name': f"Playlist {i}",
+                 'href': '',
+                 'public': i % 2 == 0,
+                 'tracks': {'href': '', 'total': self.get_playlist_size(f"mockplaylist{i:04d}{userid}")}}
+                for i in range(offset, min(offset + limit, self.playlist_count))]
+
+    def get_playlist_size(self, playlistid):
+        return random.Random(f"{self.seed}:{playlistid}").randint(1, self.playlist_size)
+
+    def get_playlist_tracks(self, playlistid, offset, limit):
+        return [{'track': self._track(playlistid, i)}
+                for i in range(offset, min(offset + limit, self.get_playlist_size(playlistid)))]
+
+
+class Throttle(object):
+    """Decides which requests are answered with 429, randomly and above a number of requests per second."""
+
+    def __init__(self, probability=0.0, rate=0.0):
+        self.probability = probability
+        self.rate = rate
+        self.tokens = rate
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def throttled(self):
+        if random.random() < self.probability:
+            return True
+        if not self.rate:
+            return False
+
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            if self.tokens < 1:
+                return True
+            self.tokens -= 1
+            return False
+
+
+class MockSpotifyHandler(BaseHTTPRequestHandler):
+    """Answers the requests of app/utils/spotify.py from the catalog of the server."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self._handle()
+
+    def do_POST(self):
+        self._handle()
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _handle(self):
+        server = self.server
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+        if server.latency:
+            time.sleep(server.latency * random.uniform(0.5, 1.5))
+        if server.throttle.throttled():
+            return self._send(429, {'error': {'status': 429, 'message': 'API rate limit exceeded'}},
+                              {'Retry-After': str(server.retry_after)})
+
+        if url.path == '/api/token':
+            form = {key: values[0] for key, values in parse_qs(body.decode()).items()}
+            # The access token carries the user, so the other endpoints know who is calling.
+            userid = form.get('refresh_token', form.get('code', 'app'))
+            return self._send(200, {'access_token': f"mock-{userid}", 'token_type': 'Bearer', 'expires_in': 3600,
+                                    'refresh_token': userid, 'scope': ''})
+
+        authorization = self.headers.get('Authorization', '')
+        if not authorization.startswith('Bearer mock-'):
+            return self._send(401, {'error': {'status': 401, 'message': 'Invalid access token'}})
+        userid = authorization[len('Bearer mock-'):]
+
+        path = url.path.rstrip('/')
+        catalog = server.catalog
+        limit = int(query.get('limit', 20))
+        offset = int(query.get('offset', 0))
+        ids = [key for key in query.get('ids', '').split(',') if key]
+
+        if path == '/v1/me':
+            return self._send(200, catalog.get_user(userid))
+        if path == '/v1/me/player/recently-played':
+            after = int(query['after']) if 'after' in query else None
+            return self._send(200, {'items': catalog.get_recently_played(userid, min(limit, 50), after)})
+        if path == '/v1/audio-features':
+            return self._send(200, {'audio_features': [catalog.features.get(key) for key in ids[:100]]})
+        if path == '/v1/artists':
+            return self._send(200, {'artists': [catalog.artists.get(key) for key in ids[:50]]})
+        if path == '/v1/recommendations':
+            return self._send(200, {'tracks': catalog.get_recommendations(query.get('seed_tracks', ''),
+                                                                          min(limit, 100))})
+        if path == '/v1/me/playlists':
+            return self._send(200, {'items': catalog.get_playlists(userid, offset, min(limit, 50)),
+                                    'total': catalog.playlist_count})
+        if path.startswith('/v1/playlists/') and path.endswith('/tracks'):
+            playlistid = path[len('/v1/playlists/'):-len('/tracks')]
+            return self._send(200, {'items': catalog.get_playlist_tracks(playlistid, offset, min(limit, 100)),
+                                    'total': catalog.get_playlist_size(playlistid)})
+
+        self._send(404, {'error': {'status': 404, 'message': 'Service not found'}})
+
+    def _send(self, status, data, headers=None):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MockSpotifyServer(ThreadingMixIn, HTTPServer):
+    """Threaded HTTP server of the stand-in, every connection is handled in its own thread."""
+
+    daemon_threads = True
+
+    def __init__(self, address, catalog, latency=0.0, throttle=0.0, rate=0.0, retry_after=1, verbose=False):
+        """
+        :param address: Tuple (host, port), port 0 picks a free port.
+        :param catalog: MockCatalog object.
+        :param latency: Mean number of seconds every response is delayed.
+        :param throttle: Probability that a request is answered with 429.
+        :param rate: Requests per second above which requests are answered with 429, 0 for no limit.
+        :param retry_after: Number of seconds in the Retry-After header of 429 responses.
+        :param verbose: Log every request.
+        """
+        super().__init__(address, MockSpotifyHandler)
+        self.catalog = catalog
+        self.latency = latency
+        self.throttle = Throttle(throttle, rate)
+        self.retry_after = retry_after
+        self.verbose = verbose
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in of the Spotify Web API.')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic catalog')
+    parser.add_argument('--tracks', type=int, default=10000, help='number of tracks in the catalog')
+    parser.add_argument('--artists', type=int, default=2000, help='number of artists in the catalog')
+    parser.add_argument('--playlists', type=int, default=30, help='number of playlists per user')
+    parser.add_argument('--playlist-size', type=int, default=500, help='maximum number of tracks per playlist')
+    parser.add_argument('--latency', type=float, default=0.0, help='mean delay of every response in seconds')
+    parser.add_argument('--throttle', type=float, default=0.0, help='probability of a 429 response')
+    parser.add_argument('--rate', type=float, default=0.0, help='requests per second before 429 responses')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After of 429 responses in seconds')
+    parser.add_argument('--verbose', action='store_true', help='log every request')
+    args = parser.parse_args()
+
+    catalog = MockCatalog(args.seed, args.tracks, args.artists, args.playlists, args.playlist_size)
+    server = MockSpotifyServer((args.host, args.port), catalog, args.latency, args.throttle, args.rate,
+                               args.retry_after, args.verbose)
+    print(f"Mock Spotify listening on http://{args.host}:{server.server_address[1]}, set SPOTIFY_API_URL to "
+          f"'http://{args.host}:{server.server_address[1]}/v1' and SPOTIFY_ACCOUNTS_URL to "
+          f"'http://{args.host}:{server.server_address[1]}'")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -44,12 +44,12 @@ def analyse_mood(songs):
 
     input_data = []
     song_titles = []
-    to_be_skipped = []
+    to_be_skipped = set()
     for i, song in enumerate(songs):
         # Store song titles to return the later.
         song_titles.append(song['songid'])
         if not song['danceability']:
-            to_be_skipped.append(i)
+            to_be_skipped.add(i)
         else:
             # Make list matrix of input data for algorithm.
             input_data.append(np.array([song[feature] for feature in features]))
@@ -0,0 +1,49 @@
+"""
+    refresh_artists_worker.py
+    ~~~~~~~~~~~~
+    This file refreshes the genres and popularity of the artists that were not updated for a while, a limited number
+    of artists per run so the Spotify traffic stays bounded.
+
+    :copyright: 2019 Moodify (High-Mood)
+    :authors:
+           "Stan van den Broek",
+           "Mitchell van den Bulk",
+           "Mo Diallo",
+           "Arthur van Eeden",
+           "Elijah Erven",
+           "Henok Ghebrenigus",
+           "Jonas van der Ham",
+           "Mounir El Kirafi",
+           "Esmeralda Knaap",
+           "Youri Reijne",
+           "Siwa Sardjoemissier",
+           "Barry de Vries",
+           "Jelle Witsen Elias"
+"""
+
+import sys
+from datetime import timedelta
+
+import requests
+
+from app import app
+from app.utils.exceptions import CircuitOpenError
+from app.utils.spotify import get_app_token, StatusCodeError
+from app.utils.tasks import refresh_stale_artists
+
+if __name__ == '__main__':
+    # We Limit the traceback to keep the log files clear.
+    sys.tracebacklimit = 0
+
+    max_age = timedelta(days=app.config.get('ARTIST_REFRESH_DAYS', 7))
+    limit = int(sys.argv[1]) if len(sys.argv) > 1 else app.config.get('ARTIST_REFRESH_BATCH', 500)
+
+    try:
+        refreshed = refresh_stale_artists(get_app_token(), max_age, limit)
+        print(f"Refreshed {refreshed} artists")
+    except requests.exceptions.RequestException as e:
+        print(f"RequestsException: {e}", file=sys.stderr)
+    except StatusCodeError as e:
+        print(f"StatusCodeError: {e}", file=sys.stderr)
+    except CircuitOpenError as e:
+        print(f"CircuitOpenError: {e}", file=sys.stderr)
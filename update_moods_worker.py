@@ -23,21 +23,25 @@
 import sys
 
 from app.utils.models import User
-from app.utils.tasks import get_last_n_minutes
+from app.utils.tasks import get_last_n_minutes, update_all_moods
 
 
 def main():
-    duration = sys.argv[1]
+    durations = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
     # We Limit the traceback to keep the log files clear.
     sys.tracebacklimit = 0
     userids = User.get_all_userids()
 
-    for userid in userids:
-        get_last_n_minutes(duration, userid)
+    if '--per-user' in sys.argv:
+        for duration in durations:
+            for userid in userids:
+                get_last_n_minutes(duration, userid)
+    else:
+        update_all_moods(durations, userids)
 
 
 if __name__ == '__main__':
-    if len(sys.argv) == 2:
+    if [arg for arg in sys.argv[1:] if not arg.startswith('--')]:
         main()
     else:
-        print('Add duration to generate mean mood for: run.py <duration (i.e. 1h, 1d, 1w etc)>')
+        print('Add durations to generate mean moods for: run.py <durations (i.e. 1h 1d 1w etc)> [--per-user]')
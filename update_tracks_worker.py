@@ -23,22 +23,52 @@
 import sys
 
 import requests
+from sqlalchemy.exc import SQLAlchemyError
 
+from app import db
+from app.utils.exceptions import CircuitOpenError
+from app.utils.history import get_store
 from app.utils.models import User
-from app.utils.spotify import get_access_token, StatusCodeError
+from app.utils.spotify import get_access_token, get_breaker_metrics, get_metrics, StatusCodeError
 from app.utils.tasks import update_user_tracks
 
+
+def print_metrics():
+    metrics = get_metrics()
+    print(f"Spotify calls: {metrics['requests']}, throttled: {metrics['throttled']}, "
+          f"waited for the rate limiter: {metrics['limiter_waits']} times ({metrics['limiter_wait_seconds']:.1f}s)")
+    for name, breaker in get_breaker_metrics().items():
+        if breaker['failures'] or breaker['rejected']:
+            print(f"Circuit breaker '{name}' is {breaker['state']}: {breaker['failures']} failures, "
+                  f"{breaker['rejected']} rejected calls, opened {breaker['opened']} times")
+
+
 if __name__ == '__main__':
     # We Limit the traceback to keep the log files clear.
     sys.tracebacklimit = 0
 
-    # Update user tracks
-    refresh_tokens = User.get_all_tokes()
-    for refresh_token in refresh_tokens:
-        try:
-            access_token = get_access_token(refresh_token)
-            update_user_tracks(access_token)
-        except requests.exceptions.RequestException as e:
-            print(f"RequestsException: {e}", file=sys.stderr)
-        except StatusCodeError as e:
-            print(f"StatusCodeError: {e}", file=sys.stderr)
+    # Update user tracks, the tracks of all users are written to the history store in batches.
+    store = get_store()
+    try:
+        refresh_tokens = User.get_all_tokes()
+        with store.write_buffer() as write_buffer:
+            for refresh_token in refresh_tokens:
+                try:
+                    access_token = get_access_token(refresh_token)
+                    update_user_tracks(access_token, write_buffer)
+                except requests.exceptions.RequestException as e:
+                    print(f"RequestsException: {e}", file=sys.stderr)
+                except StatusCodeError as e:
+                    print(f"StatusCodeError: {e}", file=sys.stderr)
+                except CircuitOpenError as e:
+                    print(f"CircuitOpenError: {e}", file=sys.stderr)
+                except SQLAlchemyError as e:
+                    db.session.rollback()
+                    print(f"SQLAlchemyError: {e}", file=sys.stderr)
+                except store.errors as e:
+                    print(f"{type(e).__name__}: {e}", file=sys.stderr)
+    except (SQLAlchemyError,) + store.errors as e:
+        # The cursors only move once the listens are stored, so the listens that are left are fetched next run.
+        print(f"{type(e).__name__}: {e}", file=sys.stderr)
+    finally:
+        print_metrics()
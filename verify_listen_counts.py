@@ -0,0 +1,41 @@
+"""
+    verify_listen_counts.py
+    ~~~~~~~~~~~~
+    This file can be utilized as a worker to recount the top songs and artists of all users from their entire
+    history and correct the counters that are maintained on ingest. Users whose counters were not counted from
+    their history yet are read from the history by the API, running this worker backfills their counters.
+
+    :copyright: 2019 Moodify (High-Mood)
+    :authors:
+           "Stan van den Broek",
+           "Mitchell van den Bulk",
+           "Mo Diallo",
+           "Arthur van Eeden",
+           "Elijah Erven",
+           "Henok Ghebrenigus",
+           "Jonas van der Ham",
+           "Mounir El Kirafi",
+           "Esmeralda Knaap",
+           "Youri Reijne",
+           "Siwa Sardjoemissier",
+           "Barry de Vries",
+           "Jelle Witsen Elias"
+"""
+
+import sys
+
+from app.utils.models import User
+from app.utils.tasks import verify_listen_counts
+
+
+def main():
+    # We Limit the traceback to keep the log files clear.
+    sys.tracebacklimit = 0
+
+    for userid in User.get_all_userids():
+        if not verify_listen_counts(userid):
+            print(f"Corrected the listen counters of '{userid}'", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()